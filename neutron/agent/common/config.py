@@ -64,6 +64,15 @@ IPTABLES_OPTS = [
                        "generated iptables rules that describe each rule's "
                        "purpose. System must support the iptables comments "
                        "module for addition of comments.")),
+    cfg.BoolOpt('iptables_incremental_apply', default=False,
+                help=_("Keep an in-memory copy of the iptables state "
+                       "last applied by the agent and compute the "
+                       "iptables-restore commands against it, instead of "
+                       "running iptables-save on every apply. A full "
+                       "iptables-save is only done on startup, after "
+                       "an apply fails, when the security group agent "
+                       "resyncs and when an apply changes the built-in or "
+                       "shared chains, which other programs may modify.")),
 ]
 
 PROCESS_MONITOR_OPTS = [
@@ -0,0 +1,107 @@
+# Copyright 2016 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import contextlib
+import time
+
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+import six
+
+from neutron._i18n import _LE
+from neutron.common import utils as common_utils
+
+LOG = logging.getLogger(__name__)
+
+# Number of durations kept per phase to compute the percentiles
+DEFAULT_MAX_SAMPLES = 1000
+PERCENTILES = (50, 90, 99)
+
+
+def get_percentile(sorted_samples, percentile):
+    """Return the nearest-rank percentile of a sorted list of samples."""
+    if not sorted_samples:
+        return None
+    rank = int(round(percentile / 100.0 * len(sorted_samples)))
+    return sorted_samples[max(rank, 1) - 1]
+
+
+class LoopTimer(object):
+    """Measure the phases of the iterations of an agent loop.
+
+    The durations of the last samples of each phase are kept to compute
+    percentiles, along with the durations and the port counts of the last
+    completed iteration. They can be dumped to a file to be inspected
+    locally.
+    """
+
+    def __init__(self, dump_file=None, max_samples=DEFAULT_MAX_SAMPLES):
+        self.dump_file = dump_file
+        self.max_samples = max_samples
+        self._samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.max_samples))
+        self._counts = collections.Counter()
+        self._phases = collections.defaultdict(float)
+        self._last_iteration = {}
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_sample(phase, time.time() - start)
+
+    def add_sample(self, phase, elapsed):
+        self._samples[phase].append(elapsed)
+        self._counts[phase] += 1
+        # a phase might run several times in an iteration
+        self._phases[phase] += elapsed
+
+    def get_iteration_phases(self):
+        return dict(self._phases)
+
+    def complete_iteration(self, iter_num, elapsed, port_stats):
+        """Record the iteration and dump the statistics if requested."""
+        self._last_iteration = {'iteration': iter_num,
+                                'elapsed': elapsed,
+                                'phases': self.get_iteration_phases(),
+                                'port_stats': port_stats}
+        self.add_sample('iteration', elapsed)
+        self._phases = collections.defaultdict(float)
+        if self.dump_file:
+            self.dump()
+
+    def get_stats(self):
+        phases = {}
+        for phase, samples in six.iteritems(self._samples):
+            sorted_samples = sorted(samples)
+            stats = {'count': self._counts[phase],
+                     'max': sorted_samples[-1]}
+            for percentile in PERCENTILES:
+                stats['p%d' % percentile] = get_percentile(sorted_samples,
+                                                           percentile)
+            phases[phase] = stats
+        return {'phases': phases,
+                'last_iteration': self._last_iteration}
+
+    def dump(self):
+        try:
+            common_utils.replace_file(
+                self.dump_file,
+                jsonutils.dumps(self.get_stats(), indent=2, sort_keys=True))
+        except (IOError, OSError):
+            LOG.exception(_LE("Failed to dump loop timings in %s"),
+                          self.dump_file)
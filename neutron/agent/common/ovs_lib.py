@@ -44,6 +44,20 @@ UNASSIGNED_OFPORT = []
 FAILMODE_SECURE = 'secure'
 FAILMODE_STANDALONE = 'standalone'
 
+# flow_mod commands of the ovs-ofctl flow files for do_action_flows actions
+BUNDLE_FLOW_COMMANDS = {'add': 'add', 'mod': 'modify', 'del': 'delete'}
+
+# Priority of the flows added without one
+OFP_DEFAULT_PRIORITY = 32768
+
+# Fields of the ovs-ofctl dump-flows output which are not matched on
+FLOW_DUMP_FIELDS = frozenset(['cookie', 'duration', 'n_packets', 'n_bytes',
+                              'idle_age', 'hard_age', 'importance',
+                              'hard_timeout', 'idle_timeout',
+                              'send_flow_rem', 'check_overlap',
+                              'reset_counts', 'no_packet_counts',
+                              'no_byte_counts'])
+
 OPTS = [
     cfg.IntOpt('ovs_vsctl_timeout',
                default=DEFAULT_OVS_VSCTL_TIMEOUT,
@@ -178,6 +192,12 @@ class OVSBridge(BaseOVS):
         self.br_name = br_name
         self.datapath_type = datapath_type
         self.agent_uuid_stamp = 0
+        # (action, flow) tuples collected while a flow bundle is started
+        self._flow_bundle = None
+        # {table: {flow key: actions}} of the flows installed on the bridge
+        # while the flow mirror is loaded, see load_flow_mirror
+        self._flow_mirror = None
+        self._claimed_flows = set()
 
     def set_agent_uuid_stamp(self, val):
         self.agent_uuid_stamp = val
@@ -248,6 +268,9 @@ class OVSBridge(BaseOVS):
         self.ovsdb.del_port(port_name, self.br_name).execute()
 
     def run_ofctl(self, cmd, args, process_input=None):
+        if self._flow_bundle:
+            # the collected flows must be applied before any other command
+            self.apply_flow_bundle()
         full_args = ["ovs-ofctl", cmd, self.br_name] + args
         try:
             return utils.execute(full_args, run_as_root=True,
@@ -263,6 +286,9 @@ class OVSBridge(BaseOVS):
 
     def remove_all_flows(self):
         self.run_ofctl("del-flows", [])
+        if self._flow_mirror is not None:
+            self._flow_mirror.clear()
+            self._claimed_flows.clear()
 
     @_ofport_retry
     def _get_port_ofport(self, port_name):
@@ -278,6 +304,41 @@ class OVSBridge(BaseOVS):
                           port_name)
         return ofport
 
+    def _get_ports_ofports(self, port_names):
+        ofports = dict.fromkeys(port_names, UNASSIGNED_OFPORT)
+        ofports.update(
+            (port['name'], port['ofport'])
+            for port in self.get_ports_attributes(
+                'Interface', columns=['name', 'ofport'], ports=port_names,
+                if_exists=True))
+        return ofports
+
+    def get_ports_ofports(self, port_names):
+        """Get the ports' assigned ofports, retrying until all are assigned.
+
+        :returns: a dict of the ofports by port name, INVALID_OFPORT for the
+                  ports without one.
+        """
+        get_ports_ofports = retrying.retry(
+            retry_on_result=lambda ofports: any(
+                _ofport_result_pending(ofport)
+                for ofport in ofports.values()),
+            stop_max_delay=self.vsctl_timeout * 1000,
+            wait_exponential_multiplier=10,
+            wait_exponential_max=1000,
+            retry_on_exception=lambda _: False)(self._get_ports_ofports)
+        try:
+            ofports = get_ports_ofports(port_names)
+        except retrying.RetryError as e:
+            ofports = e.last_attempt.value
+            LOG.error(_LE("Timed out retrieving ofport on ports %s."),
+                      [port_name for port_name, ofport in
+                       six.iteritems(ofports)
+                       if _ofport_result_pending(ofport)])
+        return {port_name: (INVALID_OFPORT if _ofport_result_pending(ofport)
+                            else ofport)
+                for port_name, ofport in six.iteritems(ofports)}
+
     def get_datapath_id(self):
         return self.db_get_val('Bridge',
                                self.br_name, 'datapath_id')
@@ -288,8 +349,116 @@ class OVSBridge(BaseOVS):
                 if 'cookie' not in kw:
                     kw['cookie'] = self.agent_uuid_stamp
         flow_strs = [_build_flow_expr_str(kw, action) for kw in kwargs_list]
+        if self._flow_mirror is not None:
+            flow_strs = self._update_flow_mirror(action, flow_strs)
+            if not flow_strs:
+                return
+        if self._flow_bundle is not None:
+            self._flow_bundle.extend(
+                (action, flow_str) for flow_str in flow_strs)
+            return
         self.run_ofctl('%s-flows' % action, ['-'], '\n'.join(flow_strs))
 
+    def load_flow_mirror(self):
+        """Mirror the flows installed on the bridge.
+
+        Until stop_flow_mirror is called, adding a flow which is installed
+        with the same actions is skipped. The installed flow is claimed
+        instead, so that a cleanup of the flows with another cookie can
+        keep it. Flows with a timeout are not mirrored.
+        """
+        self._flow_mirror = collections.defaultdict(dict)
+        self._claimed_flows = set()
+        for flow_str in self.dump_all_flows():
+            flow_key = get_flow_key(flow_str)
+            if flow_key:
+                self._flow_mirror[flow_key[0]][flow_key] = (
+                    _get_flow_actions(flow_str))
+
+    def stop_flow_mirror(self):
+        """Stop mirroring the flows and return the claimed flow keys."""
+        claimed_flows = self._claimed_flows
+        self._flow_mirror = None
+        self._claimed_flows = set()
+        return claimed_flows
+
+    def _update_flow_mirror(self, action, flow_strs):
+        """Update the mirror and return the flows to apply on the bridge."""
+        if action != 'add':
+            for flow_str in flow_strs:
+                self._forget_mirrored_flows(flow_str)
+            return flow_strs
+        missing_flow_strs = []
+        for flow_str in flow_strs:
+            flow_key = get_flow_key(flow_str)
+            if flow_key:
+                actions = _get_flow_actions(flow_str)
+                table_flows = self._flow_mirror[flow_key[0]]
+                if table_flows.get(flow_key) == actions:
+                    self._claimed_flows.add(flow_key)
+                    continue
+                table_flows[flow_key] = actions
+                self._claimed_flows.discard(flow_key)
+            missing_flow_strs.append(flow_str)
+        return missing_flow_strs
+
+    def _forget_mirrored_flows(self, flow_str):
+        # forget all the flows that a modification or deletion might
+        # affect, unless their fields can't match the given ones
+        table = None
+        fields = {}
+        for name, value in _split_flow_str(flow_str)[0]:
+            if name == 'table':
+                table = _normalize_flow_value(value)
+            elif name not in FLOW_DUMP_FIELDS:
+                fields[name] = _normalize_flow_value(value)
+        if table is None:
+            tables = list(self._flow_mirror.values())
+        else:
+            tables = [self._flow_mirror.get(table, {})]
+        for table_flows in tables:
+            for flow_key in list(table_flows):
+                if not _flow_fields_conflict(fields, dict(flow_key[2])):
+                    del table_flows[flow_key]
+                    self._claimed_flows.discard(flow_key)
+
+    def start_flow_bundle(self):
+        """Collect the flow modifications until stop_flow_bundle is called.
+
+        The collected flows are applied in order with a single atomic
+        'ovs-ofctl --bundle' call, which requires OpenFlow 1.4 to be enabled
+        on the bridge. Any other ovs-ofctl command applies them first.
+        """
+        if self._flow_bundle is None:
+            self._flow_bundle = []
+
+    def apply_flow_bundle(self):
+        """Apply the flows collected so far and keep collecting."""
+        action_flows = self._flow_bundle
+        if not action_flows:
+            return
+        self._flow_bundle = []
+        flow_strs = ['%s %s' % (BUNDLE_FLOW_COMMANDS[action], flow_str)
+                     for action, flow_str in action_flows]
+        if self.run_ofctl('add-flows', ['--bundle', '-'],
+                          '\n'.join(flow_strs)) is not None:
+            return
+        # nothing of a failed bundle is applied, find out the failing flows
+        LOG.warning(_LW("Flow bundle of %(count)d flows failed on bridge "
+                        "%(bridge)s, applying the flows one by one"),
+                    {'count': len(action_flows), 'bridge': self.br_name})
+        for action, flow_str in action_flows:
+            if self.run_ofctl('%s-flows' % action, ['-'], flow_str) is None:
+                LOG.error(_LE("Unable to %(action)s flow %(flow)s on bridge "
+                              "%(bridge)s"),
+                          {'action': action, 'flow': flow_str,
+                           'bridge': self.br_name})
+
+    def stop_flow_bundle(self):
+        """Apply the flows collected so far and stop collecting."""
+        self.apply_flow_bundle()
+        self._flow_bundle = None
+
     def add_flow(self, **kwargs):
         self.do_action_flows('add', [kwargs])
 
@@ -320,6 +489,34 @@ class OVSBridge(BaseOVS):
                         vxlan_udp_port=p_const.VXLAN_UDP_PORT,
                         dont_fragment=True,
                         tunnel_csum=False):
+        attrs = self._get_tunnel_port_attrs(remote_ip, local_ip, tunnel_type,
+                                            vxlan_udp_port, dont_fragment,
+                                            tunnel_csum)
+        return self.add_port(port_name, *attrs)
+
+    def add_tunnel_ports(self, tunnels, local_ip,
+                         tunnel_type=p_const.TYPE_GRE,
+                         vxlan_udp_port=p_const.VXLAN_UDP_PORT,
+                         dont_fragment=True,
+                         tunnel_csum=False):
+        """Add tunnel ports in a single transaction.
+
+        :param tunnels: a dict of the remote IPs by port name.
+        :returns: a dict of the ofports by port name, INVALID_OFPORT for the
+                  ports which failed to get one.
+        """
+        with self.ovsdb.transaction() as txn:
+            for port_name, remote_ip in six.iteritems(tunnels):
+                attrs = self._get_tunnel_port_attrs(
+                    remote_ip, local_ip, tunnel_type, vxlan_udp_port,
+                    dont_fragment, tunnel_csum)
+                txn.add(self.ovsdb.add_port(self.br_name, port_name))
+                txn.add(self.ovsdb.db_set('Interface', port_name, *attrs))
+        return self.get_ports_ofports(list(tunnels))
+
+    @staticmethod
+    def _get_tunnel_port_attrs(remote_ip, local_ip, tunnel_type,
+                               vxlan_udp_port, dont_fragment, tunnel_csum):
         attrs = [('type', tunnel_type)]
         # TODO(twilson) This is an OrderedDict solely to make a test happy
         options = collections.OrderedDict()
@@ -337,8 +534,7 @@ class OVSBridge(BaseOVS):
         if tunnel_csum:
             options['csum'] = str(tunnel_csum).lower()
         attrs.append(('options', options))
-
-        return self.add_port(port_name, *attrs)
+        return attrs
 
     def add_patch_port(self, local_name, remote_name):
         attrs = [('type', 'patch'),
@@ -370,6 +566,13 @@ class OVSBridge(BaseOVS):
     def get_ports_attributes(self, table, columns=None, ports=None,
                              check_error=True, log_errors=True,
                              if_exists=False):
+        if not ports:
+            # read from the local copy of the database if there is one
+            cmd = self.ovsdb.list_bridge_rows(self.br_name, table,
+                                              columns=columns)
+            if cmd is not None:
+                return cmd.execute(check_error=check_error,
+                                   log_errors=log_errors)
         port_names = ports or self.get_port_name_list()
         if not port_names:
             return []
@@ -589,7 +792,8 @@ class DeferredOVSBridge(object):
     This class is not thread-safe, that's why for every use a new instance
     must be implemented.
     '''
-    ALLOWED_PASSTHROUGHS = 'add_port', 'add_tunnel_port', 'delete_port'
+    ALLOWED_PASSTHROUGHS = ('add_port', 'add_tunnel_port', 'add_tunnel_ports',
+                            'delete_port')
 
     def __init__(self, br, full_ordered=False,
                  order=('add', 'mod', 'del')):
@@ -648,6 +852,68 @@ class DeferredOVSBridge(object):
                           self.br.br_name)
 
 
+def _split_flow_str(flow_str):
+    """Return the (name, value) fields and the actions of a flow string."""
+    match, _sep, actions = flow_str.partition('actions=')
+    fields = [field.strip().partition('=')[::2]
+              for field in match.split(',')]
+    return [field for field in fields if field[0]], actions.strip()
+
+
+def _normalize_flow_value(value):
+    value = value.lower()
+    try:
+        return str(int(value, 0))
+    except ValueError:
+        return value
+
+
+def _get_flow_actions(flow_str):
+    return _split_flow_str(flow_str)[1].lower()
+
+
+def _flow_fields_conflict(fields, other_fields):
+    """Return True if no packet can match both flow fields."""
+    for name, value in six.iteritems(fields):
+        other_value = other_fields.get(name)
+        if (other_value is not None and other_value != value and
+                value.isdigit() and other_value.isdigit()):
+            return True
+    return False
+
+
+def get_flow_key(flow_str):
+    """Return the (table, priority, match) key of a flow.
+
+    :param flow_str: a line of the ovs-ofctl dump-flows output or a flow
+                     built for ovs-ofctl add-flows.
+    :returns: a hashable key, identical for both representations of the
+              same flow, or None for a flow with a timeout.
+    """
+    table = '0'
+    priority = str(OFP_DEFAULT_PRIORITY)
+    match = []
+    for name, value in _split_flow_str(flow_str)[0]:
+        value = _normalize_flow_value(value)
+        if name in ('hard_timeout', 'idle_timeout'):
+            if value != '0':
+                return
+        elif name == 'table':
+            table = value
+        elif name == 'priority':
+            priority = value
+        elif name not in FLOW_DUMP_FIELDS:
+            match.append((name, value))
+    return table, priority, frozenset(match)
+
+
+def get_flow_match_str(flow_str):
+    """Return the match of a dumped flow for ovs-ofctl --strict."""
+    return ','.join('%s=%s' % field if field[1] else field[0]
+                    for field in _split_flow_str(flow_str)[0]
+                    if field[0] not in FLOW_DUMP_FIELDS)
+
+
 def _build_flow_expr_str(flow_dict, cmd):
     flow_expr_arr = []
     actions = None
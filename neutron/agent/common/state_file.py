@@ -0,0 +1,89 @@
+# Copyright 2016 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+import six
+
+from neutron._i18n import _LE, _LW
+from neutron.common import utils as common_utils
+
+LOG = logging.getLogger(__name__)
+
+
+class StateFile(object):
+    """A JSON file holding state an agent keeps across its restarts.
+
+    The state is a dict of entries, each of them a dict, stored under a
+    single key of the file. The file is replaced atomically, so that a
+    restarted agent never reads a partially written state, and only when
+    the entries changed since they were last read or written.
+    """
+
+    def __init__(self, path, key, entry_keys=()):
+        self.path = path
+        self.key = key
+        # keys every entry must have to be loaded
+        self.entry_keys = entry_keys
+        # last state read from or written to the file
+        self._state = None
+
+    def load(self):
+        """Return the entries of the file.
+
+        An empty dict is returned if there is no file. The content of a
+        file which is not the expected JSON document is ignored, and so
+        are the entries without the expected keys.
+        """
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                state = jsonutils.loads(f.read())
+        except IOError:
+            # nothing was persisted yet
+            return {}
+        except ValueError:
+            state = None
+        if (not isinstance(state, dict) or
+                not isinstance(state.get(self.key), dict)):
+            LOG.warning(_LW("Ignoring invalid state file %s"), self.path)
+            return {}
+        entries = {}
+        for name, entry in six.iteritems(state[self.key]):
+            if (not isinstance(entry, dict) or
+                    not all(key in entry for key in self.entry_keys)):
+                LOG.warning(_LW("Ignoring invalid entry %(name)s of state "
+                                "file %(path)s"),
+                            {'name': name, 'path': self.path})
+                continue
+            entries[name] = entry
+        self._state = {self.key: entries}
+        return copy.deepcopy(entries)
+
+    def save(self, entries):
+        """Persist the entries if they changed."""
+        if not self.path:
+            return
+        state = {self.key: entries}
+        if state == self._state:
+            return
+        try:
+            common_utils.replace_file(self.path, jsonutils.dumps(state))
+        except (IOError, OSError):
+            LOG.exception(_LE("Failed to persist state in %s"), self.path)
+            return
+        self._state = copy.deepcopy(state)
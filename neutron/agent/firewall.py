@@ -126,6 +126,25 @@ class FirewallDriver(object):
         """
         raise NotImplementedError()
 
+    def apply_security_group_members(self, devices, security_groups,
+                                     security_group_member_ips):
+        """Apply new remote group members without refreshing the ports.
+
+        Drivers which can update the members of the remote security groups
+        in place, when neither the devices nor the rules of their security
+        groups changed, do so and return True. Otherwise, and by default,
+        False is returned and the filters of the devices must be updated.
+        """
+        return False
+
+    def invalidate_saved_state(self):
+        """Forget the state of the host cached by the driver.
+
+        It is called when the agent resyncs with the plugin, the firewall
+        may have been changed behind the driver's back. It does nothing by
+        default.
+        """
+
 
 class NoopFirewallDriver(FirewallDriver):
     """Noop Firewall Driver.
@@ -11,6 +11,9 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import collections
+
+import eventlet
 import netaddr
 from oslo_log import log as logging
 
@@ -21,12 +24,24 @@ LOG = logging.getLogger(__name__)
 
 
 class IpConntrackManager(object):
-    """Smart wrapper for ip conntrack."""
+    """Smart wrapper for ip conntrack.
+
+    Conntrack deletions are queued, de-duplicated and run zone by zone.
+    With async_purge the queue is drained by a greenthread, so callers
+    don't wait for the conntrack processes; otherwise it is drained
+    before each delete_conntrack_state_* call returns.
+    """
 
-    def __init__(self, zone_lookup_func, execute=None, namespace=None):
+    def __init__(self, zone_lookup_func, execute=None, namespace=None,
+                 async_purge=False):
         self.get_device_zone = zone_lookup_func
         self.execute = execute or linux_utils.execute
         self.namespace = namespace
+        self.async_purge = async_purge
+        # (zone, cmd) -> cmd, in the order the deletions were requested
+        self._pending = collections.OrderedDict()
+        self._worker_running = False
+        self._stats = {'purged': 0, 'failed': 0, 'deduplicated': 0}
 
     @staticmethod
     def _generate_conntrack_cmd_by_rule(rule, namespace):
@@ -59,23 +74,72 @@ class IpConntrackManager(object):
                 if remote_ip and str(
                         netaddr.IPNetwork(remote_ip).version) in ethertype:
                     ip_cmd.extend(['-s', str(remote_ip)])
-                conntrack_cmds.append(cmd + ip_cmd)
+                conntrack_cmds.append((zone_id, cmd + ip_cmd))
         return conntrack_cmds
 
     def _delete_conntrack_state(self, device_info_list, rule, remote_ip=None):
         conntrack_cmds = self._get_conntrack_cmds(device_info_list,
                                                   rule, remote_ip)
-        for cmd in conntrack_cmds:
-            try:
-                self.execute(cmd, run_as_root=True,
-                             check_exit_code=True,
-                             extra_ok_codes=[1])
-            except RuntimeError:
-                LOG.exception(
-                    _LE("Failed execute conntrack command %s"), str(cmd))
+        for zone_id, cmd in conntrack_cmds:
+            key = (zone_id, tuple(cmd))
+            if key in self._pending:
+                self._stats['deduplicated'] += 1
+                continue
+            self._pending[key] = cmd
+
+    def _execute_conntrack_cmd(self, cmd):
+        try:
+            self.execute(cmd, run_as_root=True,
+                         check_exit_code=True,
+                         extra_ok_codes=[1])
+            self._stats['purged'] += 1
+        except RuntimeError:
+            self._stats['failed'] += 1
+            LOG.exception(
+                _LE("Failed execute conntrack command %s"), str(cmd))
+
+    def _pop_zone_batches(self):
+        """Pop the pending deletions, grouped by zone."""
+        batches = collections.OrderedDict()
+        for (zone_id, _cmd), cmd in self._pending.items():
+            batches.setdefault(zone_id, []).append(cmd)
+        self._pending.clear()
+        return batches
+
+    def _process_pending(self):
+        while self._pending:
+            for zone_id, cmds in self._pop_zone_batches().items():
+                LOG.debug("Purging %(count)d conntrack entries of zone "
+                          "%(zone)s", {'count': len(cmds), 'zone': zone_id})
+                for cmd in cmds:
+                    self._execute_conntrack_cmd(cmd)
+                if self.async_purge:
+                    # let the agent loop run between zones
+                    eventlet.sleep(0)
+
+    def _purge_worker(self):
+        try:
+            self._process_pending()
+        finally:
+            self._worker_running = False
+
+    def _schedule_purge(self):
+        if not self.async_purge:
+            self._process_pending()
+        elif not self._worker_running:
+            self._worker_running = True
+            eventlet.spawn_n(self._purge_worker)
+
+    def get_queue_stats(self):
+        """Return the conntrack purge queue depth and counters."""
+        stats = dict(self._stats)
+        stats['pending'] = len(self._pending)
+        stats['zones_pending'] = len(set(key[0] for key in self._pending))
+        return stats
 
     def delete_conntrack_state_by_rule(self, device_info_list, rule):
         self._delete_conntrack_state(device_info_list, rule)
+        self._schedule_purge()
 
     def delete_conntrack_state_by_remote_ips(self, device_info_list,
                                              ethertype, remote_ips):
@@ -86,3 +150,4 @@ class IpConntrackManager(object):
                     device_info_list, rule, remote_ip)
         else:
             self._delete_conntrack_state(device_info_list, rule)
+        self._schedule_purge()
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 from oslo_log import log as logging
 from oslo_utils import excutils
 
@@ -85,3 +86,99 @@ class IPMonitor(async_process.AsyncProcess):
 
     def stop(self):
         super(IPMonitor, self).stop(block=True)
+
+
+class IPLinkMonitorEvent(object):
+    def __init__(self, line, added, interface):
+        self.line = line
+        self.added = added
+        self.interface = interface
+
+    def __str__(self):
+        return self.line
+
+    @classmethod
+    def from_text(cls, line):
+        link = line.split()
+
+        try:
+            first_word = link[0]
+        except IndexError:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Unable to parse link "%s"'), line)
+
+        added = (first_word != 'Deleted')
+        if not added:
+            link = link[1:]
+
+        try:
+            interface = ip_lib.remove_interface_suffix(link[1].rstrip(':'))
+        except IndexError:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE('Unable to parse link "%s"'), line)
+
+        return cls(line, added, interface)
+
+
+class IPLinkMonitor(async_process.AsyncProcess):
+    """Wrapper over `ip monitor link`.
+
+    The has_updates property indicates whether links have been created,
+    changed or deleted since the monitor started or since the previous call
+    to get_events. As the kernel notifies the changes of existing links too,
+    the 'added' links might have existed before.
+    """
+
+    def __init__(self,
+                 namespace=None,
+                 run_as_root=True,
+                 respawn_interval=None):
+        super(IPLinkMonitor, self).__init__(['ip', '-o', 'monitor', 'link'],
+                                            run_as_root=run_as_root,
+                                            respawn_interval=respawn_interval,
+                                            namespace=namespace)
+        self.new_events = {'added': set(), 'removed': set()}
+
+    @property
+    def has_updates(self):
+        """Indicate whether links have been updated.
+
+        Always True if the monitor process is not active, as it can't
+        communicate any update. This situation should be temporary if
+        respawn_interval is set.
+        """
+        if not self.is_active():
+            LOG.error(_LE("Link monitor is not active"))
+            return True
+        self.process_events()
+        return bool(self.new_events['added'] or self.new_events['removed'])
+
+    def get_events(self):
+        self.process_events()
+        events = self.new_events
+        self.new_events = {'added': set(), 'removed': set()}
+        return events
+
+    def process_events(self):
+        for line in self.iter_stdout():
+            self._process_line(line)
+
+    def _process_line(self, line):
+        try:
+            event = IPLinkMonitorEvent.from_text(line)
+        except IndexError:
+            return
+        if event.added:
+            self.new_events['added'].add(event.interface)
+            self.new_events['removed'].discard(event.interface)
+        else:
+            self.new_events['removed'].add(event.interface)
+            self.new_events['added'].discard(event.interface)
+
+    def wait_for_events(self, timeout):
+        """Wait at most timeout seconds for a link update."""
+        try:
+            line = self._stdout_lines.get(timeout=timeout)
+        except eventlet.queue.Empty:
+            return
+        self._process_line(line)
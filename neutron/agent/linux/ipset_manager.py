@@ -14,6 +14,7 @@
 import copy
 
 import netaddr
+from oslo_utils import excutils
 
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
@@ -29,12 +30,19 @@ class IpsetManager(object):
 
        Keeps track of ip addresses per set, using bulk
        or single ip add/remove for smaller changes.
+
+       Between defer_apply_on() and defer_apply_off() membership changes
+       to every set are queued and then applied with a single
+       'ipset restore' call.
     """
 
     def __init__(self, execute=None, namespace=None):
         self.execute = execute or linux_utils.execute
         self.namespace = namespace
         self.ipset_sets = {}
+        self._defer_apply = False
+        self._deferred_input = []
+        self._deferred_sets = set()
 
     def _sanitize_addresses(self, addresses):
         """This method converts any address to ipset format.
@@ -84,9 +92,36 @@ class IpsetManager(object):
             return
         self.set_members_mutate(set_name, ethertype, member_ips)
 
+    def defer_apply_on(self):
+        self._defer_apply = True
+
+    def defer_apply_off(self):
+        self._defer_apply = False
+        self._apply_deferred()
+
+    @utils.synchronized('ipset', external=True)
+    def _apply_deferred(self):
+        self._flush_deferred_input()
+
+    def _flush_deferred_input(self):
+        if not self._deferred_input:
+            return
+        process_input, self._deferred_input = self._deferred_input, []
+        set_names, self._deferred_sets = self._deferred_sets, set()
+        try:
+            self._restore_sets(process_input)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # we don't know what made it to the kernel, forget about
+                # these sets so the next update creates them again
+                for set_name in set_names:
+                    self.ipset_sets.pop(set_name, None)
+
     @utils.synchronized('ipset', external=True)
     def set_members_mutate(self, set_name, ethertype, member_ips):
-        if not self.set_name_exists(set_name):
+        if self._defer_apply:
+            self._queue_set_members(set_name, ethertype, member_ips)
+        elif not self.set_name_exists(set_name):
             # The initial creation is handled with create/refresh to
             # avoid any downtime for existing sets (i.e. avoiding
             # a flush/restore), as the restore operation of ipset is
@@ -106,9 +141,44 @@ class IpsetManager(object):
             else:
                 self._refresh_set(set_name, member_ips, ethertype)
 
+    def _queue_set_members(self, set_name, ethertype, member_ips):
+        """Queue the restore input bringing set_name to member_ips.
+
+        The same create/swap sequence as the non deferred path is used,
+        just expressed as 'ipset restore' commands.
+        """
+        set_type = self._get_ipset_set_type(ethertype)
+        if not self.set_name_exists(set_name):
+            # a set left behind in the kernel is swapped, not added to
+            self._deferred_input.append(
+                "create %s hash:net family %s" % (set_name, set_type))
+            swap = True
+        else:
+            add_ips = self._get_new_set_ips(set_name, member_ips)
+            del_ips = self._get_deleted_set_ips(set_name, member_ips)
+            swap = (len(add_ips) + len(del_ips) >= IPSET_ADD_BULK_THRESHOLD)
+        if swap:
+            new_set_name = set_name + SWAP_SUFFIX
+            self._deferred_input.append(
+                "create %s hash:net family %s" % (new_set_name, set_type))
+            self._deferred_input.extend(
+                "add %s %s" % (new_set_name, ip) for ip in member_ips)
+            self._deferred_input.append(
+                "swap %s %s" % (new_set_name, set_name))
+            self._deferred_input.append("destroy %s" % new_set_name)
+        else:
+            self._deferred_input.extend(
+                "add %s %s" % (set_name, ip) for ip in add_ips)
+            self._deferred_input.extend(
+                "del %s %s" % (set_name, ip) for ip in del_ips)
+        self.ipset_sets[set_name] = copy.copy(member_ips)
+        self._deferred_sets.add(set_name)
+
     @utils.synchronized('ipset', external=True)
     def destroy(self, id, ethertype, forced=False):
         set_name = self.get_name(id, ethertype)
+        # queued commands may still reference the set
+        self._flush_deferred_input()
         self._destroy(set_name, forced)
 
     def _add_member_to_set(self, set_name, member_ip):
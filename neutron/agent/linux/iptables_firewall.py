@@ -14,6 +14,8 @@
 #    under the License.
 
 import collections
+import copy
+import hashlib
 import re
 
 import netaddr
@@ -21,7 +23,7 @@ from oslo_config import cfg
 from oslo_log import log as logging
 import six
 
-from neutron._i18n import _LI
+from neutron._i18n import _LI, _LW
 from neutron.agent import firewall
 from neutron.agent.linux import ip_conntrack
 from neutron.agent.linux import ipset_manager
@@ -45,6 +47,13 @@ DIRECTION_IP_PREFIX = {firewall.INGRESS_DIRECTION: 'source_ip_prefix',
                        firewall.EGRESS_DIRECTION: 'dest_ip_prefix'}
 IPSET_DIRECTION = {firewall.INGRESS_DIRECTION: 'src',
                    firewall.EGRESS_DIRECTION: 'dst'}
+# prefixes of the chains shared by the ports of a security group
+SG_CHAIN_NAME_PREFIX = {firewall.INGRESS_DIRECTION: 'gi',
+                        firewall.EGRESS_DIRECTION: 'go'}
+# packet mark bit set by a shared security group chain on a match
+SG_MATCH_MARK = '0x40000000'
+# chain setting SG_MATCH_MARK, the shared chains go to it on a match
+SG_MATCH_CHAIN = 'sg-match'
 # length of all device prefixes (e.g. qvo, tap, qvb)
 LINUX_DEV_PREFIX_LEN = 3
 LINUX_DEV_LEN = 14
@@ -70,7 +79,8 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         # driver composed over this one
         self.ipset = ipset_manager.IpsetManager(namespace=namespace)
         self.ipconntrack = ip_conntrack.IpConntrackManager(
-            self.get_device_zone, namespace=namespace)
+            self.get_device_zone, namespace=namespace,
+            async_purge=cfg.CONF.SECURITYGROUP.async_conntrack_purge)
         self._populate_initial_zone_map()
         # list of port which has security group
         self.filtered_ports = {}
@@ -91,6 +101,27 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self.updated_rule_sg_ids = set()
         self.updated_sg_members = set()
         self.devices_with_updated_sg_members = collections.defaultdict(list)
+        # chains set up for the filtered ports, device -> (fingerprint of
+        # what they were set up from, security group ids of the port,
+        # ids of the security groups they depend on)
+        self._port_chains = {}
+        # devices whose chains depend on a security group, sg id -> devices
+        self._sg_devices = collections.defaultdict(set)
+        # ports and security groups updated since the chains were set up
+        self._changed_devices = set()
+        self._changed_sg_ids = set()
+        self._sg_chain_set_up = False
+        self._sg_fingerprints = {}
+        self.shared_sg_chains = cfg.CONF.SECURITYGROUP.shared_sg_chains
+        if self.shared_sg_chains and not self.enable_ipset:
+            # without ipset the addresses of each port must be left out of
+            # its remote group rules, which can't be shared
+            LOG.warning(_LW("shared_sg_chains requires enable_ipset, the "
+                            "security group rules are not shared"))
+            self.shared_sg_chains = False
+        # shared security group chains currently set up,
+        # name -> (sg id, direction, fingerprint of the chain rules)
+        self._sg_chains = {}
 
     def _enable_netfilter_for_bridges(self):
         # we only need to set these values once, but it has to be when
@@ -141,15 +172,61 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
     def update_security_group_rules(self, sg_id, sg_rules):
         LOG.debug("Update rules of security group (%s)", sg_id)
         self.sg_rules[sg_id] = sg_rules
+        self._changed_sg_ids.add(sg_id)
 
     def update_security_group_members(self, sg_id, sg_members):
         LOG.debug("Update members of security group (%s)", sg_id)
         self.sg_members[sg_id] = collections.defaultdict(list, sg_members)
+        self._changed_sg_ids.add(sg_id)
+
+    def apply_security_group_members(self, devices, security_groups,
+                                     security_group_member_ips):
+        """Update the remote group ipsets in place when possible.
+
+        With ipset the port chains only reference the sets of the remote
+        groups, so as long as the ports, the rules and the referenced sets
+        stay the same, new members only need the set contents changed.
+        """
+        if not self.enable_ipset or self._defer_apply:
+            return False
+        ports = self.ports
+        for device, port in six.iteritems(devices):
+            if ports.get(device) != port:
+                return False
+        for sg_id, sg_rules in six.iteritems(security_groups):
+            # the stored rules may have been rewritten in place
+            if (sg_id not in self.sg_rules or
+                    self._sg_rules_fingerprint(self.sg_rules[sg_id]) !=
+                    self._sg_rules_fingerprint(sg_rules)):
+                return False
+        remote_sg_ids = self._get_remote_sg_ids_sets_by_ipversion(
+            self.filtered_ports.values())
+        for ip_version, sg_ids in six.iteritems(remote_sg_ids):
+            sg_ids &= set(security_group_member_ips)
+            for sg_id in sg_ids:
+                if not self.ipset.set_name_exists(
+                        self.ipset.get_name(sg_id, ip_version)):
+                    # the port chains need to start referencing the set
+                    return False
+        self.pre_sg_members = dict(self.sg_members)
+        for sg_id, sg_members in six.iteritems(security_group_member_ips):
+            self.update_security_group_members(sg_id, sg_members)
+        self.ipset.defer_apply_on()
+        try:
+            self._update_ipset_members(remote_sg_ids)
+        finally:
+            self.ipset.defer_apply_off()
+        self._clean_deleted_remote_sg_members_conntrack_entries()
+        return True
+
+    def invalidate_saved_state(self):
+        self.iptables.invalidate_saved_state()
 
     def _ps_enabled(self, port):
         return port.get(psec.PORTSECURITY, True)
 
     def _set_ports(self, port):
+        self._changed_devices.add(port['device'])
         if not self._ps_enabled(port):
             self.unfiltered_ports[port['device']] = port
             self.filtered_ports.pop(port['device'], None)
@@ -212,20 +289,127 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                                      self.unfiltered_ports)
 
     def _setup_chains_apply(self, ports, unfiltered_ports):
-        self._add_chain_by_name_v4v6(SG_CHAIN)
+        """Set up the chains of the filtered ports which changed.
+
+        Only the ports which were added, updated or removed, and the ones
+        depending on a security group whose rules or members were updated,
+        are fingerprinted. The chains of the other ports are left as they
+        are, and so are those of the ports whose fingerprint is unchanged.
+        """
+        if not self._sg_chain_set_up:
+            self._add_chain_by_name_v4v6(SG_CHAIN)
+            if self.shared_sg_chains:
+                self._add_chain_by_name_v4v6(SG_MATCH_CHAIN)
+                mark_rule = ['-j MARK --set-xmark %s/%s' % (SG_MATCH_MARK,
+                                                            SG_MATCH_MARK)]
+                self._add_rules_to_chain_v4v6(SG_MATCH_CHAIN, mark_rule,
+                                              mark_rule)
+        self._sg_fingerprints = {}
+        changed_sg_ids, self._changed_sg_ids = self._changed_sg_ids, set()
+        devices, self._changed_devices = self._changed_devices, set()
+        # added and removed ports
+        devices |= set(ports) ^ set(self._port_chains)
+        for sg_id in changed_sg_ids:
+            devices |= self._sg_devices.get(sg_id, set())
+        if self.enable_ipset:
+            for device in devices:
+                if device in ports:
+                    self._update_ipset_members(
+                        self._get_remote_sg_ids(ports[device]))
+        if self.shared_sg_chains and devices:
+            # the sets of the remote groups may have just been created
+            self._update_sg_chains()
+        removed_sg_ids = set()
+        chains_added = False
         # sort by port so we always do this deterministically between
         # agent restarts and don't cause unnecessary rule differences
-        for pname in sorted(ports):
-            port = ports[pname]
-            self._setup_chain(port, firewall.INGRESS_DIRECTION)
-            self._setup_chain(port, firewall.EGRESS_DIRECTION)
-        self.iptables.ipv4['filter'].add_rule(SG_CHAIN, '-j ACCEPT')
-        self.iptables.ipv6['filter'].add_rule(SG_CHAIN, '-j ACCEPT')
+        for device in sorted(devices):
+            port = ports.get(device)
+            port_chains = self._port_chains.get(device)
+            if port_chains and port is not None:
+                fingerprint = self._get_port_chains_fingerprint(port)
+                if port_chains[0] != fingerprint:
+                    self._refill_port_chains(port)
+                    removed_sg_ids |= port_chains[1]
+                self._track_port_chains(port, fingerprint)
+            elif port_chains:
+                removed_sg_ids |= self._remove_port_chains(device)
+            elif port is not None:
+                self._setup_port_chains(port)
+                chains_added = True
+        if self.shared_sg_chains:
+            self._remove_unused_sg_chains(removed_sg_ids)
+        if chains_added or not self._sg_chain_set_up:
+            # the jumps to the port chains must come before the accept rule
+            if self._sg_chain_set_up:
+                self._remove_rule_from_chain_v4v6(SG_CHAIN, ['-j ACCEPT'],
+                                                  ['-j ACCEPT'])
+            self.iptables.ipv4['filter'].add_rule(SG_CHAIN, '-j ACCEPT')
+            self.iptables.ipv6['filter'].add_rule(SG_CHAIN, '-j ACCEPT')
+            self._sg_chain_set_up = True
 
         for port in unfiltered_ports.values():
             self._add_accept_rule_port_sec(port, firewall.INGRESS_DIRECTION)
             self._add_accept_rule_port_sec(port, firewall.EGRESS_DIRECTION)
 
+    def _setup_port_chains(self, port):
+        self._setup_chain(port, firewall.INGRESS_DIRECTION)
+        self._setup_chain(port, firewall.EGRESS_DIRECTION)
+        self._track_port_chains(port,
+                                self._get_port_chains_fingerprint(port))
+
+    def _refill_port_chains(self, port):
+        """Replace the rules of the chains of a port.
+
+        The jumps to the chains only depend on the device, they are left in
+        place so that the other rules of their chains don't move.
+        """
+        self._remove_chain(port, SPOOF_FILTER)
+        for direction in (firewall.INGRESS_DIRECTION,
+                          firewall.EGRESS_DIRECTION):
+            chain_name = self._port_chain_name(port, direction)
+            self.iptables.ipv4['filter'].empty_chain(chain_name)
+            self.iptables.ipv6['filter'].empty_chain(chain_name)
+            self._add_rules_by_security_group(port, direction)
+
+    def _track_port_chains(self, port, fingerprint):
+        """Record what the chains of a port were set up from.
+
+        The remote groups the port depends on change with the rules of its
+        security groups, even when its chains are unchanged.
+        """
+        device = port['device']
+        sg_ids = frozenset(port.get('security_groups', []))
+        depends_on = sg_ids.union(*self._get_remote_sg_ids(port).values())
+        if device in self._port_chains:
+            self._untrack_port_chains(device)
+        self._port_chains[device] = (fingerprint, sg_ids, depends_on)
+        for sg_id in depends_on:
+            self._sg_devices[sg_id].add(device)
+
+    def _untrack_port_chains(self, device):
+        port_chains = self._port_chains.pop(device)
+        for sg_id in port_chains[2]:
+            self._sg_devices[sg_id].discard(device)
+            if not self._sg_devices[sg_id]:
+                del self._sg_devices[sg_id]
+        return port_chains
+
+    def _remove_port_chains(self, device):
+        """Remove the chains of a port, return its security group ids."""
+        fingerprint, sg_ids, depends_on = self._untrack_port_chains(device)
+        # the fingerprint starts with the port the chains were set up for
+        port = fingerprint[0]
+        for direction in (firewall.INGRESS_DIRECTION,
+                          firewall.EGRESS_DIRECTION):
+            self._remove_chain(port, direction)
+            # SG_CHAIN is kept, so the jumps to it aren't removed with it
+            jump_rule = self._get_sg_chain_jump_rule(port, direction)
+            self._remove_rule_from_chain_v4v6('FORWARD', jump_rule,
+                                              jump_rule)
+        self._remove_chain(port, SPOOF_FILTER)
+        return sg_ids
+
     def _remove_chains(self):
         """Remove ingress and egress chain for a port."""
         if not self._defer_apply:
@@ -233,14 +417,11 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                                       self.unfiltered_ports)
 
     def _remove_chains_apply(self, ports, unfiltered_ports):
-        for port in ports.values():
-            self._remove_chain(port, firewall.INGRESS_DIRECTION)
-            self._remove_chain(port, firewall.EGRESS_DIRECTION)
-            self._remove_chain(port, SPOOF_FILTER)
+        # the chains of the filtered ports are removed by
+        # _setup_chains_apply, only when they have to be rebuilt
         for port in unfiltered_ports.values():
             self._remove_rule_port_sec(port, firewall.INGRESS_DIRECTION)
             self._remove_rule_port_sec(port, firewall.EGRESS_DIRECTION)
-        self._remove_chain_by_name_v4v6(SG_CHAIN)
 
     def _setup_chain(self, port, DIRECTION):
         self._add_chain(port, DIRECTION)
@@ -322,10 +503,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
 
         # jump to the security group chain
         device = self._get_device_name(port)
-        jump_rule = ['-m physdev --%s %s --physdev-is-bridged '
-                     '-j $%s' % (self.IPTABLES_DIRECTION[direction],
-                                 device,
-                                 SG_CHAIN)]
+        jump_rule = self._get_sg_chain_jump_rule(port, direction)
         self._add_rules_to_chain_v4v6('FORWARD', jump_rule, jump_rule,
                                       comment=ic.VM_INT_SG)
 
@@ -341,6 +519,12 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             self._add_rules_to_chain_v4v6('INPUT', jump_rule, jump_rule,
                                           comment=ic.INPUT_TO_SG)
 
+    def _get_sg_chain_jump_rule(self, port, direction):
+        return ['-m physdev --%s %s --physdev-is-bridged '
+                '-j $%s' % (self.IPTABLES_DIRECTION[direction],
+                            self._get_device_name(port),
+                            SG_CHAIN)]
+
     def _split_sgr_by_ethertype(self, security_group_rules):
         ipv4_sg_rules = []
         ipv6_sg_rules = []
@@ -440,9 +624,12 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                              '-j RETURN' % icmp6_type]
         return icmpv6_rules
 
-    def _select_sg_rules_for_port(self, port, direction):
+    def _select_sg_rules_for_port(self, port, direction, sg_ids=None):
         """Select rules from the security groups the port is member of."""
-        port_sg_ids = port.get('security_groups', [])
+        if sg_ids is None:
+            port_sg_ids = port.get('security_groups', [])
+        else:
+            port_sg_ids = sg_ids
         port_rules = []
 
         for sg_id in port_sg_ids:
@@ -486,18 +673,10 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         return remote_sg_ids
 
     def _add_rules_by_security_group(self, port, direction):
-        # select rules for current port and direction
-        security_group_rules = self._select_sgr_by_direction(port, direction)
-        security_group_rules += self._select_sg_rules_for_port(port, direction)
         # make sure ipset members are updated for remote security groups
         if self.enable_ipset:
             remote_sg_ids = self._get_remote_sg_ids(port, direction)
             self._update_ipset_members(remote_sg_ids)
-        # split groups by ip version
-        # for ipv4, iptables command is used
-        # for ipv6, iptables6 command is used
-        ipv4_sg_rules, ipv6_sg_rules = self._split_sgr_by_ethertype(
-            security_group_rules)
         ipv4_iptables_rules = []
         ipv6_iptables_rules = []
         # include fixed egress/ingress rules
@@ -508,15 +687,209 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         elif direction == firewall.INGRESS_DIRECTION:
             ipv6_iptables_rules += self._accept_inbound_icmpv6()
         # include IPv4 and IPv6 iptable rules from security group
-        ipv4_iptables_rules += self._convert_sgr_to_iptables_rules(
-            ipv4_sg_rules)
-        ipv6_iptables_rules += self._convert_sgr_to_iptables_rules(
-            ipv6_sg_rules)
+        if self.shared_sg_chains:
+            ipv4_sg_iptables_rules, ipv6_sg_iptables_rules = (
+                self._get_shared_sg_iptables_rules(port, direction))
+        else:
+            ipv4_sg_iptables_rules, ipv6_sg_iptables_rules = (
+                self._get_sg_iptables_rules(port, direction))
+        ipv4_iptables_rules += ipv4_sg_iptables_rules
+        ipv6_iptables_rules += ipv6_sg_iptables_rules
         # finally add the rules to the port chain for a given direction
         self._add_rules_to_chain_v4v6(self._port_chain_name(port, direction),
                                       ipv4_iptables_rules,
                                       ipv6_iptables_rules)
 
+    def _get_sg_iptables_rules(self, port, direction):
+        """Return the iptables rules generated from the port's SG rules."""
+        # select rules for current port and direction
+        security_group_rules = self._select_sgr_by_direction(port, direction)
+        security_group_rules += self._select_sg_rules_for_port(port, direction)
+        # split groups by ip version
+        # for ipv4, iptables command is used
+        # for ipv6, iptables6 command is used
+        ipv4_sg_rules, ipv6_sg_rules = self._split_sgr_by_ethertype(
+            security_group_rules)
+        ipv4_iptables_rules = self._convert_sgr_to_iptables_rules(
+            ipv4_sg_rules)
+        ipv6_iptables_rules = self._convert_sgr_to_iptables_rules(
+            ipv6_sg_rules)
+        return ipv4_iptables_rules, ipv6_iptables_rules
+
+    def _get_shared_sg_iptables_rules(self, port, direction):
+        """Return port chain rules jumping to the shared SG chains.
+
+        On its first matching rule, a shared chain goes to SG_MATCH_CHAIN,
+        which sets SG_MATCH_MARK and returns straight to the port chain.
+        The port chain clears the bit before jumping to the chains of its
+        security groups, and returns as soon as one of them set it.
+        """
+        security_group_rules = self._select_sgr_by_direction(port, direction)
+        jump_rules = []
+        port_sg_ids = port.get('security_groups', [])
+        if port_sg_ids:
+            jump_rules.append('-j MARK --set-xmark 0x0/%s' % SG_MATCH_MARK)
+            for sg_id in port_sg_ids:
+                chain_name = self._setup_sg_chain(sg_id, direction)
+                if chain_name:
+                    jump_rules += ['-j $%s' % chain_name,
+                                   '-m mark --mark %s/%s -j RETURN' %
+                                   (SG_MATCH_MARK, SG_MATCH_MARK)]
+                else:
+                    security_group_rules += self._select_sg_rules_for_port(
+                        port, direction, [sg_id])
+        ipv4_sg_rules, ipv6_sg_rules = self._split_sgr_by_ethertype(
+            security_group_rules)
+        return (self._convert_sgr_to_iptables_rules(ipv4_sg_rules,
+                                                    jump_rules),
+                self._convert_sgr_to_iptables_rules(ipv6_sg_rules,
+                                                    jump_rules))
+
+    def _sg_chain_name(self, sg_id, direction):
+        # the wrapped chain names only have room for 9 characters of the
+        # id, which other ids may share, so a hash of the whole id is used
+        sg_hash = hashlib.sha1(sg_id.encode('utf-8')).hexdigest()
+        return iptables_manager.get_chain_name(
+            '%s%s' % (SG_CHAIN_NAME_PREFIX[direction], sg_hash))
+
+    def _setup_sg_chain(self, sg_id, direction):
+        """Set up the shared chain of a security group, unless it exists.
+
+        Returns None if the chain name is already used by another security
+        group, the rules of the group must then be added to the port chains.
+        """
+        chain_name = self._sg_chain_name(sg_id, direction)
+        if chain_name in self._sg_chains:
+            other_sg_id = self._sg_chains[chain_name][0]
+            if other_sg_id != sg_id:
+                LOG.warning(_LW("Security groups %(sg_id)s and "
+                                "%(other_sg_id)s have the same shared chain "
+                                "name %(chain)s, not sharing the rules of "
+                                "%(sg_id)s"),
+                            {'sg_id': sg_id,
+                             'other_sg_id': other_sg_id,
+                             'chain': chain_name})
+                return None
+            return chain_name
+        self._add_chain_by_name_v4v6(chain_name)
+        self._add_sg_chain_rules(chain_name, sg_id, direction)
+        return chain_name
+
+    def _add_sg_chain_rules(self, chain_name, sg_id, direction):
+        sg_rules = [rule for rule in self.sg_rules.get(sg_id, [])
+                    if rule['direction'] == direction]
+        ipv4_sg_rules, ipv6_sg_rules = self._split_sgr_by_ethertype(sg_rules)
+        self._add_rules_to_chain_v4v6(
+            chain_name,
+            self._convert_sgr_to_shared_chain_rules(ipv4_sg_rules),
+            self._convert_sgr_to_shared_chain_rules(ipv6_sg_rules))
+        self._sg_chains[chain_name] = (
+            sg_id, direction, self._get_sg_chain_fingerprint(sg_id, direction))
+
+    def _update_sg_chains(self):
+        """Rebuild in place the shared chains whose rules changed.
+
+        The port chains keep jumping to them, so they are emptied rather
+        than removed.
+        """
+        for chain_name, (sg_id, direction, fingerprint) in list(
+                six.iteritems(self._sg_chains)):
+            if fingerprint == self._get_sg_chain_fingerprint(sg_id,
+                                                             direction):
+                continue
+            self.iptables.ipv4['filter'].empty_chain(chain_name)
+            self.iptables.ipv6['filter'].empty_chain(chain_name)
+            self._add_sg_chain_rules(chain_name, sg_id, direction)
+
+    def _remove_unused_sg_chains(self, sg_ids):
+        for sg_id in sg_ids:
+            if any(sg_id in self._port_chains[device][1]
+                   for device in self._sg_devices.get(sg_id, ())):
+                continue
+            for direction in SG_CHAIN_NAME_PREFIX:
+                chain_name = self._sg_chain_name(sg_id, direction)
+                if self._sg_chains.get(chain_name, (None,))[0] == sg_id:
+                    self._remove_chain_by_name_v4v6(chain_name)
+                    del self._sg_chains[chain_name]
+
+    def _in_shared_sg_chains(self, sg_id):
+        return self.shared_sg_chains and all(
+            self._sg_chains.get(self._sg_chain_name(sg_id, direction),
+                                (sg_id,))[0] == sg_id
+            for direction in SG_CHAIN_NAME_PREFIX)
+
+    def _convert_sgr_to_shared_chain_rules(self, security_group_rules):
+        iptables_rules = []
+        for rule in security_group_rules:
+            args = self._convert_sg_rule_to_iptables_args(rule)
+            if args:
+                args[-1] = '-g $%s' % SG_MATCH_CHAIN
+                iptables_rules += [' '.join(args)]
+        return iptables_rules
+
+    @staticmethod
+    def _sg_rules_fingerprint(sg_rules):
+        fingerprint = []
+        for rule in sg_rules:
+            rule = dict(rule)
+            # _split_sgr_by_ethertype rewrites these in place
+            if (rule.get('ethertype') == constants.IPv6 and
+                    rule.get('protocol') == 'icmp'):
+                rule['protocol'] = 'ipv6-icmp'
+            fingerprint.append(tuple(sorted(six.iteritems(rule))))
+        return tuple(fingerprint)
+
+    def _get_sg_fingerprint(self, sg_id):
+        # security groups are shared by many ports, only fingerprint them
+        # once per _setup_chains_apply run
+        if sg_id not in self._sg_fingerprints:
+            self._sg_fingerprints[sg_id] = self._sg_rules_fingerprint(
+                self.sg_rules.get(sg_id, []))
+        return self._sg_fingerprints[sg_id]
+
+    def _get_remote_sg_fingerprint(self, remote_sg_ids):
+        """Fingerprint the members of remote groups the rules depend on.
+
+        With ipset the rules only depend on whether the set exists.
+        """
+        remote_groups = []
+        for ethertype, sg_ids in sorted(six.iteritems(remote_sg_ids)):
+            for remote_sg_id in sorted(sg_ids):
+                if self.enable_ipset:
+                    remote_state = self.ipset.set_name_exists(
+                        self.ipset.get_name(remote_sg_id, ethertype))
+                else:
+                    remote_state = tuple(
+                        self.sg_members[remote_sg_id][ethertype])
+                remote_groups.append((remote_sg_id, ethertype, remote_state))
+        return tuple(remote_groups)
+
+    def _get_port_chains_fingerprint(self, port):
+        """Fingerprint everything the chains of a port are set up from.
+
+        That is the port itself, the rules of its security groups, unless
+        they are in shared chains, and the state of their remote groups.
+        The fingerprint starts with a copy of the port.
+        """
+        port_copy = copy.deepcopy(port)
+        # _split_sgr_by_ethertype rewrites the rules in place
+        port_copy['security_group_rules'] = self._sg_rules_fingerprint(
+            port.get('security_group_rules', []))
+        sg_ids = [sg_id for sg_id in port.get('security_groups', [])
+                  if not self._in_shared_sg_chains(sg_id)]
+        return (port_copy,
+                tuple((sg_id, self._get_sg_fingerprint(sg_id))
+                      for sg_id in sg_ids),
+                self._get_remote_sg_fingerprint(self._get_remote_sg_ids(
+                    {'security_groups': sg_ids})))
+
+    def _get_sg_chain_fingerprint(self, sg_id, direction):
+        sg_rules = [rule for rule in self.sg_rules.get(sg_id, [])
+                    if rule['direction'] == direction]
+        return (self._sg_rules_fingerprint(sg_rules),
+                self._get_remote_sg_fingerprint(self._get_remote_sg_ids(
+                    {'security_groups': [sg_id]}, direction)))
+
     def _add_fixed_egress_rules(self, port, ipv4_iptables_rules,
                                 ipv6_iptables_rules):
         self._spoofing_rule(port,
@@ -573,13 +946,16 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         else:
             return self._generate_plain_rule_args(sg_rule)
 
-    def _convert_sgr_to_iptables_rules(self, security_group_rules):
+    def _convert_sgr_to_iptables_rules(self, security_group_rules,
+                                       sg_chain_rules=None):
         iptables_rules = []
         self._allow_established(iptables_rules)
         for rule in security_group_rules:
             args = self._convert_sg_rule_to_iptables_args(rule)
             if args:
                 iptables_rules += [' '.join(args)]
+        if sg_chain_rules:
+            iptables_rules += sg_chain_rules
 
         self._drop_invalid_packets(iptables_rules)
         iptables_rules += [comment_rule('-j $sg-fallback',
@@ -653,6 +1029,8 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
     def filter_defer_apply_on(self):
         if not self._defer_apply:
             self.iptables.defer_apply_on()
+            if self.enable_ipset:
+                self.ipset.defer_apply_on()
             self._pre_defer_filtered_ports = dict(self.filtered_ports)
             self._pre_defer_unfiltered_ports = dict(self.unfiltered_ports)
             self.pre_sg_members = dict(self.sg_members)
@@ -816,6 +1194,9 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                                       self._pre_defer_unfiltered_ports)
             self._setup_chains_apply(self.filtered_ports,
                                      self.unfiltered_ports)
+            if self.enable_ipset:
+                # the sets must exist before the rules referencing them
+                self.ipset.defer_apply_off()
             self.iptables.defer_apply_off()
             self._remove_conntrack_entries_from_sg_updates()
             self._remove_unused_security_group_info()
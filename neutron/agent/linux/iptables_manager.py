@@ -125,13 +125,60 @@ class IptablesTable(object):
     """An iptables table."""
 
     def __init__(self, binary_name=binary_name):
-        self.rules = []
+        # Rules are kept in insertion order, keyed by a sequence number, and
+        # indexed by (chain, wrap), by rule identity and by tag so adding and
+        # removing them doesn't require scanning every rule of the table.
+        self._rules = collections.OrderedDict()
+        self._rule_seq = 0
+        self._rules_by_chain = collections.defaultdict(
+            collections.OrderedDict)
+        self._rules_by_key = collections.defaultdict(list)
+        self._rules_by_tag = collections.defaultdict(set)
         self.remove_rules = []
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
         self.wrap_name = binary_name[:16]
 
+    @property
+    def rules(self):
+        return list(self._rules.values())
+
+    @staticmethod
+    def _rule_key(rule):
+        return rule.chain, rule.rule, rule.wrap, rule.top
+
+    def _insert_rule(self, rule):
+        self._rule_seq += 1
+        seq = self._rule_seq
+        self._rules[seq] = rule
+        self._rules_by_chain[(rule.chain, rule.wrap)][seq] = None
+        self._rules_by_key[self._rule_key(rule)].append(seq)
+        if rule.tag:
+            self._rules_by_tag[rule.tag].add(seq)
+
+    def _delete_rule(self, seq):
+        rule = self._rules.pop(seq)
+        chain_key = (rule.chain, rule.wrap)
+        del self._rules_by_chain[chain_key][seq]
+        if not self._rules_by_chain[chain_key]:
+            del self._rules_by_chain[chain_key]
+        key = self._rule_key(rule)
+        self._rules_by_key[key].remove(seq)
+        if not self._rules_by_key[key]:
+            del self._rules_by_key[key]
+        if rule.tag:
+            self._rules_by_tag[rule.tag].discard(seq)
+            if not self._rules_by_tag[rule.tag]:
+                del self._rules_by_tag[rule.tag]
+        return rule
+
+    def _delete_rules(self, seqs):
+        return [self._delete_rule(seq) for seq in sorted(seqs)]
+
+    def _chain_seqs(self, chain, wrap):
+        return list(self._rules_by_chain.get((chain, wrap), ()))
+
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
 
@@ -175,29 +222,29 @@ class IptablesTable(object):
 
         chain_set.remove(name)
 
+        # remove rules that have a matching chain name, whether they were
+        # added as wrapped or unwrapped rules
+        removed = self._delete_rules(self._chain_seqs(name, True) +
+                                     self._chain_seqs(name, False))
+
         if not wrap:
             # non-wrapped chains and rules need to be dealt with specially,
             # so we keep a list of them to be iterated over in apply()
             self.remove_chains.add(name)
 
             # first, add rules to remove that have a matching chain name
-            self.remove_rules += [str(r) for r in self.rules
-                                  if r.chain == name]
+            self.remove_rules += [str(r) for r in removed]
 
-        # next, remove rules from list that have a matching chain name
-        self.rules = [r for r in self.rules if r.chain != name]
-
-        if not wrap:
             jump_snippet = '-j %s' % name
-            # next, add rules to remove that have a matching jump chain
-            self.remove_rules += [str(r) for r in self.rules
-                                  if jump_snippet in r.rule]
         else:
             jump_snippet = '-j %s-%s' % (self.wrap_name, name)
 
-        # finally, remove rules from list that have a matching jump chain
-        self.rules = [r for r in self.rules
-                      if jump_snippet not in r.rule]
+        # finally, remove rules that have a matching jump chain
+        removed = self._delete_rules(
+            seq for seq, r in six.iteritems(self._rules)
+            if jump_snippet in r.rule)
+        if not wrap:
+            self.remove_rules += [str(r) for r in removed]
 
     def add_rule(self, chain, rule, wrap=True, top=False, tag=None,
                  comment=None):
@@ -219,7 +266,7 @@ class IptablesTable(object):
             rule = ' '.join(
                 self._wrap_target_chain(e, wrap) for e in rule.split(' '))
 
-        self.rules.append(IptablesRule(chain, rule, wrap, top, self.wrap_name,
+        self._insert_rule(IptablesRule(chain, rule, wrap, top, self.wrap_name,
                                        tag, comment))
 
     def _wrap_target_chain(self, s, wrap):
@@ -237,41 +284,37 @@ class IptablesTable(object):
 
         """
         chain = get_chain_name(chain, wrap)
-        try:
-            if '$' in rule:
-                rule = ' '.join(
-                    self._wrap_target_chain(e, wrap) for e in rule.split(' '))
-
-            self.rules.remove(IptablesRule(chain, rule, wrap, top,
-                                           self.wrap_name,
-                                           comment=comment))
-            if not wrap:
-                self.remove_rules.append(str(IptablesRule(chain, rule, wrap,
-                                                          top, self.wrap_name,
-                                                          comment=comment)))
-        except ValueError:
+        if '$' in rule:
+            rule = ' '.join(
+                self._wrap_target_chain(e, wrap) for e in rule.split(' '))
+
+        seqs = self._rules_by_key.get((chain, rule, wrap, top))
+        if not seqs:
             LOG.warn(_LW('Tried to remove rule that was not there:'
                          ' %(chain)r %(rule)r %(wrap)r %(top)r'),
                      {'chain': chain, 'rule': rule,
                       'top': top, 'wrap': wrap})
+            return
+
+        self._delete_rule(seqs[0])
+        if not wrap:
+            self.remove_rules.append(str(IptablesRule(chain, rule, wrap,
+                                                      top, self.wrap_name,
+                                                      comment=comment)))
 
     def _get_chain_rules(self, chain, wrap):
         chain = get_chain_name(chain, wrap)
-        return [rule for rule in self.rules
-                if rule.chain == chain and rule.wrap == wrap]
+        return [self._rules[seq] for seq in self._chain_seqs(chain, wrap)]
 
     def empty_chain(self, chain, wrap=True):
         """Remove all rules from a chain."""
-        chained_rules = self._get_chain_rules(chain, wrap)
-        for rule in chained_rules:
-            self.rules.remove(rule)
+        chain = get_chain_name(chain, wrap)
+        self._delete_rules(self._chain_seqs(chain, wrap))
 
     def clear_rules_by_tag(self, tag):
         if not tag:
             return
-        rules = [rule for rule in self.rules if rule.tag == tag]
-        for rule in rules:
-            self.rules.remove(rule)
+        self._delete_rules(self._rules_by_tag.get(tag, ()))
 
 
 class IptablesManager(object):
@@ -308,6 +351,11 @@ class IptablesManager(object):
         self.namespace = namespace
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
+        self.incremental_apply = cfg.CONF.AGENT.iptables_incremental_apply
+        # Last known iptables-save output per command ('iptables' or
+        # 'ip6tables'), kept up to date after each successful apply when
+        # incremental_apply is enabled.
+        self._saved_lines = {}
 
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
@@ -495,6 +543,14 @@ class IptablesManager(object):
         and replace them with the current set of rules.
         This happens atomically, thanks to iptables-restore.
 
+        When incremental_apply is enabled, the diff is computed against the
+        state left behind by the previous successful apply rather than a
+        fresh iptables-save, so only the commands for the chains that
+        changed are generated and fed to iptables-restore --noflush. This
+        is only done when the commands change the chains wrapped by this
+        manager: the other chains, e.g. the built-in ones, are shared with
+        other programs and their rule indexes must come from iptables-save.
+
         Returns a list of the changes that were sent to iptables-save.
         """
         s = [('iptables', self.ipv4)]
@@ -502,30 +558,27 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
         all_commands = []  # variable to keep track all commands for return val
         for cmd, tables in s:
-            args = ['%s-save' % (cmd,)]
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            save_output = self.execute(args, run_as_root=True)
-            all_lines = save_output.split('\n')
-            commands = []
-            # Traverse tables in sorted order for predictable dump output
-            for table_name in sorted(tables):
-                table = tables[table_name]
-                # isolate the lines of the table we are modifying
-                start, end = self._find_table(all_lines, table_name)
-                old_rules = all_lines[start:end]
-                # generate the new table state we want
-                new_rules = self._modify_rules(old_rules, table, table_name)
-                # generate the iptables commands to get between the old state
-                # and the new state
-                changes = _generate_path_between_rules(old_rules, new_rules)
-                if changes:
-                    # if there are changes to the table, we put on the header
-                    # and footer that iptables-save needs
-                    commands += (['# Generated by iptables_manager'] +
-                                 ['*%s' % table_name] + changes +
-                                 ['COMMIT', '# Completed by iptables_manager'])
+            saved = self.incremental_apply and cmd in self._saved_lines
+            if saved:
+                # generating the commands consumes the pending removals
+                removals = dict(
+                    (table_name, (set(table.remove_chains),
+                                  list(table.remove_rules)))
+                    for table_name, table in six.iteritems(tables))
+            all_lines = self._get_saved_lines(cmd)
+            commands, new_tables = self._generate_commands(all_lines, tables)
+            if saved and not self._only_wrapped_chains_changed(commands):
+                # the saved state of the shared chains may be stale
+                for table_name, (remove_chains, remove_rules) in (
+                        six.iteritems(removals)):
+                    tables[table_name].remove_chains = remove_chains
+                    tables[table_name].remove_rules = remove_rules
+                self._saved_lines.pop(cmd, None)
+                all_lines = self._get_saved_lines(cmd)
+                commands, new_tables = self._generate_commands(all_lines,
+                                                               tables)
             if not commands:
+                self._update_saved_lines(cmd, all_lines, new_tables)
                 continue
             all_commands += commands
             args = ['%s-restore' % (cmd,), '-n']
@@ -536,8 +589,12 @@ class IptablesManager(object):
                 commands.append('')
                 self.execute(args, process_input='\n'.join(commands),
                              run_as_root=True)
+                self._update_saved_lines(cmd, all_lines, new_tables)
             except RuntimeError as r_error:
                 with excutils.save_and_reraise_exception():
+                    # The kernel state may have drifted from our copy of it,
+                    # make sure the next apply starts from iptables-save.
+                    self._saved_lines.pop(cmd, None)
                     try:
                         line_no = int(re.search(
                             'iptables-restore: line ([0-9]+?) failed',
@@ -561,6 +618,86 @@ class IptablesManager(object):
                   "commands were issued", len(all_commands))
         return all_commands
 
+    def _generate_commands(self, all_lines, tables):
+        """Return the commands bringing all_lines to the tables' state.
+
+        The new state of each table is also returned, by table name, None
+        for the tables missing from all_lines.
+        """
+        commands = []
+        new_tables = {}
+        # Traverse tables in sorted order for predictable dump output
+        for table_name in sorted(tables):
+            table = tables[table_name]
+            # isolate the lines of the table we are modifying
+            start, end = self._find_table(all_lines, table_name)
+            old_rules = all_lines[start:end]
+            # generate the new table state we want
+            new_rules = self._modify_rules(old_rules, table, table_name)
+            new_tables[table_name] = new_rules if start != end else None
+            # generate the iptables commands to get between the old state
+            # and the new state
+            changes = _generate_path_between_rules(old_rules, new_rules)
+            if changes:
+                # if there are changes to the table, we put on the header
+                # and footer that iptables-save needs
+                commands += (['# Generated by iptables_manager'] +
+                             ['*%s' % table_name] + changes +
+                             ['COMMIT', '# Completed by iptables_manager'])
+        return commands, new_tables
+
+    def _only_wrapped_chains_changed(self, commands):
+        prefix = '%s-' % self.wrap_name
+        for command in commands:
+            if command.startswith(':'):
+                chain = command[1:].split(' ', 1)[0]
+            elif command.startswith('-'):
+                chain = command.split(' ', 2)[1]
+            else:
+                # table header or footer
+                continue
+            if not chain.startswith(prefix):
+                return False
+        return True
+
+    def _get_saved_lines(self, cmd):
+        if self.incremental_apply and cmd in self._saved_lines:
+            return self._saved_lines[cmd]
+        args = ['%s-save' % (cmd,)]
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        save_output = self.execute(args, run_as_root=True)
+        return save_output.split('\n')
+
+    def _update_saved_lines(self, cmd, all_lines, new_tables):
+        """Record the state iptables-restore has just been brought to."""
+        if not self.incremental_apply:
+            return
+        if any(rules is None for rules in new_tables.values()):
+            # A table was missing from the iptables-save output, we can't
+            # tell what the kernel added around our rules.
+            self._saved_lines.pop(cmd, None)
+            return
+        lines = list(all_lines)
+        for table_name, new_rules in six.iteritems(new_tables):
+            start, end = self._find_table(lines, table_name)
+            # new chains lack the policy and counters iptables-save prints,
+            # add them so later applies see the same lines as a real dump
+            lines[start:end] = [
+                '%s - [0:0]' % line
+                if line.startswith(':') and ' ' not in line else line
+                for line in new_rules]
+        self._saved_lines[cmd] = lines
+
+    def invalidate_saved_state(self):
+        """Forget the cached iptables state.
+
+        The next apply will run iptables-save again. Callers that notice
+        the kernel rules may have been changed behind our back (e.g. on an
+        agent resync) should call this.
+        """
+        self._saved_lines.clear()
+
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
             # length only <2 when fake iptables
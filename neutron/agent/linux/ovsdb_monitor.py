@@ -12,21 +12,32 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+
 import eventlet
+from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
 
-from neutron._i18n import _LE
+from neutron._i18n import _LE, _LW
 from neutron.agent.linux import async_process
 from neutron.agent.ovsdb import api as ovsdb
 
 
+cfg.CONF.import_opt('ovs_vsctl_timeout', 'neutron.agent.common.ovs_lib')
+
 LOG = logging.getLogger(__name__)
 
 OVSDB_ACTION_INITIAL = 'initial'
 OVSDB_ACTION_INSERT = 'insert'
 OVSDB_ACTION_DELETE = 'delete'
 
+# Row events of the native OVSDB connection, see ovs.db.idl
+IDL_ROW_UPDATE = 'update'
+IDL_ROW_DELETE = 'delete'
+
+INTERFACE_COLUMNS = ['name', 'ofport', 'external_ids']
+
 
 class OvsdbMonitor(async_process.AsyncProcess):
     """Manages an invocation of 'ovsdb-client monitor'."""
@@ -56,7 +67,7 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
     def __init__(self, respawn_interval=None):
         super(SimpleInterfaceMonitor, self).__init__(
             'Interface',
-            columns=['name', 'ofport', 'external_ids'],
+            columns=INTERFACE_COLUMNS,
             format='json',
             respawn_interval=respawn_interval,
         )
@@ -108,3 +119,100 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
             with eventlet.timeout.Timeout(timeout):
                 while not self.is_active():
                     eventlet.sleep()
+
+
+class IdlInterfaceMonitor(object):
+    """Monitors the Interface table through the native OVSDB connection.
+
+    It provides the events of SimpleInterfaceMonitor from the row change
+    notifications of the IDL replicated by the connection, without an
+    ovsdb-client process. The interfaces which exist when it starts are
+    reported as added.
+    """
+
+    def __init__(self):
+        self.vsctl_timeout = cfg.CONF.ovs_vsctl_timeout
+        self.ovsdb = ovsdb.API.get(self)
+        self.connection = getattr(self.ovsdb, 'ovsdb_connection', None)
+        self.new_events = {'added': [], 'removed': []}
+        self._lock = threading.Lock()
+        self._active = False
+
+    def is_supported(self):
+        return bool(self.connection and self.connection.supports_row_events)
+
+    def is_active(self):
+        return self._active
+
+    @property
+    def has_updates(self):
+        """Indicate whether the ovsdb Interface table has been updated."""
+        with self._lock:
+            return bool(self.new_events['added'] or
+                        self.new_events['removed'])
+
+    def get_events(self):
+        with self._lock:
+            events = self.new_events
+            self.new_events = {'added': [], 'removed': []}
+        return events
+
+    @staticmethod
+    def _get_device(row):
+        device = {}
+        for column in INTERFACE_COLUMNS:
+            value = getattr(row, column)
+            # like db_list, return the single value of an optional column
+            if isinstance(value, list) and len(value) == 1:
+                value = value[0]
+            device[column] = value
+        return device
+
+    def _handle_row_event(self, event, row, updates=None):
+        if row._table.name != 'Interface':
+            return
+        if event == IDL_ROW_UPDATE:
+            # an interface gets its ofport or its external_ids after
+            # being created, the other changes don't matter
+            if not any(_row_has_column(updates, column)
+                       for column in ('ofport', 'external_ids')):
+                return
+        action = 'removed' if event == IDL_ROW_DELETE else 'added'
+        device = self._get_device(row)
+        with self._lock:
+            self.new_events[action].append(device)
+
+    def start(self, block=False, timeout=5):
+        if self._active:
+            return
+        self.connection.add_row_event_handler(self._handle_row_event)
+        self._active = True
+        devices = self.ovsdb.db_list(
+            'Interface', columns=INTERFACE_COLUMNS).execute(check_error=True)
+        with self._lock:
+            self.new_events['added'].extend(devices)
+
+    def stop(self):
+        self.connection.remove_row_event_handler(self._handle_row_event)
+        self._active = False
+
+
+def _row_has_column(row, column):
+    # the old row of an update only holds the changed columns
+    try:
+        getattr(row, column)
+    except (AttributeError, KeyError):
+        return False
+    return True
+
+
+def get_interface_monitor(respawn_interval=None):
+    """Return the monitor of the Interface table for the ovsdb_interface."""
+    if cfg.CONF.OVS.ovsdb_interface == 'native':
+        monitor = IdlInterfaceMonitor()
+        if monitor.is_supported():
+            return monitor
+        LOG.warning(_LW("The ovs library doesn't support the row events of "
+                        "the native OVSDB interface, falling back to "
+                        "ovsdb-client to monitor the interfaces"))
+    return SimpleInterfaceMonitor(respawn_interval=respawn_interval)
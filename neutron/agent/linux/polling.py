@@ -50,7 +50,7 @@ class InterfacePollingMinimizer(base_polling.BasePollingManager):
             ovsdb_monitor_respawn_interval=constants.DEFAULT_OVSDBMON_RESPAWN):
 
         super(InterfacePollingMinimizer, self).__init__()
-        self._monitor = ovsdb_monitor.SimpleInterfaceMonitor(
+        self._monitor = ovsdb_monitor.get_interface_monitor(
             respawn_interval=ovsdb_monitor_respawn_interval)
 
     def start(self):
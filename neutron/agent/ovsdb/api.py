@@ -35,7 +35,14 @@ OPTS = [
     cfg.StrOpt('ovsdb_connection',
                default='tcp:127.0.0.1:6640',
                help=_('The connection string for the native OVSDB backend. '
-                      'Requires the native ovsdb_interface to be enabled.'))
+                      'Requires the native ovsdb_interface to be enabled.')),
+    cfg.IntOpt('ovsdb_transaction_batch_size',
+               default=1, min=1,
+               help=_('Maximum number of queued transactions of the native '
+                      'OVSDB backend which are committed as a single OVSDB '
+                      'transaction, when they only read records or set '
+                      'their columns. 1 disables the coalescing. Requires '
+                      'the native ovsdb_interface to be enabled.'))
 ]
 cfg.CONF.register_opts(OPTS, 'OVS')
 
@@ -355,6 +362,23 @@ class API(object):
         :returns:      :class:`Command` with list of interfaces names result
         """
 
+    def list_bridge_rows(self, bridge, table, columns=None):
+        """Create a command to return the port or interface records of a bridge
+
+        The records are those of the ports listed by list_ports, read from
+        a local copy of the database. Implementations without one return
+        None, the ports have to be listed before their records then.
+
+        :param bridge:  The name of the bridge
+        :type bridge:   string
+        :param table:   The OVS table to query, 'Port' or 'Interface'
+        :type table:    string
+        :param columns: Limit results to only columns, None means all columns
+        :type columns:  list of column names or None
+        :returns:       :class:`Command` with [{'column', value}, ...] result
+                        or None
+        """
+
 
 def val_to_py(val):
     """Convert a json ovsdb return value to native python object"""
@@ -12,6 +12,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
 import time
 
 from oslo_config import cfg
@@ -106,12 +107,54 @@ class Transaction(api.Transaction):
 
             return [cmd.result for cmd in self.commands]
 
+    @property
+    def coalescable(self):
+        return all(command.coalescable for command in self.commands)
+
+    def do_commit_coalesced(self, txns):
+        """Commit the commands of this and other transactions at once
+
+        :param txns: The coalescable transactions following this one
+        :returns:    The results of this and the other transactions, or None
+                     when they have to be committed one by one, because a
+                     command or the OVSDB transaction failed.
+        """
+        txns = [self] + list(txns)
+        start_time = time.time()
+        while True:
+            elapsed_time = time.time() - start_time
+            if elapsed_time > self.timeout:
+                return
+            txn = idl.Transaction(self.api.idl)
+            try:
+                for command in itertools.chain.from_iterable(
+                        t.commands for t in txns):
+                    command.run_idl(txn)
+            except Exception:
+                txn.abort()
+                return
+            seqno = self.api.idl.change_seqno
+            status = txn.commit_block()
+            if status == txn.TRY_AGAIN:
+                LOG.debug("OVSDB transaction returned TRY_AGAIN, retrying")
+                idlutils.wait_for_change(
+                    self.api.idl, self.timeout - elapsed_time,
+                    seqno)
+                continue
+            elif status in (txn.ERROR, txn.ABORTED):
+                LOG.debug("Coalesced transaction failed, committing its "
+                          "%d transactions one by one", len(txns))
+                return
+            return [[cmd.result for cmd in t.commands] for t in txns]
+
 
 class OvsdbIdl(api.API):
 
-    ovsdb_connection = connection.Connection(cfg.CONF.OVS.ovsdb_connection,
-                                             cfg.CONF.ovs_vsctl_timeout,
-                                             'Open_vSwitch')
+    ovsdb_connection = connection.Connection(
+        cfg.CONF.OVS.ovsdb_connection,
+        cfg.CONF.ovs_vsctl_timeout,
+        'Open_vSwitch',
+        max_batch_size=cfg.CONF.OVS.ovsdb_transaction_batch_size)
 
     def __init__(self, context):
         super(OvsdbIdl, self).__init__(context)
@@ -199,3 +242,6 @@ class OvsdbIdl(api.API):
 
     def list_ifaces(self, bridge):
         return cmd.ListIfacesCommand(self, bridge)
+
+    def list_bridge_rows(self, bridge, table, columns=None):
+        return cmd.ListBridgeRowsCommand(self, bridge, table, columns)
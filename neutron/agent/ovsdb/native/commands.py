@@ -25,6 +25,10 @@ LOG = logging.getLogger(__name__)
 
 
 class BaseCommand(api.Command):
+    # Whether the transactions of the command can be coalesced with others,
+    # for commands which only read records or set their columns
+    coalescable = False
+
     def __init__(self, api):
         self.api = api
         self.result = None
@@ -109,6 +113,8 @@ class DelBridgeCommand(BaseCommand):
 
 
 class BridgeExistsCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, name):
         super(BridgeExistsCommand, self).__init__(api)
         self.name = name
@@ -119,6 +125,8 @@ class BridgeExistsCommand(BaseCommand):
 
 
 class ListBridgesCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api):
         super(ListBridgesCommand, self).__init__(api)
 
@@ -129,6 +137,8 @@ class ListBridgesCommand(BaseCommand):
 
 
 class BrGetExternalIdCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, name, field):
         super(BrGetExternalIdCommand, self).__init__(api)
         self.name = name
@@ -140,6 +150,8 @@ class BrGetExternalIdCommand(BaseCommand):
 
 
 class BrSetExternalIdCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, name, field, value):
         super(BrSetExternalIdCommand, self).__init__(api)
         self.name = name
@@ -178,6 +190,8 @@ class DbDestroyCommand(BaseCommand):
 
 
 class DbSetCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, table, record, *col_values):
         super(DbSetCommand, self).__init__(api)
         self.table = table
@@ -196,6 +210,8 @@ class DbSetCommand(BaseCommand):
 
 
 class DbClearCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, table, record, column):
         super(DbClearCommand, self).__init__(api)
         self.table = table
@@ -210,6 +226,8 @@ class DbClearCommand(BaseCommand):
 
 
 class DbGetCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, table, record, column):
         super(DbGetCommand, self).__init__(api)
         self.table = table
@@ -257,6 +275,8 @@ class DelControllerCommand(BaseCommand):
 
 
 class GetControllerCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, bridge):
         super(GetControllerCommand, self).__init__(api)
         self.bridge = bridge
@@ -352,6 +372,8 @@ class DelPortCommand(BaseCommand):
 
 
 class ListPortsCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, bridge):
         super(ListPortsCommand, self).__init__(api)
         self.bridge = bridge
@@ -362,6 +384,8 @@ class ListPortsCommand(BaseCommand):
 
 
 class ListIfacesCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, bridge):
         super(ListIfacesCommand, self).__init__(api)
         self.bridge = bridge
@@ -372,7 +396,35 @@ class ListIfacesCommand(BaseCommand):
                        for i in p.interfaces]
 
 
+class ListBridgeRowsCommand(BaseCommand):
+    coalescable = True
+
+    def __init__(self, api, bridge, table, columns):
+        super(ListBridgeRowsCommand, self).__init__(api)
+        self.bridge = bridge
+        self.table = table
+        self.columns = columns
+
+    def run_idl(self, txn):
+        br = idlutils.row_by_value(self.api.idl, 'Bridge', 'name', self.bridge)
+        ports = [p for p in br.ports if p.name != self.bridge]
+        if self.table == 'Interface':
+            # like the records of the port names listed with db_list
+            rows = [i for p in ports for i in p.interfaces
+                    if i.name == p.name]
+        else:
+            rows = ports
+        table_schema = self.api._tables[self.table]
+        columns = self.columns or list(table_schema.columns.keys()) + ['_uuid']
+        self.result = [
+            {c: idlutils.get_column_value(row, c) for c in columns}
+            for row in rows
+        ]
+
+
 class PortToBridgeCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, name):
         super(PortToBridgeCommand, self).__init__(api)
         self.name = name
@@ -389,6 +441,8 @@ class PortToBridgeCommand(BaseCommand):
 
 
 class InterfaceToBridgeCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, name):
         super(InterfaceToBridgeCommand, self).__init__(api)
         self.name = name
@@ -405,6 +459,8 @@ class InterfaceToBridgeCommand(BaseCommand):
 
 
 class DbListCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, table, records, columns, if_exists):
         super(DbListCommand, self).__init__(api)
         self.table = table
@@ -447,6 +503,8 @@ class DbListCommand(BaseCommand):
 
 
 class DbFindCommand(BaseCommand):
+    coalescable = True
+
     def __init__(self, api, table, *conditions, **kwargs):
         super(DbFindCommand, self).__init__(api)
         self.table = self.api._tables[table]
@@ -50,14 +50,48 @@ class TransactionQueue(Queue.Queue, object):
         return self.alertin.fileno()
 
 
+class RowEventIdl(idl.Idl):
+    """An Idl passing its row change notifications to handlers."""
+
+    def __init__(self, remote, schema_helper, handlers):
+        super(RowEventIdl, self).__init__(remote, schema_helper)
+        self.handlers = handlers
+
+    def notify(self, event, row, updates=None):
+        for handler in list(self.handlers):
+            handler(event, row, updates)
+
+
 class Connection(object):
-    def __init__(self, connection, timeout, schema_name):
+    def __init__(self, connection, timeout, schema_name, max_batch_size=1):
         self.idl = None
         self.connection = connection
         self.timeout = timeout
-        self.txns = TransactionQueue(1)
+        # at most max_batch_size queued transactions are committed at once
+        self.max_batch_size = max_batch_size
+        self.txns = TransactionQueue(max_batch_size)
         self.lock = threading.Lock()
         self.schema_name = schema_name
+        self.row_event_handlers = []
+
+    @property
+    def supports_row_events(self):
+        # older versions of the ovs library have no notify hook in the Idl
+        return hasattr(idl.Idl, 'notify')
+
+    def add_row_event_handler(self, handler):
+        """Call handler(event, row, updates) for each change of a row
+
+        The handler is called from the connection thread, with the
+        ROW_CREATE, ROW_UPDATE or ROW_DELETE event of ovs.db.idl, the row
+        and, for updates, a row holding the old values of the changed
+        columns.
+        """
+        self.row_event_handlers.append(handler)
+
+    def remove_row_event_handler(self, handler):
+        if handler in self.row_event_handlers:
+            self.row_event_handlers.remove(handler)
 
     def start(self):
         with self.lock:
@@ -80,7 +114,8 @@ class Connection(object):
                 helper = do_get_schema_helper()
 
             helper.register_all()
-            self.idl = idl.Idl(self.connection, helper)
+            self.idl = RowEventIdl(self.connection, helper,
+                                   self.row_event_handlers)
             idlutils.wait_for_change(self.idl, self.timeout)
             self.poller = poller.Poller()
             self.thread = threading.Thread(target=self.run)
@@ -93,15 +128,42 @@ class Connection(object):
             self.poller.fd_wait(self.txns.alert_fileno, poller.POLLIN)
             self.poller.block()
             self.idl.run()
+            coalesced_txns = []
+            for txn in self._get_queued_txns():
+                if txn.coalescable:
+                    coalesced_txns.append(txn)
+                    continue
+                self._commit_txns(coalesced_txns)
+                coalesced_txns = []
+                self._commit_txns([txn])
+            self._commit_txns(coalesced_txns)
+
+    def _get_queued_txns(self):
+        txns = []
+        while len(txns) < self.max_batch_size:
             txn = self.txns.get_nowait()
-            if txn is not None:
-                try:
-                    txn.results.put(txn.do_commit())
-                except Exception as ex:
-                    er = idlutils.ExceptionResult(ex=ex,
-                                                  tb=traceback.format_exc())
-                    txn.results.put(er)
-                self.txns.task_done()
+            if txn is None:
+                break
+            txns.append(txn)
+        return txns
+
+    def _commit_txns(self, txns):
+        """Commit transactions, as a single one if there are several"""
+        if len(txns) > 1:
+            results = txns[0].do_commit_coalesced(txns[1:])
+            if results is not None:
+                for txn, result in zip(txns, results):
+                    txn.results.put(result)
+                    self.txns.task_done()
+                return
+        for txn in txns:
+            try:
+                txn.results.put(txn.do_commit())
+            except Exception as ex:
+                er = idlutils.ExceptionResult(ex=ex,
+                                              tb=traceback.format_exc())
+                txn.results.put(er)
+            self.txns.task_done()
 
     def queue_txn(self, txn):
         self.txns.put(txn)
@@ -16,6 +16,7 @@
 
 import functools
 
+import netaddr
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
@@ -44,7 +45,23 @@ security_group_opts = [
         default=True,
         help=_('Use ipset to speed-up the iptables based security groups. '
                'Enabling ipset support requires that ipset is installed on L2 '
-               'agent node.'))
+               'agent node.')),
+    cfg.BoolOpt(
+        'async_conntrack_purge',
+        default=False,
+        help=_('Delete the conntrack entries made stale by security group '
+               'changes from a background worker instead of waiting for '
+               'them while the ports are being processed. Pending '
+               'deletions are de-duplicated and run zone by zone.')),
+    cfg.BoolOpt(
+        'shared_sg_chains',
+        default=False,
+        help=_('Render the rules of each security group once, into a chain '
+               'shared by all the ports of this host using that group, '
+               'and make the port chains jump into it instead of holding '
+               'a copy of the rules. Matches are tracked with the '
+               '0x40000000 bit of the packet mark, which must not be used '
+               'by anything else on the host. It requires enable_ipset.'))
 ]
 cfg.CONF.register_opts(security_group_opts, 'SECURITYGROUP')
 
@@ -110,6 +127,17 @@ class SecurityGroupAgentRpc(object):
         self.devices_to_refilter = set()
         # Flag raised when a global refresh is needed
         self.global_refresh_firewall = False
+        # Stores devices for which firewall should be refreshed from the
+        # security group information already known by the agent
+        self.devices_to_reapply = set()
+        # The security group rules and member IPs received from the server,
+        # the deltas of the update notifications are applied to them
+        self._security_groups = {}
+        self._security_group_member_ips = {}
+        # The last sequence number of the notifications of each sender
+        self._security_group_sequences = {}
+        # Number of security_group_info_for_devices calls in progress
+        self._security_group_pulls = 0
         self._use_enhanced_rpc = None
 
     @property
@@ -150,8 +178,7 @@ class SecurityGroupAgentRpc(object):
             return
         LOG.info(_LI("Preparing filters for devices %s"), device_ids)
         if self.use_enhanced_rpc:
-            devices_info = self.plugin_rpc.security_group_info_for_devices(
-                self.context, list(device_ids))
+            devices_info = self._get_security_group_info(list(device_ids))
             devices = devices_info['devices']
             security_groups = devices_info['security_groups']
             security_group_member_ips = devices_info['sg_member_ips']
@@ -168,32 +195,54 @@ class SecurityGroupAgentRpc(object):
             for device in devices.values():
                 self.firewall.prepare_port_filter(device)
 
+    def _get_security_group_info(self, device_ids):
+        self._security_group_pulls += 1
+        try:
+            return self.plugin_rpc.security_group_info_for_devices(
+                self.context, device_ids)
+        finally:
+            self._security_group_pulls -= 1
+
     def _update_security_group_info(self, security_groups,
                                     security_group_member_ips):
         LOG.debug("Update security group information")
+        self._security_groups.update(security_groups)
+        self._security_group_member_ips.update(security_group_member_ips)
         for sg_id, sg_rules in security_groups.items():
-            self.firewall.update_security_group_rules(sg_id, sg_rules)
+            # the firewall may rewrite the rules it is given, the deltas
+            # must be applied to the rules as received from the server
+            self.firewall.update_security_group_rules(
+                sg_id, [dict(rule) for rule in sg_rules])
         for remote_sg_id, member_ips in security_group_member_ips.items():
             self.firewall.update_security_group_members(
                 remote_sg_id, member_ips)
 
-    def security_groups_rule_updated(self, security_groups):
+    def security_groups_rule_updated(self, security_groups, rule_deltas=None,
+                                     sequence=None):
         LOG.info(_LI("Security group "
                  "rule updated %r"), security_groups)
+        reapply = (self._check_security_group_sequence(sequence) and
+                   self._apply_security_group_rule_deltas(rule_deltas))
         self._security_group_updated(
             security_groups,
             'security_groups',
-            'sg_rule')
+            'sg_rule',
+            reapply)
 
-    def security_groups_member_updated(self, security_groups):
+    def security_groups_member_updated(self, security_groups,
+                                       member_deltas=None, sequence=None):
         LOG.info(_LI("Security group "
                  "member updated %r"), security_groups)
+        reapply = (self._check_security_group_sequence(sequence) and
+                   self._apply_security_group_member_deltas(member_deltas))
         self._security_group_updated(
             security_groups,
             'security_group_source_groups',
-            'sg_member')
+            'sg_member',
+            reapply)
 
-    def _security_group_updated(self, security_groups, attribute, action_type):
+    def _security_group_updated(self, security_groups, attribute, action_type,
+                                reapply=False):
         devices = []
         sec_grp_set = set(security_groups)
         for device in self.firewall.ports.values():
@@ -206,10 +255,93 @@ class SecurityGroupAgentRpc(object):
                 LOG.debug("Adding %s devices to the list of devices "
                           "for which firewall needs to be refreshed",
                           devices)
-                self.devices_to_refilter |= set(devices)
+                if reapply:
+                    self.devices_to_reapply |= set(devices)
+                else:
+                    self.devices_to_refilter |= set(devices)
+            elif reapply:
+                self.reapply_firewall(devices)
             else:
                 self.refresh_firewall(devices)
 
+    def _check_security_group_sequence(self, sequence):
+        """Check that no notification of the sender was missed.
+
+        Returns True when the deltas of the notification can be applied to
+        the known security group information. The first notification of a
+        sender is handled like one without deltas since the notifications
+        sent before it can't be checked. A gap in the sequence means that
+        the changes of any group may have been missed, so all the known
+        information is forgotten and the devices of the notified groups
+        pull it again, the other groups being pulled when they are next
+        notified. The deltas are not applied while
+        security_group_info_for_devices is called either, since the
+        information it returns may be older or newer than them.
+        """
+        if not sequence:
+            return False
+        sender = sequence['sender']
+        number = sequence['number']
+        last_number = self._security_group_sequences.get(sender)
+        self._security_group_sequences[sender] = number
+        if last_number is None:
+            return False
+        if number != last_number + 1:
+            LOG.warning(_LW("Security group notifications from %(sender)s "
+                            "were missed (expected %(expected)d, got "
+                            "%(number)d), requesting the security group "
+                            "information again"),
+                        {'sender': sender, 'expected': last_number + 1,
+                         'number': number})
+            self._security_groups.clear()
+            self._security_group_member_ips.clear()
+            return False
+        return not self._security_group_pulls
+
+    def _apply_security_group_rule_deltas(self, rule_deltas):
+        if not rule_deltas or not self.use_enhanced_rpc:
+            return False
+        sg_ids = set(rule_deltas) & set(self._security_groups)
+        for sg_id in sg_ids:
+            for rule in rule_deltas[sg_id].get('added', []):
+                remote_sg_id = rule.get('remote_group_id')
+                if remote_sg_id and rule['ethertype'] not in (
+                        self._security_group_member_ips.get(remote_sg_id,
+                                                            {})):
+                    # the members of the remote group must be requested
+                    return False
+        for sg_id in sg_ids:
+            removed_rules = rule_deltas[sg_id].get('removed', [])
+            rules = [rule for rule in self._security_groups[sg_id]
+                     if rule not in removed_rules]
+            for rule in rule_deltas[sg_id].get('added', []):
+                if rule not in rules:
+                    rules.append(rule)
+            self._security_groups[sg_id] = rules
+        return True
+
+    def _apply_security_group_member_deltas(self, member_deltas):
+        if not member_deltas or not self.use_enhanced_rpc:
+            return False
+        for sg_id, member_delta in member_deltas.items():
+            if sg_id not in self._security_group_member_ips:
+                continue
+            # the lists may be shared with the firewall, so copy them
+            member_ips = dict(
+                (ethertype, list(ips)) for ethertype, ips in
+                self._security_group_member_ips[sg_id].items())
+            for ip in member_delta.get('removed', []):
+                ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
+                if ip in member_ips.get(ethertype, []):
+                    member_ips[ethertype].remove(ip)
+            for ip in member_delta.get('added', []):
+                ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
+                if (ethertype in member_ips and
+                        ip not in member_ips[ethertype]):
+                    member_ips[ethertype].append(ip)
+            self._security_group_member_ips[sg_id] = member_ips
+        return True
+
     def security_groups_provider_updated(self, devices_to_update):
         LOG.info(_LI("Provider rule updated"))
         if self.defer_refresh_firewall:
@@ -230,6 +362,23 @@ class SecurityGroupAgentRpc(object):
                 if not device:
                     continue
                 self.firewall.remove_port_filter(device)
+        self._prune_security_group_info()
+
+    def _prune_security_group_info(self):
+        """Forget the security groups the remaining devices don't use."""
+        sg_ids = set()
+        remote_sg_ids = set()
+        for device in self.firewall.ports.values():
+            sg_ids.update(device.get('security_groups', []))
+            remote_sg_ids.update(
+                device.get('security_group_source_groups', []))
+        for sg_id in set(self._security_groups) - sg_ids:
+            del self._security_groups[sg_id]
+        for sg_rules in self._security_groups.values():
+            remote_sg_ids.update(rule['remote_group_id'] for rule in sg_rules
+                                 if rule.get('remote_group_id'))
+        for sg_id in set(self._security_group_member_ips) - remote_sg_ids:
+            del self._security_group_member_ips[sg_id]
 
     @skip_if_noopfirewall_or_firewall_disabled
     def refresh_firewall(self, device_ids=None):
@@ -239,28 +388,97 @@ class SecurityGroupAgentRpc(object):
             if not device_ids:
                 LOG.info(_LI("No ports here to refresh firewall"))
                 return
+            # all the filters are refreshed, read them again from the host
+            self.firewall.invalidate_saved_state()
         if self.use_enhanced_rpc:
-            devices_info = self.plugin_rpc.security_group_info_for_devices(
-                self.context, device_ids)
-            devices = devices_info['devices']
-            security_groups = devices_info['security_groups']
-            security_group_member_ips = devices_info['sg_member_ips']
-        else:
-            devices = self.plugin_rpc.security_group_rules_for_devices(
-                self.context, device_ids)
+            devices_info = self._get_security_group_info(device_ids)
+            self._apply_security_group_info(
+                devices_info['devices'], devices_info['security_groups'],
+                devices_info['sg_member_ips'])
+            return
 
+        devices = self.plugin_rpc.security_group_rules_for_devices(
+            self.context, device_ids)
         with self.firewall.defer_apply():
-            if self.use_enhanced_rpc:
-                LOG.debug("Update security group information for ports %s",
-                          devices.keys())
-                self._update_security_group_info(
-                    security_groups, security_group_member_ips)
+            for device in devices.values():
+                LOG.debug("Update port filter for %s", device['device'])
+                self.firewall.update_port_filter(device)
+
+    def invalidate_firewall_state(self):
+        """Make the next firewall update read the state from the host.
+
+        It is called by the agents when they resync with the plugin.
+        """
+        self.firewall.invalidate_saved_state()
+
+    @skip_if_noopfirewall_or_firewall_disabled
+    def reapply_firewall(self, device_ids):
+        """Refresh the firewall of devices without requesting the server.
+
+        The security group information already known by the agent, with
+        the deltas of the update notifications applied, is used.
+        """
+        LOG.info(_LI("Reapply firewall rules"))
+        devices = {}
+        security_groups = {}
+        security_group_member_ips = {}
+        for device_id in device_ids:
+            device = self.firewall.ports.get(device_id)
+            if not device:
+                continue
+            sg_ids = device.get('security_groups', [])
+            if not set(sg_ids) <= set(self._security_groups):
+                return self.refresh_firewall(device_ids)
+            remote_sg_ids = []
+            for sg_id in sg_ids:
+                security_groups[sg_id] = self._security_groups[sg_id]
+                for rule in security_groups[sg_id]:
+                    remote_sg_id = rule.get('remote_group_id')
+                    if remote_sg_id and remote_sg_id not in remote_sg_ids:
+                        remote_sg_ids.append(remote_sg_id)
+            if not set(remote_sg_ids) <= set(self._security_group_member_ips):
+                return self.refresh_firewall(device_ids)
+            for remote_sg_id in remote_sg_ids:
+                security_group_member_ips[remote_sg_id] = (
+                    self._security_group_member_ips[remote_sg_id])
+            # keep the order of the remote groups still referenced
+            source_groups = [
+                sg_id for sg_id in
+                device.get('security_group_source_groups', [])
+                if sg_id in remote_sg_ids]
+            source_groups.extend(sg_id for sg_id in remote_sg_ids
+                                 if sg_id not in source_groups)
+            device = dict(device)
+            device['security_group_source_groups'] = source_groups
+            devices[device_id] = device
+        if devices:
+            self._apply_security_group_info(
+                devices, security_groups, security_group_member_ips)
+
+    def _apply_security_group_info(self, devices, security_groups,
+                                   security_group_member_ips):
+        # member updates usually only need the remote group ipsets
+        # changed, avoid rebuilding the port filters for them
+        if self.firewall.apply_security_group_members(
+                devices, security_groups, security_group_member_ips):
+            LOG.debug("Updated security group members for ports %s",
+                      devices.keys())
+            self._security_groups.update(security_groups)
+            self._security_group_member_ips.update(security_group_member_ips)
+            return
+
+        with self.firewall.defer_apply():
+            LOG.debug("Update security group information for ports %s",
+                      devices.keys())
+            self._update_security_group_info(
+                security_groups, security_group_member_ips)
             for device in devices.values():
                 LOG.debug("Update port filter for %s", device['device'])
                 self.firewall.update_port_filter(device)
 
     def firewall_refresh_needed(self):
-        return self.global_refresh_firewall or self.devices_to_refilter
+        return (self.global_refresh_firewall or self.devices_to_refilter or
+                self.devices_to_reapply)
 
     def setup_port_filters(self, new_devices, updated_devices):
         """Configure port filters for devices.
@@ -276,8 +494,10 @@ class SecurityGroupAgentRpc(object):
         # These data structures are cleared here in order to avoid
         # losing updates occurring during firewall refresh
         devices_to_refilter = self.devices_to_refilter
+        devices_to_reapply = self.devices_to_reapply
         global_refresh_firewall = self.global_refresh_firewall
         self.devices_to_refilter = set()
+        self.devices_to_reapply = set()
         self.global_refresh_firewall = False
         # We must call prepare_devices_filter() after we've grabbed
         # self.devices_to_refilter since an update for a new port
@@ -305,6 +525,11 @@ class SecurityGroupAgentRpc(object):
                 LOG.debug("Refreshing firewall for %d devices",
                           len(updated_devices))
                 self.refresh_firewall(updated_devices)
+            devices_to_reapply -= updated_devices | new_devices
+            if devices_to_reapply:
+                LOG.debug("Reapplying firewall for %d devices",
+                          len(devices_to_reapply))
+                self.reapply_firewall(devices_to_reapply)
 
 
 # TODO(armax): for bw compat with external dependencies; to be dropped in M.
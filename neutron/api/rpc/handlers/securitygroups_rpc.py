@@ -12,8 +12,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import itertools
+import os
+
 from oslo_log import log as logging
 import oslo_messaging
+from oslo_utils import uuidutils
 
 from neutron._i18n import _LW
 from neutron.common import constants
@@ -126,32 +130,76 @@ class SecurityGroupAgentRpcApiMixin(object):
 
     # history
     #   1.1 Support Security Group RPC
+    #   1.3 Added param devices_to_update to security_groups_provider_updated
+    #   1.5 Added params rule_deltas, member_deltas and sequence to
+    #       security_groups_rule_updated and security_groups_member_updated
     SG_RPC_VERSION = "1.1"
+    # version of the rule and member notifications carrying deltas
+    SG_DELTAS_RPC_VERSION = "1.5"
 
     def _get_security_group_topic(self):
         return topics.get_topic_name(self.topic,
                                      topics.SECURITY_GROUP,
                                      topics.UPDATE)
 
-    def security_groups_rule_updated(self, context, security_groups):
-        """Notify rule updated security groups."""
-        if not security_groups:
-            return
-        cctxt = self.client.prepare(version=self.SG_RPC_VERSION,
+    # sender and sequence number of the notifications sent by this process
+    _sg_sequence = None
+
+    def _get_security_group_sequence(self):
+        """Return the sequence of the next rule or member notification.
+
+        Each server process numbers its notifications on its own, the
+        sender is regenerated after a fork so that the API workers do not
+        share it.
+        """
+        pid = os.getpid()
+        if self._sg_sequence is None or self._sg_sequence[0] != pid:
+            self._sg_sequence = (pid, uuidutils.generate_uuid(),
+                                 itertools.count(1))
+        return {'sender': self._sg_sequence[1],
+                'number': next(self._sg_sequence[2])}
+
+    def _notify_security_groups_updated(self, context, method,
+                                        security_groups, deltas_key, deltas):
+        kwargs = {'security_groups': security_groups}
+        version = self.SG_RPC_VERSION
+        # NOTE: the deltas are only sent when the security_group_rpc_deltas
+        # option is enabled, which must only be done once all the agents
+        # implement version 1.5, so the version can be required for them.
+        if deltas is not None:
+            kwargs[deltas_key] = deltas
+            kwargs['sequence'] = self._get_security_group_sequence()
+            version = self.SG_DELTAS_RPC_VERSION
+        cctxt = self.client.prepare(version=version,
                                     topic=self._get_security_group_topic(),
                                     fanout=True)
-        cctxt.cast(context, 'security_groups_rule_updated',
-                   security_groups=security_groups)
+        cctxt.cast(context, method, **kwargs)
 
-    def security_groups_member_updated(self, context, security_groups):
-        """Notify member updated security groups."""
+    def security_groups_rule_updated(self, context, security_groups,
+                                     rule_deltas=None):
+        """Notify rule updated security groups.
+
+        :param rule_deltas: optional {sg_id: {'added': [rule1],
+                            'removed': [rule2]}} of the changed rules
+        """
         if not security_groups:
             return
-        cctxt = self.client.prepare(version=self.SG_RPC_VERSION,
-                                    topic=self._get_security_group_topic(),
-                                    fanout=True)
-        cctxt.cast(context, 'security_groups_member_updated',
-                   security_groups=security_groups)
+        self._notify_security_groups_updated(
+            context, 'security_groups_rule_updated', security_groups,
+            'rule_deltas', rule_deltas)
+
+    def security_groups_member_updated(self, context, security_groups,
+                                       member_deltas=None):
+        """Notify member updated security groups.
+
+        :param member_deltas: optional {sg_id: {'added': [ip1],
+                              'removed': [ip2]}} of the changed member IPs
+        """
+        if not security_groups:
+            return
+        self._notify_security_groups_updated(
+            context, 'security_groups_member_updated', security_groups,
+            'member_deltas', member_deltas)
 
     def security_groups_provider_updated(self, context,
                                          devices_to_update=None):
@@ -193,25 +241,42 @@ class SecurityGroupAgentRpcCallbackMixin(object):
         """Callback for security group rule update.
 
         :param security_groups: list of updated security_groups
+        :param rule_deltas: optional rules added to and removed from them
+        :param sequence: sender and number of the notification
         """
         security_groups = kwargs.get('security_groups', [])
         LOG.debug("Security group rule updated on remote: %s",
                   security_groups)
         if not self.sg_agent:
             return self._security_groups_agent_not_set()
-        self.sg_agent.security_groups_rule_updated(security_groups)
+        sequence = kwargs.get('sequence')
+        if sequence:
+            self.sg_agent.security_groups_rule_updated(
+                security_groups, rule_deltas=kwargs.get('rule_deltas'),
+                sequence=sequence)
+        else:
+            self.sg_agent.security_groups_rule_updated(security_groups)
 
     def security_groups_member_updated(self, context, **kwargs):
         """Callback for security group member update.
 
         :param security_groups: list of updated security_groups
+        :param member_deltas: optional member IPs added to and removed from
+                              them
+        :param sequence: sender and number of the notification
         """
         security_groups = kwargs.get('security_groups', [])
         LOG.debug("Security group member updated on remote: %s",
                   security_groups)
         if not self.sg_agent:
             return self._security_groups_agent_not_set()
-        self.sg_agent.security_groups_member_updated(security_groups)
+        sequence = kwargs.get('sequence')
+        if sequence:
+            self.sg_agent.security_groups_member_updated(
+                security_groups, member_deltas=kwargs.get('member_deltas'),
+                sequence=sequence)
+        else:
+            self.sg_agent.security_groups_member_updated(security_groups)
 
     def security_groups_provider_updated(self, context, **kwargs):
         """Callback for security group provider update."""
@@ -155,6 +155,22 @@ core_opts = [
     cfg.IntOpt('send_events_interval', default=2,
                help=_('Number of seconds between sending events to nova if '
                       'there are any events to send.')),
+    cfg.IntOpt('security_group_info_cache_time', default=0,
+               help=_('Number of seconds the rules of security groups '
+                      'are kept cached by the server after being last used '
+                      'to answer the security group RPC calls of the L2 '
+                      'agents, 0 disables the cache. The cached rules of a '
+                      'group are checked against the ids of its rules in '
+                      'the database each time they are used.')),
+    cfg.BoolOpt('security_group_rpc_deltas', default=False,
+                help=_('Send the rules and member IPs added to and removed '
+                       'from the security groups along with the security '
+                       'group update notifications, so that the L2 agents '
+                       'supporting it can apply them without requesting '
+                       'the security group information again. It must '
+                       'only be enabled once all the L2 agents support '
+                       'version 1.5 of the security group agent RPC '
+                       'API.')),
     cfg.BoolOpt('advertise_mtu', default=True,
                 help=_('If True, advertise network MTU values if core plugin '
                        'calculates them. Currently, the only way to advertise '
@@ -13,7 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 import netaddr
+from oslo_config import cfg
 from oslo_log import log as logging
 from sqlalchemy.orm import exc
 
@@ -24,6 +27,7 @@ from neutron.common import utils
 from neutron.db import allowedaddresspairs_db as addr_pair
 from neutron.db import models_v2
 from neutron.db import securitygroups_db as sg_db
+from neutron.extensions import allowedaddresspairs as ext_addr_pair
 from neutron.extensions import securitygroup as ext_sg
 
 LOG = logging.getLogger(__name__)
@@ -35,9 +39,63 @@ DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
 DHCP_RULE_PORT = {4: (67, 68, n_const.IPv4), 6: (547, 546, n_const.IPv6)}
 
 
+class SecurityGroupRulesCache(object):
+    """Cache of the rules of security groups.
+
+    The rules are kept in the format sent to the agents by
+    security_group_info_for_ports, along with the ids of the rules they
+    were built from. Security group rules can only be created and deleted,
+    so an entry is valid as long as its group has the same rule ids in the
+    DB. Any server process can change the rules, so the ids are checked
+    each time an entry is used. Entries not used for cache_time seconds
+    are dropped.
+    """
+
+    def __init__(self, cache_time):
+        self.cache_time = cache_time
+        # security group id -> (time last used, rule ids, rules)
+        self._rules = {}
+        self._expired_at = time.time()
+
+    def get_rules(self, rule_ids_by_group):
+        """Return the cached rules of the groups whose rules are unchanged.
+
+        :param rule_ids_by_group: {sg_id: set of the ids of its rules}
+        """
+        now = time.time()
+        found = {}
+        for sg_id, rule_ids in rule_ids_by_group.items():
+            entry = self._rules.get(sg_id)
+            if entry is not None and entry[1] == rule_ids:
+                self._rules[sg_id] = (now, entry[1], entry[2])
+                found[sg_id] = entry[2]
+        self._expire(now)
+        return found
+
+    def set_rules(self, sg_id, rule_ids, rules):
+        self._rules[sg_id] = (time.time(), frozenset(rule_ids), rules)
+
+    def _expire(self, now):
+        if now - self._expired_at < self.cache_time:
+            return
+        self._expired_at = now
+        for sg_id, entry in list(self._rules.items()):
+            if now - entry[0] >= self.cache_time:
+                del self._rules[sg_id]
+
+
 class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
     """Mixin class to add agent-based security group implementation."""
 
+    _sg_rules_cache = None
+
+    def _get_sg_rules_cache(self):
+        if (self._sg_rules_cache is None and
+                cfg.CONF.security_group_info_cache_time > 0):
+            self._sg_rules_cache = SecurityGroupRulesCache(
+                cfg.CONF.security_group_info_cache_time)
+        return self._sg_rules_cache
+
     def get_port_from_device(self, context, device):
         """Get port dict from device name on an agent.
 
@@ -72,24 +130,36 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         rule = super(SecurityGroupServerRpcMixin,
                      self).create_security_group_rule(context,
                                                       security_group_rule)
-        sgids = [rule['security_group_id']]
-        self.notifier.security_groups_rule_updated(context, sgids)
+        self._notify_security_groups_rule_updated(context, [rule], 'added')
         return rule
 
     def create_security_group_rule_bulk(self, context, security_group_rules):
         rules = super(SecurityGroupServerRpcMixin,
                       self).create_security_group_rule_bulk_native(
                           context, security_group_rules)
-        sgids = set([r['security_group_id'] for r in rules])
-        self.notifier.security_groups_rule_updated(context, list(sgids))
+        self._notify_security_groups_rule_updated(context, rules, 'added')
         return rules
 
     def delete_security_group_rule(self, context, sgrid):
         rule = self.get_security_group_rule(context, sgrid)
         super(SecurityGroupServerRpcMixin,
               self).delete_security_group_rule(context, sgrid)
-        self.notifier.security_groups_rule_updated(context,
-                                                   [rule['security_group_id']])
+        self._notify_security_groups_rule_updated(context, [rule], 'removed')
+
+    def _notify_security_groups_rule_updated(self, context, rules, change):
+        sgids = []
+        rule_deltas = {}
+        for rule in rules:
+            sgid = rule['security_group_id']
+            if sgid not in rule_deltas:
+                sgids.append(sgid)
+                rule_deltas[sgid] = {'added': [], 'removed': []}
+            rule_deltas[sgid][change].append(self._make_rule_info_dict(rule))
+        if cfg.CONF.security_group_rpc_deltas:
+            self.notifier.security_groups_rule_updated(
+                context, sgids, rule_deltas=rule_deltas)
+        else:
+            self.notifier.security_groups_rule_updated(context, sgids)
 
     def check_and_notify_security_group_member_changed(
             self, context, original_port, updated_port):
@@ -100,7 +170,9 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
             self.notify_security_groups_member_updated_bulk(
                 context, [original_port, updated_port])
         elif original_port['fixed_ips'] != updated_port['fixed_ips']:
-            self.notify_security_groups_member_updated(context, updated_port)
+            # the original port is needed for the removed member IPs
+            self.notify_security_groups_member_updated_bulk(
+                context, [original_port, updated_port])
 
     def is_security_group_member_updated(self, context,
                                          original_port, updated_port):
@@ -132,6 +204,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
         """
         sg_provider_updated_networks = set()
         sec_groups = set()
+        member_ports = []
         for port in ports:
             if port['device_owner'] == n_const.DEVICE_OWNER_DHCP:
                 sg_provider_updated_networks.add(
@@ -148,6 +221,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                         port['network_id'])
             else:
                 sec_groups |= set(port.get(ext_sg.SECURITYGROUPS))
+                member_ports.append(port)
 
         if sg_provider_updated_networks:
             ports_query = context.session.query(models_v2.Port.id).filter(
@@ -157,13 +231,48 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
             self.notifier.security_groups_provider_updated(
                 context, ports_to_update)
         if sec_groups:
-            self.notifier.security_groups_member_updated(
-                context, list(sec_groups))
+            if cfg.CONF.security_group_rpc_deltas:
+                self.notifier.security_groups_member_updated(
+                    context, list(sec_groups),
+                    member_deltas=self._get_member_deltas(
+                        context, member_ports))
+            else:
+                self.notifier.security_groups_member_updated(
+                    context, list(sec_groups))
+
+    def _get_member_deltas(self, context, ports):
+        """Return the member IPs of the ports added to and removed from
+        their security groups.
+
+        The ports may be the created, deleted, original or updated ones, so
+        their IPs are compared with the current members of the groups,
+        which also keeps an IP used by another member of the group.
+        """
+        port_ips_by_group = {}
+        for port in ports:
+            ips = set(fixed_ip['ip_address']
+                      for fixed_ip in port.get('fixed_ips') or [])
+            ips.update(pair['ip_address'] for pair in
+                       port.get(ext_addr_pair.ADDRESS_PAIRS) or [])
+            for sg_id in port.get(ext_sg.SECURITYGROUPS) or []:
+                port_ips_by_group.setdefault(sg_id, set()).update(ips)
+        member_ips = self._select_ips_for_remote_group(
+            context, port_ips_by_group.keys())
+        member_deltas = {}
+        for sg_id, ips in port_ips_by_group.items():
+            member_deltas[sg_id] = {
+                'added': sorted(ips & member_ips[sg_id]),
+                'removed': sorted(ips - member_ips[sg_id])}
+        return member_deltas
 
     def notify_security_groups_member_updated(self, context, port):
         self.notify_security_groups_member_updated_bulk(context, [port])
 
     def security_group_info_for_ports(self, context, ports):
+        cache = self._get_sg_rules_cache()
+        if cache:
+            return self._security_group_info_for_ports_cached(
+                context, ports, cache)
         sg_info = {'devices': ports,
                    'security_groups': {},
                    'sg_member_ips': {}}
@@ -190,19 +299,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                     # this set will be serialized into a list by rpc code
                     remote_security_group_info[remote_gid][ethertype] = set()
 
-            direction = rule_in_db['direction']
-            rule_dict = {
-                'direction': direction,
-                'ethertype': ethertype}
-
-            for key in ('protocol', 'port_range_min', 'port_range_max',
-                        'remote_ip_prefix', 'remote_group_id'):
-                if rule_in_db.get(key) is not None:
-                    if key == 'remote_ip_prefix':
-                        direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
-                        rule_dict[direction_ip_prefix] = rule_in_db[key]
-                        continue
-                    rule_dict[key] = rule_in_db[key]
+            rule_dict = self._make_rule_info_dict(rule_in_db)
             if security_group_id not in sg_info['security_groups']:
                 sg_info['security_groups'][security_group_id] = []
             if rule_dict not in sg_info['security_groups'][security_group_id]:
@@ -221,6 +318,74 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
 
         return self._get_security_group_member_ips(context, sg_info)
 
+    def _security_group_info_for_ports_cached(self, context, ports, cache):
+        """security_group_info_for_ports using the security group cache.
+
+        Only the ids of the rules of the port security groups are selected
+        to check the cached rules, the rules themselves are only selected
+        for the groups missing from the cache or whose rules changed.
+        """
+        sg_info = {'devices': ports,
+                   'security_groups': {},
+                   'sg_member_ips': {}}
+        sg_ids_by_port = self._select_sg_ids_by_port(context, ports)
+        sg_ids = set()
+        for port_sg_ids in sg_ids_by_port.values():
+            sg_ids.update(port_sg_ids)
+        # the ids must be selected before the rules, so that rules selected
+        # after a change are never cached with the ids they had before it
+        rule_ids = self._select_rule_ids_for_security_groups(context, sg_ids)
+        sg_rules = cache.get_rules(rule_ids)
+        missing_sg_ids = sg_ids - set(sg_rules)
+        if missing_sg_ids:
+            for sg_id, rules in self._select_rules_for_security_groups(
+                    context, missing_sg_ids).items():
+                cache.set_rules(sg_id, rule_ids[sg_id], rules)
+                sg_rules[sg_id] = rules
+
+        remote_security_group_info = {}
+        for port_id, port_sg_ids in sg_ids_by_port.items():
+            source_groups = sg_info['devices'][port_id].setdefault(
+                'security_group_source_groups', [])
+            for sg_id in port_sg_ids:
+                for rule in sg_rules[sg_id]:
+                    remote_gid = rule.get('remote_group_id')
+                    if not remote_gid:
+                        continue
+                    if remote_gid not in source_groups:
+                        source_groups.append(remote_gid)
+                    # this set will be serialized into a list by rpc code
+                    remote_security_group_info.setdefault(
+                        remote_gid, {}).setdefault(rule['ethertype'], set())
+        for sg_id in sg_ids:
+            sg_info['security_groups'][sg_id] = [
+                dict(rule) for rule in sg_rules[sg_id]]
+
+        sg_info['sg_member_ips'] = remote_security_group_info
+        # the provider rules do not belong to any security group, so these
+        # rules still reside in sg_info['devices'] [port_id]
+        self._apply_provider_rule(context, sg_info['devices'])
+
+        # the members change with every port of the groups, they are not
+        # cached since checking them costs as much as selecting them
+        return self._get_security_group_member_ips(context, sg_info)
+
+    def _make_rule_info_dict(self, rule_in_db):
+        direction = rule_in_db['direction']
+        rule_dict = {
+            'direction': direction,
+            'ethertype': rule_in_db['ethertype']}
+
+        for key in ('protocol', 'port_range_min', 'port_range_max',
+                    'remote_ip_prefix', 'remote_group_id'):
+            if rule_in_db.get(key) is not None:
+                if key == 'remote_ip_prefix':
+                    direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
+                    rule_dict[direction_ip_prefix] = rule_in_db[key]
+                    continue
+                rule_dict[key] = rule_in_db[key]
+        return rule_dict
+
     def _get_security_group_member_ips(self, context, sg_info):
         ips = self._select_ips_for_remote_group(
             context, sg_info['sg_member_ips'].keys())
@@ -231,6 +396,43 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                     sg_info['sg_member_ips'][sg_id][ethertype].add(ip)
         return sg_info
 
+    def _select_sg_ids_by_port(self, context, ports):
+        sg_ids_by_port = {}
+        if not ports:
+            return sg_ids_by_port
+        sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
+        sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
+        query = context.session.query(sg_binding_port, sg_binding_sgid)
+        query = query.filter(sg_binding_port.in_(ports.keys()))
+        for port_id, sg_id in query:
+            sg_ids_by_port.setdefault(port_id, []).append(sg_id)
+        return sg_ids_by_port
+
+    def _select_rule_ids_for_security_groups(self, context, sg_ids):
+        rule_ids_by_group = dict((sg_id, set()) for sg_id in sg_ids)
+        if not sg_ids:
+            return rule_ids_by_group
+        sgr_sgid = sg_db.SecurityGroupRule.security_group_id
+        query = context.session.query(sgr_sgid, sg_db.SecurityGroupRule.id)
+        query = query.filter(sgr_sgid.in_(sg_ids))
+        for sg_id, rule_id in query:
+            rule_ids_by_group[sg_id].add(rule_id)
+        return rule_ids_by_group
+
+    def _select_rules_for_security_groups(self, context, sg_ids):
+        rules_by_group = dict((sg_id, []) for sg_id in sg_ids)
+        if not sg_ids:
+            return rules_by_group
+        sgr_sgid = sg_db.SecurityGroupRule.security_group_id
+        query = context.session.query(sg_db.SecurityGroupRule)
+        query = query.filter(sgr_sgid.in_(sg_ids))
+        for rule_in_db in query:
+            rule_dict = self._make_rule_info_dict(rule_in_db)
+            rules = rules_by_group[rule_in_db['security_group_id']]
+            if rule_dict not in rules:
+                rules.append(rule_dict)
+        return rules_by_group
+
     def _select_sg_ids_for_ports(self, context, ports):
         if not ports:
             return []
@@ -174,6 +174,37 @@ class CommonAgentManagerBase(object):
             interface could not be plugged.
         """
 
+    def is_device_plugged(self, network_id, network_segment, device):
+        """Check whether a device is still plugged into its network.
+
+        It is used to validate the devices persisted by a previous run of
+        the agent, which are not plugged again if it returns True. It
+        returns False by default.
+
+        :param network_id: The UUID of the Neutron network
+        :param network_segment: The NetworkSegment object for this network
+        :param device: The device to check
+        """
+        return False
+
+    def setup_networks(self, network_segments):
+        """Set up the networks of the devices about to be plugged.
+
+        It is called before plug_interface is called for the devices, so
+        that a manager can set up the networks concurrently. It does nothing
+        by default.
+
+        :param network_segments: the NetworkSegment of each network, by
+               network id
+        """
+
+    def clear_cache(self):
+        """Drop the state of the host cached by the manager.
+
+        It is called when the agent resyncs with the plugin, so that the
+        state is read again from the host. It does nothing by default.
+        """
+
     @abc.abstractmethod
     def setup_arp_spoofing_protection(self, device, device_details):
         """Setup the arp spoofing protection for the given port.
@@ -26,6 +26,19 @@ agent_opts = [
                help=_("Set new timeout in seconds for new rpc calls after "
                       "agent receives SIGTERM. If value is set to 0, rpc "
                       "timeout won't be changed")),
+    cfg.BoolOpt('monitor_devices', default=False,
+                help=_("Monitor the creation and deletion of the network "
+                       "devices with 'ip monitor link'. The devices are then "
+                       "only listed after such an event, and they are "
+                       "processed as soon as they appear instead of at the "
+                       "next polling interval.")),
+    cfg.StrOpt('device_state_file',
+               help=_("File where the agent persists the network bindings "
+                      "and a fingerprint of the details of its devices "
+                      "whenever they change. On restart, the devices still "
+                      "plugged into their networks whose details did not "
+                      "change on the server are not plugged again. Not "
+                      "persisted if unset.")),
     # TODO(kevinbenton): The following opt is duplicated between the OVS agent
     # and the Linuxbridge agent to make it easy to back-port. These shared opts
     # should be moved into a common agent config options location as part of
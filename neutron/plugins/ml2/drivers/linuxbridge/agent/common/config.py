@@ -60,6 +60,11 @@ bridge_opts = [
     cfg.ListOpt('bridge_mappings',
                 default=DEFAULT_BRIDGE_MAPPINGS,
                 help=_("List of <physical_network>:<physical_bridge>")),
+    cfg.IntOpt('network_setup_workers', default=1, min=1,
+               help=_("Number of green threads setting up the bridges and "
+                      "the VLAN or VXLAN interfaces of distinct networks in "
+                      "parallel when their devices are added. The devices "
+                      "of a network wait for its setup to complete.")),
 ]
 
 
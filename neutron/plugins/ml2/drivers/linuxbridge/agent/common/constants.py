@@ -21,3 +21,6 @@ VXLAN_MCAST = 'multicast_flooding'
 VXLAN_UCAST = 'unicast_flooding'
 
 EXTENSION_DRIVER_TYPE = 'linuxbridge'
+
+# Seconds to wait before respawning the device monitor
+DEFAULT_DEVICE_MONITOR_RESPAWN = 30
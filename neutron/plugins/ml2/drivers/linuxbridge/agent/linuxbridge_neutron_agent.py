@@ -20,22 +20,29 @@
 # Neutron OpenVSwitch Plugin.
 
 import collections
+import contextlib
+import hashlib
 import sys
 import time
 
+import eventlet
 import netaddr
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
+from oslo_serialization import jsonutils
 from oslo_service import loopingcall
 from oslo_service import service
 from oslo_utils import excutils
 from six import moves
 
 from neutron._i18n import _LE, _LI, _LW
+from neutron.agent.common import state_file
 from neutron.agent.l2.extensions import manager as ext_manager
 from neutron.agent.linux import bridge_lib
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ip_monitor
 from neutron.agent.linux import utils
 from neutron.agent import rpc as agent_rpc
 from neutron.agent import securitygroups_rpc as sg_rpc
@@ -63,6 +70,12 @@ BRIDGE_NAME_PREFIX = "brq"
 VXLAN_INTERFACE_PREFIX = "vxlan-"
 
 
+def get_device_fingerprint(device_details):
+    """Return a digest of the details of a device provided by the plugin."""
+    return hashlib.sha1(jsonutils.dumps(
+        device_details, sort_keys=True).encode('utf-8')).hexdigest()
+
+
 class LinuxBridgeManager(amb.CommonAgentManagerBase):
     def __init__(self, bridge_mappings, interface_mappings):
         super(LinuxBridgeManager, self).__init__()
@@ -74,6 +87,14 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
         # VXLAN related parameters:
         self.local_ip = cfg.CONF.VXLAN.local_ip
         self.vxlan_mode = lconst.VXLAN_NONE
+        # FDB and neighbour entries of the VXLAN interfaces, by interface
+        self.fdb_entries = {}
+        self.neigh_entries = {}
+        self._fdb_batch_supported = None
+        self.network_setup_workers = (
+            cfg.CONF.LINUX_BRIDGE.network_setup_workers)
+        # setup of the networks of the devices being plugged, by network id
+        self.network_setups = {}
         if cfg.CONF.VXLAN.enable_vxlan:
             device = self.get_local_ip_device()
             self.validate_vxlan_group_with_local_ip()
@@ -281,6 +302,8 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
                                       "interface."), segmentation_id)
                         return None
             int_vxlan.link.set_up()
+            # forget the entries of a previous interface of the same name
+            self.clear_fdb_entries(interface)
             LOG.debug("Done creating vxlan interface %s", interface)
         return interface
 
@@ -374,10 +397,41 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
                 return
         return bridge_name
 
+    def setup_networks(self, network_segments):
+        """Set up the bridges of distinct networks concurrently.
+
+        The setup of each network is spawned in a pool bounded by the
+        network_setup_workers option, plug_interface then waits for the
+        setup of the network of its device.
+        """
+        self.network_setups = {}
+        if self.network_setup_workers <= 1:
+            return
+        pool = eventlet.GreenPool(size=self.network_setup_workers)
+        for network_id, segment in network_segments.items():
+            if segment.network_type == p_const.TYPE_LOCAL:
+                continue
+            self.network_setups[network_id] = pool.spawn(
+                self.ensure_physical_in_bridge, network_id,
+                segment.network_type, segment.physical_network,
+                segment.segmentation_id)
+
     def ensure_physical_in_bridge(self, network_id,
                                   network_type,
                                   physical_network,
                                   segmentation_id):
+        # the devices of a network being plugged concurrently, its setup
+        # must not race with itself
+        with lockutils.lock('linuxbridge-network-%s' % network_id):
+            return self._ensure_physical_in_bridge(network_id,
+                                                   network_type,
+                                                   physical_network,
+                                                   segmentation_id)
+
+    def _ensure_physical_in_bridge(self, network_id,
+                                   network_type,
+                                   physical_network,
+                                   segmentation_id):
         if network_type == p_const.TYPE_VXLAN:
             if self.vxlan_mode == lconst.VXLAN_NONE:
                 LOG.error(_LE("Unable to add vxlan interface for network %s"),
@@ -440,10 +494,13 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
         if network_type == p_const.TYPE_LOCAL:
             self.ensure_local_bridge(network_id, bridge_name)
         else:
-            phy_dev_name = self.ensure_physical_in_bridge(network_id,
-                                                          network_type,
-                                                          physical_network,
-                                                          segmentation_id)
+            network_setup = self.network_setups.get(network_id)
+            if network_setup:
+                phy_dev_name = network_setup.wait()
+            else:
+                phy_dev_name = self.ensure_physical_in_bridge(
+                    network_id, network_type, physical_network,
+                    segmentation_id)
             if not phy_dev_name:
                 return False
             self.ensure_tap_mtu(tap_device_name, phy_dev_name)
@@ -473,6 +530,28 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
         phy_dev_mtu = ip_lib.IPDevice(phy_dev_name).link.mtu
         ip_lib.IPDevice(tap_dev_name).link.set_mtu(phy_dev_mtu)
 
+    def is_device_plugged(self, network_id, network_segment, device):
+        bridge = bridge_lib.BridgeDevice.get_interface_bridge(device)
+        physical_network = network_segment.physical_network
+        bridge_name = (self.get_existing_bridge_name(physical_network) or
+                       self.get_bridge_name(network_id))
+        if not bridge or bridge.name != bridge_name:
+            return False
+        physical_interface = self.interface_mappings.get(physical_network)
+        if network_segment.network_type == p_const.TYPE_VXLAN:
+            interface = self.get_vxlan_device_name(
+                network_segment.segmentation_id)
+        elif self.get_existing_bridge_name(physical_network):
+            interface = None
+        elif network_segment.network_type == p_const.TYPE_VLAN:
+            interface = self.get_subinterface_name(
+                physical_interface, network_segment.segmentation_id)
+        elif network_segment.network_type == p_const.TYPE_FLAT:
+            interface = physical_interface
+        else:
+            interface = None
+        return not interface or bridge.owns_interface(interface)
+
     def plug_interface(self, network_id, network_segment, tap_name,
                        device_owner):
         return self.add_tap_interface(network_id, network_segment.network_type,
@@ -544,6 +623,7 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
                       interface)
             device.link.set_down()
             device.link.delete()
+            self.clear_fdb_entries(interface)
             LOG.debug("Done deleting interface %s", interface)
 
     def get_all_devices(self):
@@ -615,58 +695,194 @@ class LinuxBridgeManager(amb.CommonAgentManagerBase):
             raise exceptions.VxlanNetworkUnsupported()
         LOG.debug('Using %s VXLAN mode', self.vxlan_mode)
 
+    def _get_fdb_entries(self, interface):
+        """Return the FDB entries of a VXLAN interface, by MAC address.
+
+        The entries are read from the kernel the first time the interface is
+        used, and then kept in sync with the updates made by the agent. They
+        are only used to check whether entries exist, and are read again
+        after a failed update, a resync or the creation of the interface.
+        """
+        if interface not in self.fdb_entries:
+            entries = {}
+            output = utils.execute(['bridge', 'fdb', 'show', 'dev',
+                                    interface],
+                                   run_as_root=True)
+            for line in output.splitlines():
+                fields = line.split()
+                if not fields:
+                    continue
+                dsts = entries.setdefault(fields[0], set())
+                if 'dst' in fields[1:-1]:
+                    dsts.add(fields[fields.index('dst') + 1])
+            self.fdb_entries[interface] = entries
+        return self.fdb_entries[interface]
+
+    def _get_neigh_entries(self, interface):
+        """Return the neighbour entries of a VXLAN interface, by IP address.
+
+        As for the FDB entries, they are only read again from the kernel
+        when the interface is created or on a resync.
+        """
+        if interface not in self.neigh_entries:
+            entries = {}
+            output = utils.execute(['ip', 'neigh', 'show', 'dev', interface],
+                                   run_as_root=True)
+            for line in output.splitlines():
+                fields = line.split()
+                if 'lladdr' in fields[1:-1]:
+                    entries[fields[0]] = fields[fields.index('lladdr') + 1]
+            self.neigh_entries[interface] = entries
+        return self.neigh_entries[interface]
+
+    def clear_fdb_entries(self, interface):
+        self.fdb_entries.pop(interface, None)
+        self.neigh_entries.pop(interface, None)
+
+    def clear_cache(self):
+        self.fdb_entries = {}
+        self.neigh_entries = {}
+
     def fdb_ip_entry_exists(self, mac, ip, interface):
-        entries = utils.execute(['ip', 'neigh', 'show', 'to', ip,
-                                 'dev', interface],
-                                run_as_root=True)
-        return mac in entries
+        return self._get_neigh_entries(interface).get(ip) == mac
 
     def fdb_bridge_entry_exists(self, mac, interface, agent_ip=None):
-        entries = utils.execute(['bridge', 'fdb', 'show', 'dev', interface],
-                                run_as_root=True)
+        dsts = self._get_fdb_entries(interface).get(mac)
+        if dsts is None:
+            return False
         if not agent_ip:
-            return mac in entries
+            return True
 
-        return (agent_ip in entries and mac in entries)
+        return agent_ip in dsts
 
     def add_fdb_ip_entry(self, mac, ip, interface):
+        # the entry is replaced even if known, the kernel may have flushed it
         ip_lib.IPDevice(interface).neigh.add(ip, mac)
+        entries = self.neigh_entries.get(interface)
+        if entries is not None:
+            entries[ip] = mac
 
     def remove_fdb_ip_entry(self, mac, ip, interface):
         ip_lib.IPDevice(interface).neigh.delete(ip, mac)
+        entries = self.neigh_entries.get(interface)
+        if entries is not None and entries.get(ip) == mac:
+            del entries[ip]
+
+    def fdb_batch_supported(self):
+        if self._fdb_batch_supported is None:
+            self._fdb_batch_supported = ip_lib.iproute_arg_supported(
+                ['bridge'], '-batch')
+            if not self._fdb_batch_supported:
+                LOG.warning(_LW('Option "%(option)s" is not supported by '
+                                'command "%(command)s", FDB entries will be '
+                                'updated one by one'),
+                            {'option': '-batch', 'command': 'bridge'})
+        return self._fdb_batch_supported
+
+    @contextlib.contextmanager
+    def fdb_batch(self):
+        """Collect the FDB updates to apply them in a single command.
+
+        The 'bridge fdb' commands issued with the yielded batch are fed to
+        'bridge -batch' when the context exits, instead of forking once per
+        entry.
+        """
+        batch = []
+        try:
+            yield batch
+        finally:
+            # the updates collected before a failure are applied, as they
+            # were when the entries were programmed one by one
+            self.apply_fdb_batch(batch)
 
-    def add_fdb_bridge_entry(self, mac, agent_ip, interface, operation="add"):
-        utils.execute(['bridge', 'fdb', operation, mac, 'dev', interface,
-                       'dst', agent_ip],
-                      run_as_root=True,
-                      check_exit_code=False)
-
-    def remove_fdb_bridge_entry(self, mac, agent_ip, interface):
-        utils.execute(['bridge', 'fdb', 'del', mac, 'dev', interface,
-                       'dst', agent_ip],
-                      run_as_root=True,
-                      check_exit_code=False)
-
-    def add_fdb_entries(self, agent_ip, ports, interface):
-        for mac, ip in ports:
-            if mac != constants.FLOODING_ENTRY[0]:
-                self.add_fdb_ip_entry(mac, ip, interface)
-                self.add_fdb_bridge_entry(mac, agent_ip, interface,
-                                          operation="replace")
-            elif self.vxlan_mode == lconst.VXLAN_UCAST:
-                if self.fdb_bridge_entry_exists(mac, interface):
+    def apply_fdb_batch(self, batch):
+        if not batch:
+            return
+        failed_commands = []
+        if len(batch) == 1 or not self.fdb_batch_supported():
+            for command in batch:
+                try:
+                    utils.execute(['bridge'] + command.split(),
+                                  run_as_root=True)
+                except RuntimeError:
+                    failed_commands.append(command)
+        else:
+            try:
+                # -force carries on with the next commands when one of them
+                # fails, the entries being independent from each other
+                utils.execute(['bridge', '-force', '-batch', '-'],
+                              process_input='\n'.join(batch) + '\n',
+                              run_as_root=True)
+            except RuntimeError:
+                # the commands which failed are not known
+                failed_commands = batch
+        # the FDB entries of the interfaces may not be the ones the agent
+        # expects any more, they are read again from the kernel
+        for command in failed_commands:
+            args = command.split()
+            self.clear_fdb_entries(args[args.index('dev') + 1])
+
+    def _execute_fdb_bridge_command(self, args, batch=None):
+        command = ' '.join(['fdb'] + args)
+        if batch is None:
+            self.apply_fdb_batch([command])
+        else:
+            batch.append(command)
+
+    def add_fdb_bridge_entry(self, mac, agent_ip, interface, operation="add",
+                             batch=None):
+        self._execute_fdb_bridge_command(
+            [operation, mac, 'dev', interface, 'dst', agent_ip], batch)
+        entries = self._get_fdb_entries(interface)
+        if operation == "replace":
+            entries[mac] = set([agent_ip])
+        else:
+            entries.setdefault(mac, set()).add(agent_ip)
+
+    def remove_fdb_bridge_entry(self, mac, agent_ip, interface, batch=None):
+        self._execute_fdb_bridge_command(
+            ['del', mac, 'dev', interface, 'dst', agent_ip], batch)
+        entries = self._get_fdb_entries(interface)
+        dsts = entries.get(mac, set())
+        dsts.discard(agent_ip)
+        if not dsts:
+            entries.pop(mac, None)
+
+    def add_fdb_entries(self, agent_ip, ports, interface, batch=None):
+        with self._get_fdb_batch(batch) as batch:
+            for mac, ip in ports:
+                if mac != constants.FLOODING_ENTRY[0]:
+                    self.add_fdb_ip_entry(mac, ip, interface)
                     self.add_fdb_bridge_entry(mac, agent_ip, interface,
-                                              "append")
-                else:
-                    self.add_fdb_bridge_entry(mac, agent_ip, interface)
-
-    def remove_fdb_entries(self, agent_ip, ports, interface):
-        for mac, ip in ports:
-            if mac != constants.FLOODING_ENTRY[0]:
-                self.remove_fdb_ip_entry(mac, ip, interface)
-                self.remove_fdb_bridge_entry(mac, agent_ip, interface)
-            elif self.vxlan_mode == lconst.VXLAN_UCAST:
-                self.remove_fdb_bridge_entry(mac, agent_ip, interface)
+                                              operation="replace",
+                                              batch=batch)
+                elif self.vxlan_mode == lconst.VXLAN_UCAST:
+                    if self.fdb_bridge_entry_exists(mac, interface):
+                        self.add_fdb_bridge_entry(mac, agent_ip, interface,
+                                                  "append", batch=batch)
+                    else:
+                        self.add_fdb_bridge_entry(mac, agent_ip, interface,
+                                                  batch=batch)
+
+    def remove_fdb_entries(self, agent_ip, ports, interface, batch=None):
+        with self._get_fdb_batch(batch) as batch:
+            for mac, ip in ports:
+                if mac != constants.FLOODING_ENTRY[0]:
+                    self.remove_fdb_ip_entry(mac, ip, interface)
+                    self.remove_fdb_bridge_entry(mac, agent_ip, interface,
+                                                 batch=batch)
+                elif self.vxlan_mode == lconst.VXLAN_UCAST:
+                    self.remove_fdb_bridge_entry(mac, agent_ip, interface,
+                                                 batch=batch)
+
+    @contextlib.contextmanager
+    def _get_fdb_batch(self, batch=None):
+        # the caller applies the batch it provides
+        if batch is not None:
+            yield batch
+        else:
+            with self.fdb_batch() as batch:
+                yield batch
 
     def get_agent_id(self):
         if self.bridge_mappings:
@@ -735,7 +951,9 @@ class LinuxBridgeRpcCallbacks(
     #   1.1 Support Security Group RPC
     #   1.3 Added param devices_to_update to security_groups_provider_updated
     #   1.4 Added support for network_update
-    target = oslo_messaging.Target(version='1.4')
+    #   1.5 Added params rule_deltas, member_deltas and sequence to
+    #       security_groups_rule_updated and security_groups_member_updated
+    target = oslo_messaging.Target(version='1.5')
 
     def network_delete(self, context, **kwargs):
         LOG.debug("network_delete received")
@@ -778,6 +996,10 @@ class LinuxBridgeRpcCallbacks(
 
     def fdb_add(self, context, fdb_entries):
         LOG.debug("fdb_add received")
+        with self.agent.mgr.fdb_batch() as batch:
+            self._fdb_add(fdb_entries, batch)
+
+    def _fdb_add(self, fdb_entries, batch):
         for network_id, values in fdb_entries.items():
             segment = self.network_map.get(network_id)
             if not segment:
@@ -796,10 +1018,15 @@ class LinuxBridgeRpcCallbacks(
 
                 self.agent.mgr.add_fdb_entries(agent_ip,
                                                ports,
-                                               interface)
+                                               interface,
+                                               batch)
 
     def fdb_remove(self, context, fdb_entries):
         LOG.debug("fdb_remove received")
+        with self.agent.mgr.fdb_batch() as batch:
+            self._fdb_remove(fdb_entries, batch)
+
+    def _fdb_remove(self, fdb_entries, batch):
         for network_id, values in fdb_entries.items():
             segment = self.network_map.get(network_id)
             if not segment:
@@ -818,7 +1045,8 @@ class LinuxBridgeRpcCallbacks(
 
                 self.agent.mgr.remove_fdb_entries(agent_ip,
                                                   ports,
-                                                  interface)
+                                                  interface,
+                                                  batch)
 
     def _fdb_chg_ip(self, context, fdb_entries):
         LOG.debug("update chg_ip received")
@@ -875,6 +1103,16 @@ class CommonAgentLoop(service.Service):
         self.quitting_rpc_timeout = quitting_rpc_timeout
         self.agent_type = agent_type
         self.agent_binary = agent_binary
+        # monitors the device updates if monitor_devices is set
+        self.device_monitor = None
+        self.device_state = state_file.StateFile(
+            cfg.CONF.AGENT.device_state_file, 'devices',
+            entry_keys=('network_id', 'network_type', 'physical_network',
+                        'segmentation_id', 'fingerprint'))
+        # bindings and fingerprints of the plugged devices, by device
+        self.device_states = {}
+        # fingerprints of the devices restored from device_state_file
+        self.restored_devices = {}
 
     def _validate_manager_class(self):
         if not isinstance(self.mgr,
@@ -894,6 +1132,12 @@ class CommonAgentLoop(service.Service):
         self.context = context.get_admin_context_without_session()
         self.setup_rpc()
         self.init_extension_manager(self.connection)
+        if cfg.CONF.AGENT.monitor_devices:
+            self.device_monitor = ip_monitor.IPLinkMonitor(
+                run_as_root=False,
+                respawn_interval=lconst.DEFAULT_DEVICE_MONITOR_RESPAWN)
+            self.device_monitor.start()
+        self.restore_device_state()
 
         configurations = {'extensions': self.ext_manager.names()}
         configurations.update(self.mgr.get_agent_configurations())
@@ -915,6 +1159,8 @@ class CommonAgentLoop(service.Service):
 
     def stop(self, graceful=True):
         LOG.info(_LI("Stopping %s agent."), self.agent_type)
+        if self.device_monitor:
+            self.device_monitor.stop()
         if graceful and self.quitting_rpc_timeout:
             self.set_rpc_timeout(self.quitting_rpc_timeout)
         super(CommonAgentLoop, self).stop(graceful)
@@ -991,6 +1237,28 @@ class CommonAgentLoop(service.Service):
             "device": device
         })
 
+    def restore_device_state(self):
+        """Restore the devices persisted by a previous run of the agent.
+
+        A device is only restored if the manager reports it is still plugged
+        into the network it was bound to.
+        """
+        self.restored_devices = {}
+        for device, state in self.device_state.load().items():
+            segment = amb.NetworkSegment(state['network_type'],
+                                         state['physical_network'],
+                                         state['segmentation_id'])
+            if self.mgr.is_device_plugged(state['network_id'], segment,
+                                          device):
+                self.restored_devices[device] = state['fingerprint']
+                self.device_states[device] = state
+        LOG.info(_LI("Restored %d persisted devices"),
+                 len(self.restored_devices))
+
+    def persist_device_state(self):
+        """Persist the states of the plugged devices if they changed."""
+        self.device_state.save(self.device_states)
+
     def process_network_devices(self, device_info):
         resync_a = False
         resync_b = False
@@ -1019,6 +1287,25 @@ class CommonAgentLoop(service.Service):
             # resync is needed
             return True
 
+        # the devices restored on restart are only skipped during the first
+        # iteration, the kernel state could have changed since then
+        restored_devices = set(
+            details['device'] for details in devices_details_list
+            if self.restored_devices.get(details['device']) ==
+            get_device_fingerprint(details))
+        self.restored_devices = {}
+
+        network_segments = {}
+        for device_details in devices_details_list:
+            if ('port_id' in device_details and
+                    device_details['device'] not in restored_devices):
+                network_segments[device_details['network_id']] = (
+                    amb.NetworkSegment(
+                        device_details.get('network_type'),
+                        device_details['physical_network'],
+                        device_details.get('segmentation_id')))
+        self.mgr.setup_networks(network_segments)
+
         for device_details in devices_details_list:
             device = device_details['device']
             LOG.debug("Port %s added", device)
@@ -1026,7 +1313,8 @@ class CommonAgentLoop(service.Service):
             if 'port_id' in device_details:
                 LOG.info(_LI("Port %(device)s updated. Details: %(details)s"),
                          {'device': device, 'details': device_details})
-                if self.prevent_arp_spoofing:
+                restored = device in restored_devices
+                if self.prevent_arp_spoofing and not restored:
                     self.mgr.setup_arp_spoofing_protection(device,
                                                            device_details)
 
@@ -1037,9 +1325,14 @@ class CommonAgentLoop(service.Service):
                 )
                 network_id = device_details['network_id']
                 self.rpc_callbacks.add_network(network_id, segment)
-                interface_plugged = self.mgr.plug_interface(
-                    network_id, segment,
-                    device, device_details['device_owner'])
+                if restored:
+                    LOG.debug("Device %s did not change since it was "
+                              "persisted, skipping plugging", device)
+                    interface_plugged = True
+                else:
+                    interface_plugged = self.mgr.plug_interface(
+                        network_id, segment,
+                        device, device_details['device_owner'])
                 # REVISIT(scheuran): Changed the way how ports admin_state_up
                 # is implemented.
                 #
@@ -1078,10 +1371,19 @@ class CommonAgentLoop(service.Service):
                 # 1) An existing race with libvirt caused by the behavior of
                 #    the old implementation. See Bug #1312016
                 # 2) The new code is much more readable
-                if interface_plugged:
+                if interface_plugged and not restored:
                     self.mgr.ensure_port_admin_state(
                         device,
                         device_details['admin_state_up'])
+                if interface_plugged:
+                    self.device_states[device] = {
+                        'network_id': network_id,
+                        'network_type': segment.network_type,
+                        'physical_network': segment.physical_network,
+                        'segmentation_id': segment.segmentation_id,
+                        'fingerprint': get_device_fingerprint(device_details)}
+                else:
+                    self.device_states.pop(device, None)
                 # update plugin about port status if admin_state is up
                 if device_details['admin_state_up']:
                     if interface_plugged:
@@ -1122,6 +1424,7 @@ class CommonAgentLoop(service.Service):
                 LOG.info(_LI("Port %s updated."), device)
             else:
                 LOG.debug("Device %s not defined on plugin", device)
+            self.device_states.pop(device, None)
             port_id = self._clean_network_ports(device)
             self.ext_manager.delete_port(self.context,
                                          {'device': device,
@@ -1135,7 +1438,7 @@ class CommonAgentLoop(service.Service):
 
         updated_devices = self.rpc_callbacks.get_and_clear_updated_devices()
 
-        current_devices = self.mgr.get_all_devices()
+        current_devices = self._get_current_devices(previous, sync)
         device_info['current'] = current_devices
 
         if previous is None:
@@ -1171,6 +1474,24 @@ class CommonAgentLoop(service.Service):
 
         return device_info
 
+    def _get_current_devices(self, previous, sync):
+        if self.device_monitor is not None:
+            if (previous is not None and not sync and
+                    not self.device_monitor.has_updates):
+                # no device was created or deleted since the previous scan
+                return previous['current']
+            # the devices updated after this point are listed next time
+            self.device_monitor.get_events()
+        return self.mgr.get_all_devices()
+
+    def _wait_for_devices(self, timeout):
+        if self.device_monitor is None:
+            time.sleep(timeout)
+        else:
+            # the devices are processed as soon as they are created or
+            # deleted
+            self.device_monitor.wait_for_events(timeout)
+
     def _device_info_has_changes(self, device_info):
         return (device_info.get('added')
                 or device_info.get('updated')
@@ -1190,6 +1511,8 @@ class CommonAgentLoop(service.Service):
 
             if sync:
                 LOG.info(_LI("Agent out of sync with plugin!"))
+                self.mgr.clear_cache()
+                self.sg_agent.invalidate_firewall_state()
 
             device_info = self.scan_devices(previous=device_info, sync=sync)
             sync = False
@@ -1203,11 +1526,12 @@ class CommonAgentLoop(service.Service):
                     LOG.exception(_LE("Error in agent loop. Devices info: %s"),
                                   device_info)
                     sync = True
+                self.persist_device_state()
 
             # sleep till end of polling interval
             elapsed = (time.time() - start)
             if (elapsed < self.polling_interval):
-                time.sleep(self.polling_interval - elapsed)
+                self._wait_for_devices(self.polling_interval - elapsed)
             else:
                 LOG.debug("Loop iteration exceeded interval "
                           "(%(polling_interval)s vs. %(elapsed)s)!",
@@ -66,7 +66,7 @@ class PciOsWrapper(object):
         return vf_list
 
     @classmethod
-    def is_assigned_vf(cls, dev_name, vf_index):
+    def is_assigned_vf(cls, dev_name, vf_index, macvtap_vf_interfaces=None):
         """Check if VF is assigned.
 
         Checks if a given vf index of a given device name is assigned
@@ -76,6 +76,8 @@ class PciOsWrapper(object):
             Macvtap VF: macvtap@<vf interface> interface exists in ip link show
         @param dev_name: pf network device name
         @param vf_index: vf index
+        @param macvtap_vf_interfaces: vf interfaces with a macvtap interface,
+                                      ip link show is parsed if None
         """
         path = cls.PCI_PATH % (dev_name, vf_index)
 
@@ -89,7 +91,10 @@ class PciOsWrapper(object):
         # for macvtap interface. Therefore we workaround it
         # by parsing ip link show and checking if macvtap interface exists
         for ifname in ifname_list:
-            if pci_lib.PciDeviceIPWrapper.is_macvtap_assigned(ifname):
+            if macvtap_vf_interfaces is not None:
+                if ifname in macvtap_vf_interfaces:
+                    return True
+            elif pci_lib.PciDeviceIPWrapper.is_macvtap_assigned(ifname):
                 return True
         return False
 
@@ -133,25 +138,39 @@ class EmbSwitch(object):
         """Get list of VF addresses."""
         return self.pci_slot_map.keys()
 
-    def get_assigned_devices_info(self):
-        """Get assigned Virtual Functions mac and pci slot
-        information and populates vf_to_pci_slot mappings
+    def get_assigned_vfs_details(self, macvtap_vf_interfaces=None):
+        """Get the details of the assigned Virtual Functions
 
-        @return: list of VF pair (mac address, pci slot)
+        The details of all the VFs are read with a single ip link show of
+        the network device.
+        @param macvtap_vf_interfaces: VF interfaces with a macvtap interface
+        @return: dict mapping the pci slot of each assigned VF to its
+                 details (MAC address and link state)
         """
         vf_to_pci_slot_mapping = {}
-        assigned_devices_info = []
         for pci_slot, vf_index in self.pci_slot_map.items():
-            if not PciOsWrapper.is_assigned_vf(self.dev_name, vf_index):
+            if not PciOsWrapper.is_assigned_vf(self.dev_name, vf_index,
+                                               macvtap_vf_interfaces):
                 continue
             vf_to_pci_slot_mapping[vf_index] = pci_slot
+        assigned_vfs_details = {}
         if vf_to_pci_slot_mapping:
-            vf_to_mac_mapping = self.pci_dev_wrapper.get_assigned_macs(
-                list(vf_to_pci_slot_mapping.keys()))
-            for vf_index, mac in vf_to_mac_mapping.items():
-                pci_slot = vf_to_pci_slot_mapping[vf_index]
-                assigned_devices_info.append((mac, pci_slot))
-        return assigned_devices_info
+            vfs_details = self.pci_dev_wrapper.get_vfs_details()
+            for vf_index, pci_slot in vf_to_pci_slot_mapping.items():
+                vf_details = vfs_details.get(vf_index)
+                if vf_details:
+                    assigned_vfs_details[pci_slot] = vf_details
+        return assigned_vfs_details
+
+    def get_assigned_devices_info(self, macvtap_vf_interfaces=None):
+        """Get assigned Virtual Functions mac and pci slot
+        information and populates vf_to_pci_slot mappings
+
+        @param macvtap_vf_interfaces: VF interfaces with a macvtap interface
+        @return: list of VF pair (mac address, pci slot)
+        """
+        return [(vf_details["MAC"], pci_slot) for pci_slot, vf_details in
+                self.get_assigned_vfs_details(macvtap_vf_interfaces).items()]
 
     def get_device_state(self, pci_slot):
         """Get device state.
@@ -245,6 +264,9 @@ class ESwitchManager(object):
             cls._instance = super(ESwitchManager, cls).__new__(cls)
             cls.emb_switches_map = {}
             cls.pci_slot_map = {}
+            # details of the VFs by pci slot, None for the unassigned ones,
+            # cached when scanning the assigned devices
+            cls.vf_details_cache = {}
         return cls._instance
 
     def device_exists(self, device_mac, pci_slot):
@@ -262,7 +284,9 @@ class ESwitchManager(object):
     def get_assigned_devices_info(self, phys_net=None):
         """Get all assigned devices.
 
-        Get all assigned devices belongs to given embedded switch
+        Get all assigned devices belongs to given embedded switch. The
+        details of the VFs are cached, so that the other calls are served
+        from memory until the next scan.
         @param phys_net: physical network, if none get all assigned devices
         @return: set of assigned VFs (mac address, pci slot) pair
         """
@@ -273,10 +297,17 @@ class ESwitchManager(object):
             eswitch_objects = [embedded_switch]
         else:
             eswitch_objects = self.emb_switches_map.values()
+        # ip link show is parsed once for all the VFs of all the devices
+        macvtap_vf_interfaces = (
+            pci_lib.PciDeviceIPWrapper.get_macvtap_vf_interfaces())
         assigned_devices = set()
         for embedded_switch in eswitch_objects:
-            for device in embedded_switch.get_assigned_devices_info():
-                assigned_devices.add(device)
+            vfs_details = embedded_switch.get_assigned_vfs_details(
+                macvtap_vf_interfaces)
+            for pci_slot in embedded_switch.get_pci_slot_list():
+                self.vf_details_cache[pci_slot] = vfs_details.get(pci_slot)
+            for pci_slot, vf_details in vfs_details.items():
+                assigned_devices.add((vf_details["MAC"], pci_slot))
         return assigned_devices
 
     def get_device_state(self, device_mac, pci_slot):
@@ -289,6 +320,10 @@ class ESwitchManager(object):
         """
         embedded_switch = self._get_emb_eswitch(device_mac, pci_slot)
         if embedded_switch:
+            vf_details = self.vf_details_cache.get(pci_slot)
+            if vf_details:
+                return (vf_details["link-state"] !=
+                        pci_lib.PciDeviceIPWrapper.LinkState.DISABLE)
             return embedded_switch.get_device_state(pci_slot)
         return False
 
@@ -317,6 +352,12 @@ class ESwitchManager(object):
         if embedded_switch:
             embedded_switch.set_device_state(pci_slot,
                                              admin_state_up)
+            vf_details = self.vf_details_cache.get(pci_slot)
+            if vf_details:
+                link_state = pci_lib.PciDeviceIPWrapper.LinkState
+                vf_details["link-state"] = (link_state.ENABLE
+                                            if admin_state_up
+                                            else link_state.DISABLE)
 
     def set_device_spoofcheck(self, device_mac, pci_slot, enabled):
         """Set device spoofcheck
@@ -349,6 +390,7 @@ class ESwitchManager(object):
         self.emb_switches_map[phys_net] = embedded_switch
         for pci_slot in embedded_switch.get_pci_slot_list():
             self.pci_slot_map[pci_slot] = embedded_switch
+            self.vf_details_cache.pop(pci_slot, None)
 
     def _get_emb_eswitch(self, device_mac, pci_slot):
         """Get embedded switch.
@@ -359,7 +401,11 @@ class ESwitchManager(object):
         """
         embedded_switch = self.pci_slot_map.get(pci_slot)
         if embedded_switch:
-            used_device_mac = embedded_switch.get_pci_device(pci_slot)
+            if pci_slot in self.vf_details_cache:
+                vf_details = self.vf_details_cache[pci_slot]
+                used_device_mac = vf_details and vf_details["MAC"]
+            else:
+                used_device_mac = embedded_switch.get_pci_device(pci_slot)
             if used_device_mac != device_mac:
                 LOG.warning(_LW("device pci mismatch: %(device_mac)s "
                                 "- %(pci_slot)s"),
@@ -378,6 +424,8 @@ class ESwitchManager(object):
         #releases the VF back to the hypervisor on delete VM. Therefore we
         #should just clear the VF max rate according to pci_slot no matter
         #if VF is assigned or not.
+        #The VF is not looked up in the cache either, as it may have been
+        #released or assigned to another port since the last scan.
         embedded_switch = self.pci_slot_map.get(pci_slot)
         if embedded_switch:
             #(Note): check the pci_slot is not assigned to some
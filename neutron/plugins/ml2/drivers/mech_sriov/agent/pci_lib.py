@@ -96,6 +96,27 @@ class PciDeviceIPWrapper(ip_lib.IPWrapper):
                     vf_to_mac_mapping[vf_num] = vf_mac
         return vf_to_mac_mapping
 
+    def get_vfs_details(self):
+        """Get the details of all the vfs of the device.
+
+        A single ip link show of the device lists all its vfs.
+        @return: dict mapping each vf index to its details
+        """
+        try:
+            out = self._as_root([], "link", ("show", self.dev_name))
+        except Exception as e:
+            LOG.exception(_LE("Failed executing ip command"))
+            raise exc.IpCommandDeviceError(dev_name=self.dev_name,
+                                           reason=e)
+        vfs_details = {}
+        for line in out.split("\n"):
+            line = line.strip()
+            if line.startswith("vf"):
+                vf_details = self._parse_vf_link_show(line)
+                if vf_details:
+                    vfs_details[vf_details["vf"]] = vf_details
+        return vfs_details
+
     def get_vf_state(self, vf_index):
         """Get vf state {True/False}
 
@@ -185,14 +206,12 @@ class PciDeviceIPWrapper(ip_lib.IPWrapper):
         return vf_details
 
     @classmethod
-    def is_macvtap_assigned(cls, ifname):
-        """Check if vf has macvtap interface assigned
+    def get_macvtap_vf_interfaces(cls):
+        """Get the vf interfaces which have a macvtap interface assigned
 
-        Parses the output of ip link show command and checks
-        if macvtap[0-9]+@<vf interface> regex matches the
-        output.
-        @param ifname: vf interface name
-        @return: True on match otherwise False
+        Parses the output of ip link show command and collects the
+        <vf interface> of the macvtap[0-9]+@<vf interface> interfaces.
+        @return: set of vf interface names
         """
         try:
             out = cls._execute([], "link", ("show", ), run_as_root=True)
@@ -200,9 +219,21 @@ class PciDeviceIPWrapper(ip_lib.IPWrapper):
             LOG.error(_LE("Failed executing ip command: %s"), e)
             raise exc.IpCommandError(reason=e)
 
+        vf_interfaces = set()
         for line in out.splitlines():
             pattern_match = cls.MACVTAP_REG_EX.match(line)
             if pattern_match:
-                if ifname == pattern_match.group('vf_interface'):
-                    return True
-        return False
+                vf_interfaces.add(pattern_match.group('vf_interface'))
+        return vf_interfaces
+
+    @classmethod
+    def is_macvtap_assigned(cls, ifname):
+        """Check if vf has macvtap interface assigned
+
+        Parses the output of ip link show command and checks
+        if macvtap[0-9]+@<vf interface> regex matches the
+        output.
+        @param ifname: vf interface name
+        @return: True on match otherwise False
+        """
+        return ifname in cls.get_macvtap_vf_interfaces()
@@ -148,6 +148,40 @@ agent_opts = [
     cfg.BoolOpt('tunnel_csum', default=False,
                 help=_("Set or un-set the tunnel header checksum  on "
                        "outgoing IP packet carrying GRE/VXLAN tunnel.")),
+    cfg.IntOpt('device_processing_workers', default=1, min=1,
+               help=_("Number of green threads treating the added and "
+                      "updated ports in parallel. The ports of a network "
+                      "are always treated in order by the same thread.")),
+    cfg.BoolOpt('use_flow_bundles', default=False,
+                help=_("Collect the flows modified during an rpc_loop "
+                       "iteration and apply them with atomic OpenFlow 1.4 "
+                       "bundles instead of one ovs-ofctl call per "
+                       "modification. Requires Open vSwitch 2.6 or newer. "
+                       "Used only for 'ovs-ofctl' driver.")),
+    cfg.BoolOpt('mirror_installed_flows', default=False,
+                help=_("Mirror the flows installed on the integration and "
+                       "tunnel bridges when the agent starts, and don't "
+                       "reinstall the unchanged ones until the stale flows "
+                       "are cleaned up. The stale flows are then deleted "
+                       "with a single ovs-ofctl call. Used only for "
+                       "'ovs-ofctl' driver.")),
+    cfg.StrOpt('local_vlan_state_file',
+               help=_("File where the agent persists its local VLAN "
+                      "mappings whenever they change. On restart, the "
+                      "mappings which are consistent with the ports of the "
+                      "integration bridge are restored, and the networks "
+                      "whose segmentation changed while the agent was down "
+                      "are reclaimed before being provisioned again. The "
+                      "integration and tunnel bridge flows of the "
+                      "unchanged networks are kept. Not persisted if "
+                      "unset.")),
+    cfg.StrOpt('loop_timing_file',
+               help=_("File where the agent dumps, after each rpc_loop "
+                      "iteration, the percentiles of the durations of the "
+                      "loop phases (ports scan, devices treatment, firewall "
+                      "setup, RPC calls...) along with the durations and "
+                      "port counts of the last iteration. Not dumped if "
+                      "unset.")),
     cfg.StrOpt('agent_type', default=n_const.AGENT_TYPE_OVS,
                deprecated_for_removal=True,
                help=_("Selects the Agent Type reported"))
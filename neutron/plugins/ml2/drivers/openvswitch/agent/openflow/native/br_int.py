@@ -57,7 +57,8 @@ class OVSIntegrationBridge(ovs_bridge.OVSAgentBridge):
     def _local_vlan_match(_ofp, ofpp, port, vlan_vid):
         return ofpp.OFPMatch(in_port=port, vlan_vid=vlan_vid)
 
-    def provision_local_vlan(self, port, lvid, segmentation_id):
+    def provision_local_vlan(self, port, lvid, segmentation_id,
+                             cookie=None):
         (_dp, ofp, ofpp) = self._get_dp()
         if segmentation_id is None:
             vlan_vid = ofp.OFPVID_NONE
@@ -72,7 +73,8 @@ class OVSIntegrationBridge(ovs_bridge.OVSAgentBridge):
         ]
         self.install_apply_actions(priority=3,
                                    match=match,
-                                   actions=actions)
+                                   actions=actions,
+                                   cookie=cookie)
 
     def reclaim_local_vlan(self, port, segmentation_id):
         (_dp, ofp, ofpp) = self._get_dp()
@@ -140,7 +140,7 @@ class OVSTunnelBridge(ovs_bridge.OVSAgentBridge,
         return ofpp.OFPMatch(tunnel_id=tun_id)
 
     def provision_local_vlan(self, network_type, lvid, segmentation_id,
-                             distributed=False):
+                             distributed=False, cookie=None):
         (_dp, ofp, ofpp) = self._get_dp()
         match = self._local_vlan_match(ofp, ofpp, segmentation_id)
         table_id = constants.TUN_TABLE[network_type]
@@ -158,7 +158,8 @@ class OVSTunnelBridge(ovs_bridge.OVSAgentBridge,
         self.install_instructions(table_id=table_id,
                                   priority=1,
                                   match=match,
-                                  instructions=instructions)
+                                  instructions=instructions,
+                                  cookie=cookie)
 
     def reclaim_local_vlan(self, network_type, segmentation_id):
         (_dp, ofp, ofpp) = self._get_dp()
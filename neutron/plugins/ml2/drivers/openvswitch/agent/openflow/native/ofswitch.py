@@ -134,10 +134,13 @@ class OpenFlowSwitchMixin(object):
             flows += rep.body
         return flows
 
-    def cleanup_flows(self):
-        cookies = set([f.cookie for f in self.dump_flows()])
+    def dump_flow_cookies(self):
+        return set([f.cookie for f in self.dump_flows()])
+
+    def cleanup_flows(self, kept_cookies=()):
+        cookies = self.dump_flow_cookies()
         for c in cookies:
-            if c == self.agent_uuid_stamp:
+            if c == self.agent_uuid_stamp or c in kept_cookies:
                 continue
             LOG.warn(_LW("Deleting flow with cookie 0x%(cookie)x") % {
                 'cookie': c})
@@ -177,12 +180,14 @@ class OpenFlowSwitchMixin(object):
 
     def install_instructions(self, instructions,
                              table_id=0, priority=0,
-                             match=None, **match_kwargs):
+                             match=None, cookie=None, **match_kwargs):
         (dp, ofp, ofpp) = self._get_dp()
         match = self._match(ofp, ofpp, match, **match_kwargs)
+        if cookie is None:
+            cookie = self.agent_uuid_stamp
         msg = ofpp.OFPFlowMod(dp,
                               table_id=table_id,
-                              cookie=self.agent_uuid_stamp,
+                              cookie=cookie,
                               match=match,
                               priority=priority,
                               instructions=instructions)
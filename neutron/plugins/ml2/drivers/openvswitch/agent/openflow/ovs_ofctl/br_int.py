@@ -45,15 +45,18 @@ class OVSIntegrationBridge(ovs_bridge.OVSAgentBridge):
         else:
             return constants.OVS_NORMAL
 
-    def provision_local_vlan(self, port, lvid, segmentation_id):
+    def provision_local_vlan(self, port, lvid, segmentation_id,
+                             cookie=None):
         if segmentation_id is None:
             dl_vlan = 0xffff
         else:
             dl_vlan = segmentation_id
+        kwargs = {'cookie': cookie} if cookie is not None else {}
         self.add_flow(priority=3,
                       in_port=port,
                       dl_vlan=dl_vlan,
-                      actions="mod_vlan_vid:%s,normal" % lvid)
+                      actions="mod_vlan_vid:%s,normal" % lvid,
+                      **kwargs)
 
     def reclaim_local_vlan(self, port, segmentation_id):
         if segmentation_id is None:
@@ -137,17 +137,19 @@ class OVSTunnelBridge(ovs_bridge.OVSAgentBridge,
         self.install_drop(table_id=constants.FLOOD_TO_TUN)
 
     def provision_local_vlan(self, network_type, lvid, segmentation_id,
-                             distributed=False):
+                             distributed=False, cookie=None):
         if distributed:
             table_id = constants.DVR_NOT_LEARN
         else:
             table_id = constants.LEARN_FROM_TUN
+        kwargs = {'cookie': cookie} if cookie is not None else {}
         self.add_flow(table=constants.TUN_TABLE[network_type],
                       priority=1,
                       tun_id=segmentation_id,
                       actions="mod_vlan_vid:%s,"
                       "resubmit(,%s)" %
-                      (lvid, table_id))
+                      (lvid, table_id),
+                      **kwargs)
 
     def reclaim_local_vlan(self, network_type, segmentation_id):
         self.delete_flows(table=constants.TUN_TABLE[network_type],
@@ -14,11 +14,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import re
 
 from oslo_log import log as logging
 
 from neutron._i18n import _LW
+from neutron.agent.common import ovs_lib
 
 LOG = logging.getLogger(__name__)
 
@@ -84,7 +86,16 @@ class OpenFlowSwitchMixin(object):
         else:
             super(OpenFlowSwitchMixin, self).remove_all_flows()
 
-    def _filter_flows(self, flows):
+    def dump_flow_cookies(self):
+        cookie_re = re.compile('cookie=(0x[A-Fa-f0-9]*)')
+        cookies = set()
+        for flow in self.dump_flows_all_tables():
+            fl_cookie = cookie_re.search(flow)
+            if fl_cookie:
+                cookies.add(int(fl_cookie.group(1), 16))
+        return cookies
+
+    def _filter_flows(self, flows, kept_cookies=()):
         LOG.debug("Agent uuid stamp used to filter flows: %s",
                   self.agent_uuid_stamp)
         cookie_re = re.compile('cookie=(0x[A-Fa-f0-9]*)')
@@ -94,17 +105,42 @@ class OpenFlowSwitchMixin(object):
             if not fl_cookie:
                 continue
             fl_cookie = fl_cookie.group(1)
-            if int(fl_cookie, 16) != self.agent_uuid_stamp:
+            cookie = int(fl_cookie, 16)
+            if (cookie != self.agent_uuid_stamp and
+                    cookie not in kept_cookies):
                 fl_table = table_re.search(flow)
                 if not fl_table:
                     continue
                 fl_table = fl_table.group(1)
                 yield flow, fl_cookie, fl_table
 
-    def cleanup_flows(self):
+    def cleanup_flows(self, kept_cookies=()):
+        # the flows with the kept cookies are not stale either
         flows = self.dump_flows_all_tables()
-        for flow, cookie, table in self._filter_flows(flows):
+        # the flows claimed while the flow mirror was loaded were kept
+        # installed with their previous cookie
+        claimed_flows = self.stop_flow_mirror()
+        stale_flows = collections.OrderedDict()
+        for flow, cookie, table in self._filter_flows(flows, kept_cookies):
+            if (claimed_flows and
+                    ovs_lib.get_flow_key(flow) in claimed_flows):
+                continue
             # deleting a stale flow should be rare.
             # it might deserve some attention
             LOG.warning(_LW("Deleting flow %s"), flow)
-            self.delete_flows(cookie=cookie + '/-1', table=table)
+            stale_flows[flow] = (cookie, table)
+        if not stale_flows:
+            return
+        if claimed_flows:
+            # the claimed flows share the cookie of the stale ones, which
+            # have to be deleted one by one
+            flow_strs = [ovs_lib.get_flow_match_str(flow)
+                         for flow in stale_flows]
+            self.run_ofctl('del-flows', ['--strict', '-'],
+                           '\n'.join(flow_strs))
+        else:
+            cookie_tables = collections.OrderedDict.fromkeys(
+                stale_flows.values())
+            self.do_action_flows('del', [
+                {'cookie': cookie + '/-1', 'table': table}
+                for cookie, table in cookie_tables])
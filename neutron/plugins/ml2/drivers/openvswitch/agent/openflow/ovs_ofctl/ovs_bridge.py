@@ -24,7 +24,11 @@ class OVSAgentBridge(ofswitch.OpenFlowSwitchMixin, ovs_lib.OVSBridge):
     """Common code for bridges used by OVS agent"""
 
     def setup_controllers(self, conf):
-        self.set_protocols("[OpenFlow10]")
+        if conf.AGENT.use_flow_bundles:
+            # the flow bundles require OpenFlow 1.4
+            self.set_protocols("[OpenFlow10,OpenFlow14]")
+        else:
+            self.set_protocols("[OpenFlow10]")
         self.del_controller()
 
     def drop_port(self, in_port):
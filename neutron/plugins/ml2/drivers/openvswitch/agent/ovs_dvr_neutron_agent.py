@@ -350,12 +350,14 @@ class OVSDVRNeutronAgent(object):
     def in_distributed_mode(self):
         return self.dvr_mac_address is not None
 
-    def process_tunneled_network(self, network_type, lvid, segmentation_id):
+    def process_tunneled_network(self, network_type, lvid, segmentation_id,
+                                 cookie=None):
         self.tun_br.provision_local_vlan(
             network_type=network_type,
             lvid=lvid,
             segmentation_id=segmentation_id,
-            distributed=self.in_distributed_mode())
+            distributed=self.in_distributed_mode(),
+            cookie=cookie)
 
     def _bind_distributed_router_interface_port(self, port, lvm,
                                                 fixed_ips, device_owner):
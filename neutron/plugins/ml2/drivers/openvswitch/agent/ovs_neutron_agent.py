@@ -20,6 +20,7 @@ import sys
 import time
 import uuid
 
+import eventlet
 import netaddr
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -30,8 +31,10 @@ import six
 from six import moves
 
 from neutron._i18n import _, _LE, _LI, _LW
+from neutron.agent.common import loop_timing
 from neutron.agent.common import ovs_lib
 from neutron.agent.common import polling
+from neutron.agent.common import state_file
 from neutron.agent.common import utils
 from neutron.agent.l2.extensions import manager as ext_manager
 from neutron.agent.linux import ip_lib
@@ -72,7 +75,7 @@ class _mac_mydialect(netaddr.mac_unix):
 class LocalVLANMapping(object):
 
     def __init__(self, vlan, network_type, physical_network, segmentation_id,
-                 vif_ports=None):
+                 vif_ports=None, cookie=None):
         if vif_ports is None:
             vif_ports = {}
         self.vlan = vlan
@@ -82,6 +85,9 @@ class LocalVLANMapping(object):
         self.vif_ports = vif_ports
         # set of tunnel ports on which packets should be flooded
         self.tun_ofports = set()
+        # cookie of the flows provisioning the network on the integration
+        # and tunnel bridges, kept across restarts
+        self.cookie = cookie
 
     def __str__(self):
         return ("lv-id = %s type = %s phys-net = %s phys-id = %s" %
@@ -132,7 +138,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
     #   1.2 Support DVR (Distributed Virtual Router) RPC
     #   1.3 Added param devices_to_update to security_groups_provider_updated
     #   1.4 Added support for network_update
-    target = oslo_messaging.Target(version='1.4')
+    #   1.5 Added params rule_deltas, member_deltas and sequence to
+    #       security_groups_rule_updated and security_groups_member_updated
+    target = oslo_messaging.Target(version='1.5')
 
     def __init__(self, bridge_classes, conf=None):
         '''Constructor.
@@ -164,6 +172,20 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         self.enable_distributed_routing = agent_conf.enable_distributed_routing
         self.arp_responder_enabled = agent_conf.arp_responder and self.l2_pop
         self.prevent_arp_spoofing = agent_conf.prevent_arp_spoofing
+        self.device_processing_workers = agent_conf.device_processing_workers
+        self.use_flow_bundles = (agent_conf.use_flow_bundles and
+                                 ovs_conf.of_interface == 'ovs-ofctl')
+        self.mirror_installed_flows = (
+            agent_conf.mirror_installed_flows and
+            ovs_conf.of_interface == 'ovs-ofctl')
+        self.local_vlan_state = state_file.StateFile(
+            agent_conf.local_vlan_state_file, 'networks',
+            entry_keys=('vlan', 'network_type', 'physical_network',
+                        'segmentation_id', 'vif_ports'))
+        # Number of devices treated in the current rpc_loop iteration
+        self.treated_devices = 0
+        # Durations of the rpc_loop phases
+        self.loop_timer = loop_timing.LoopTimer(agent_conf.loop_timing_file)
 
         host = self.conf.host
         self.agent_id = 'ovs-agent-%s' % host
@@ -322,6 +344,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
 
     def _restore_local_vlan_map(self):
         self._local_vlan_hints = {}
+        vif_vlans = {}
         cur_ports = self.int_br.get_vif_ports()
         port_names = [p.port_name for p in cur_ports]
         port_info = self.int_br.get_ports_attributes(
@@ -344,10 +367,95 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 self.available_local_vlans.remove(local_vlan)
                 self._local_vlan_hints[local_vlan_map['net_uuid']] = \
                     local_vlan
+            if local_vlan != DEAD_VLAN_TAG:
+                vif_vlans[port.vif_id] = local_vlan
+        self._restore_local_vlan_state(vif_vlans)
+
+    def _restore_local_vlan_state(self, vif_vlans):
+        '''Restore the local VLAN mappings persisted by a previous run.
+
+        A mapping is only restored if one of its VIF ports is still tagged
+        with its local VLAN on the integration bridge. Its cookie is only
+        restored if the flows provisioning its network are still installed
+        with it, they are then not installed again.
+
+        :param vif_vlans: the local VLANs of the VIF ports by VIF id.
+        '''
+        self._restored_local_vlans = {}
+        bridge_cookies = {}
+        for net_uuid, mapping in six.iteritems(self.local_vlan_state.load()):
+            vlan = mapping['vlan']
+            if self._local_vlan_hints.get(net_uuid) != vlan:
+                continue
+            if not any(vif_vlans.get(vif_id) == vlan
+                       for vif_id in mapping['vif_ports']):
+                continue
+            lvm = LocalVLANMapping(
+                vlan, mapping['network_type'], mapping['physical_network'],
+                mapping['segmentation_id'], cookie=mapping.get('cookie'))
+            bridge = self._get_local_vlan_bridge(lvm.network_type)
+            if (bridge is None or mapping.get('int_ofport') !=
+                    self.int_ofports.get(lvm.physical_network)):
+                lvm.cookie = None
+            elif lvm.cookie is not None:
+                if bridge.br_name not in bridge_cookies:
+                    bridge_cookies[bridge.br_name] = (
+                        bridge.dump_flow_cookies())
+                if lvm.cookie not in bridge_cookies[bridge.br_name]:
+                    lvm.cookie = None
+            self._restored_local_vlans[net_uuid] = lvm
+        LOG.info(_LI("Restored %d persisted local VLAN mappings"),
+                 len(self._restored_local_vlans))
+
+    def _get_local_vlan_bridge(self, network_type):
+        '''Return the bridge provisioning the networks of a type.
+
+        The flows provisioning the networks on the physical bridges are
+        deleted when the agent starts, only the integration and tunnel
+        bridge flows can be kept.
+        '''
+        if network_type in constants.TUNNEL_NETWORK_TYPES:
+            return self.tun_br if self.enable_tunneling else None
+        if network_type in (p_const.TYPE_FLAT, p_const.TYPE_VLAN):
+            return self.int_br
+
+    def persist_local_vlan_state(self):
+        '''Persist the local VLAN mappings if they changed.'''
+        self.local_vlan_state.save({
+            net_uuid: {'vlan': lvm.vlan,
+                       'network_type': lvm.network_type,
+                       'physical_network': lvm.physical_network,
+                       'segmentation_id': lvm.segmentation_id,
+                       'vif_ports': sorted(lvm.vif_ports),
+                       'cookie': lvm.cookie,
+                       'int_ofport': self.int_ofports.get(
+                           lvm.physical_network)}
+            for net_uuid, lvm in six.iteritems(self.local_vlan_map)})
+
+    def _reclaim_restored_local_vlan(self, net_uuid, network_type,
+                                     physical_network, segmentation_id):
+        '''Reclaim the restored mapping of a network if it changed.
+
+        :returns: the restored mapping if the network is unchanged.
+        '''
+        lvm = self._restored_local_vlans.pop(net_uuid, None)
+        if lvm is None or (
+                (lvm.network_type, lvm.physical_network,
+                 lvm.segmentation_id) ==
+                (network_type, physical_network, segmentation_id)):
+            return lvm
+        # The network changed while the agent was down: its previous flows
+        # are reclaimed before it is provisioned again.
+        LOG.info(_LI("Local VLAN mapping of net-id=%(net_uuid)s changed "
+                     "from %(lvm)s"), {'net_uuid': net_uuid, 'lvm': lvm})
+        self._local_vlan_hints.pop(net_uuid, None)
+        self.local_vlan_map[net_uuid] = lvm
+        self.reclaim_local_vlan(net_uuid)
 
     def _dispose_local_vlan_hints(self):
         self.available_local_vlans.update(self._local_vlan_hints.values())
         self._local_vlan_hints = {}
+        self._restored_local_vlans = {}
 
     def _reset_tunnel_ofports(self):
         self.tun_br_ofports = {p_const.TYPE_GENEVE: {},
@@ -490,40 +598,82 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
     def _tunnel_port_lookup(self, network_type, remote_ip):
         return self.tun_br_ofports[network_type].get(remote_ip)
 
-    def fdb_add(self, context, fdb_entries):
-        LOG.debug("fdb_add received")
+    def _get_remote_agent_ports(self, fdb_entries):
+        agent_ports_by_lvm = []
         for lvm, agent_ports in self.get_agent_ports(fdb_entries,
                                                      self.local_vlan_map):
             agent_ports.pop(self.local_ip, None)
             if len(agent_ports):
-                if not self.enable_distributed_routing:
-                    with self.tun_br.deferred() as deferred_br:
-                        self.fdb_add_tun(context, deferred_br, lvm,
-                                         agent_ports, self._tunnel_port_lookup)
-                else:
-                    self.fdb_add_tun(context, self.tun_br, lvm,
-                                     agent_ports, self._tunnel_port_lookup)
+                agent_ports_by_lvm.append((lvm, agent_ports))
+        return agent_ports_by_lvm
+
+    def _setup_missing_tunnel_ports(self, agent_ports_by_lvm):
+        missing_tunnels = collections.defaultdict(dict)
+        for lvm, agent_ports in agent_ports_by_lvm:
+            for remote_ip in agent_ports:
+                if self._tunnel_port_lookup(lvm.network_type, remote_ip):
+                    continue
+                tun_name = self.get_tunnel_name(
+                    lvm.network_type, self.local_ip, remote_ip)
+                if tun_name is not None:
+                    missing_tunnels[lvm.network_type][remote_ip] = tun_name
+        for tunnel_type, tunnels in six.iteritems(missing_tunnels):
+            self._setup_tunnel_ports(self.tun_br, tunnels, tunnel_type)
+
+    def _update_flood_to_tun(self, br, lvm, tun_ofports):
+        if lvm.tun_ofports == tun_ofports:
+            return
+        if lvm.tun_ofports:
+            br.install_flood_to_tun(lvm.vlan, lvm.segmentation_id,
+                                    lvm.tun_ofports)
+        else:
+            # This local vlan doesn't require any more tunneling
+            br.delete_flood_to_tun(lvm.vlan)
+
+    def _fdb_add(self, context, br, agent_ports_by_lvm):
+        for lvm, agent_ports in agent_ports_by_lvm:
+            tun_ofports = set(lvm.tun_ofports)
+            self.fdb_add_tun(context, br, lvm, agent_ports,
+                             self._tunnel_port_lookup)
+            self._update_flood_to_tun(br, lvm, tun_ofports)
+
+    def _fdb_remove(self, context, br, agent_ports_by_lvm):
+        for lvm, agent_ports in agent_ports_by_lvm:
+            tun_ofports = set(lvm.tun_ofports)
+            self.fdb_remove_tun(context, br, lvm, agent_ports,
+                                self._tunnel_port_lookup)
+            self._update_flood_to_tun(br, lvm, tun_ofports)
+
+    def fdb_add(self, context, fdb_entries):
+        LOG.debug("fdb_add received")
+        agent_ports_by_lvm = self._get_remote_agent_ports(fdb_entries)
+        if not agent_ports_by_lvm:
+            return
+        # the tunnel ports to the new remote agents are added at once
+        self._setup_missing_tunnel_ports(agent_ports_by_lvm)
+        # the flows of all the networks are applied at once, and the
+        # flooding flow of each network is only rewritten once
+        if not self.enable_distributed_routing:
+            with self.tun_br.deferred() as deferred_br:
+                self._fdb_add(context, deferred_br, agent_ports_by_lvm)
+        else:
+            self._fdb_add(context, self.tun_br, agent_ports_by_lvm)
 
     def fdb_remove(self, context, fdb_entries):
         LOG.debug("fdb_remove received")
-        for lvm, agent_ports in self.get_agent_ports(fdb_entries,
-                                                     self.local_vlan_map):
-            agent_ports.pop(self.local_ip, None)
-            if len(agent_ports):
-                if not self.enable_distributed_routing:
-                    with self.tun_br.deferred() as deferred_br:
-                        self.fdb_remove_tun(context, deferred_br, lvm,
-                                            agent_ports,
-                                            self._tunnel_port_lookup)
-                else:
-                    self.fdb_remove_tun(context, self.tun_br, lvm,
-                                        agent_ports, self._tunnel_port_lookup)
+        agent_ports_by_lvm = self._get_remote_agent_ports(fdb_entries)
+        if not agent_ports_by_lvm:
+            return
+        if not self.enable_distributed_routing:
+            with self.tun_br.deferred() as deferred_br:
+                self._fdb_remove(context, deferred_br, agent_ports_by_lvm)
+        else:
+            self._fdb_remove(context, self.tun_br, agent_ports_by_lvm)
 
     def add_fdb_flow(self, br, port_info, remote_ip, lvm, ofport):
         if port_info == n_const.FLOODING_ENTRY:
+            # the flooding flow is updated by fdb_add
             lvm.tun_ofports.add(ofport)
-            br.install_flood_to_tun(lvm.vlan, lvm.segmentation_id,
-                                    lvm.tun_ofports)
         else:
             self.setup_entry_for_arp_reply(br, 'add', lvm.vlan,
                                            port_info.mac_address,
@@ -538,13 +688,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
             if ofport not in lvm.tun_ofports:
                 LOG.debug("attempt to remove a non-existent port %s", ofport)
                 return
+            # the flooding flow is updated by fdb_remove
             lvm.tun_ofports.remove(ofport)
-            if len(lvm.tun_ofports) > 0:
-                br.install_flood_to_tun(lvm.vlan, lvm.segmentation_id,
-                                        lvm.tun_ofports)
-            else:
-                # This local vlan doesn't require any more tunneling
-                br.delete_flood_to_tun(lvm.vlan)
         else:
             self.setup_entry_for_arp_reply(br, 'remove', lvm.vlan,
                                            port_info.mac_address,
@@ -582,7 +727,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         else:
             LOG.warning(_LW('Action %s not supported'), action)
 
-    def _local_vlan_for_flat(self, lvid, physical_network):
+    def _local_vlan_for_flat(self, lvid, physical_network, cookie=None,
+                             int_br_provisioned=False):
         phys_br = self.phys_brs[physical_network]
         phys_port = self.phys_ofports[physical_network]
         int_br = self.int_br
@@ -590,10 +736,12 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         phys_br.provision_local_vlan(port=phys_port, lvid=lvid,
                                      segmentation_id=None,
                                      distributed=False)
-        int_br.provision_local_vlan(port=int_port, lvid=lvid,
-                                    segmentation_id=None)
+        if not int_br_provisioned:
+            int_br.provision_local_vlan(port=int_port, lvid=lvid,
+                                        segmentation_id=None, cookie=cookie)
 
-    def _local_vlan_for_vlan(self, lvid, physical_network, segmentation_id):
+    def _local_vlan_for_vlan(self, lvid, physical_network, segmentation_id,
+                             cookie=None, int_br_provisioned=False):
         distributed = self.enable_distributed_routing
         phys_br = self.phys_brs[physical_network]
         phys_port = self.phys_ofports[physical_network]
@@ -602,8 +750,10 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         phys_br.provision_local_vlan(port=phys_port, lvid=lvid,
                                      segmentation_id=segmentation_id,
                                      distributed=distributed)
-        int_br.provision_local_vlan(port=int_port, lvid=lvid,
-                                    segmentation_id=segmentation_id)
+        if not int_br_provisioned:
+            int_br.provision_local_vlan(port=int_port, lvid=lvid,
+                                        segmentation_id=segmentation_id,
+                                        cookie=cookie)
 
     def provision_local_vlan(self, net_uuid, network_type, physical_network,
                              segmentation_id):
@@ -620,9 +770,14 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         # will already be assigned, so check for that here before assigning a
         # new one.
         lvm = self.local_vlan_map.get(net_uuid)
+        # the flows of a network restored with its cookie are still
+        # installed on the integration and tunnel bridges
+        provisioned = False
         if lvm:
             lvid = lvm.vlan
         else:
+            restored_lvm = self._reclaim_restored_local_vlan(
+                net_uuid, network_type, physical_network, segmentation_id)
             lvid = self._local_vlan_hints.pop(net_uuid, None)
             if lvid is None:
                 if not self.available_local_vlans:
@@ -630,14 +785,24 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                               net_uuid)
                     return
                 lvid = self.available_local_vlans.pop()
-            self.local_vlan_map[net_uuid] = LocalVLANMapping(lvid,
-                                                             network_type,
-                                                             physical_network,
-                                                             segmentation_id)
-
-        LOG.info(_LI("Assigning %(vlan_id)s as local vlan for "
-                     "net-id=%(net_uuid)s"),
-                 {'vlan_id': lvid, 'net_uuid': net_uuid})
+            if (restored_lvm and restored_lvm.vlan == lvid and
+                    restored_lvm.cookie is not None):
+                cookie = restored_lvm.cookie
+                provisioned = True
+            else:
+                cookie = uuid.uuid4().int & UINT64_BITMASK
+            lvm = LocalVLANMapping(lvid, network_type, physical_network,
+                                   segmentation_id, cookie=cookie)
+            self.local_vlan_map[net_uuid] = lvm
+
+        if provisioned:
+            LOG.info(_LI("Keeping the flows of local vlan %(vlan_id)s for "
+                         "net-id=%(net_uuid)s"),
+                     {'vlan_id': lvid, 'net_uuid': net_uuid})
+        else:
+            LOG.info(_LI("Assigning %(vlan_id)s as local vlan for "
+                         "net-id=%(net_uuid)s"),
+                     {'vlan_id': lvid, 'net_uuid': net_uuid})
 
         if network_type in constants.TUNNEL_NETWORK_TYPES:
             if self.enable_tunneling:
@@ -649,13 +814,18 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                                                      ofports)
                 # inbound from tunnels: set lvid in the right table
                 # and resubmit to Table LEARN_FROM_TUN for mac learning
-                if self.enable_distributed_routing:
+                if provisioned:
+                    LOG.debug("Tunnel flows of net-id=%s already installed",
+                              net_uuid)
+                elif self.enable_distributed_routing:
                     self.dvr_agent.process_tunneled_network(
-                        network_type, lvid, segmentation_id)
+                        network_type, lvid, segmentation_id,
+                        cookie=lvm.cookie)
                 else:
                     self.tun_br.provision_local_vlan(
                         network_type=network_type, lvid=lvid,
-                        segmentation_id=segmentation_id)
+                        segmentation_id=segmentation_id,
+                        cookie=lvm.cookie)
             else:
                 LOG.error(_LE("Cannot provision %(network_type)s network for "
                               "net-id=%(net_uuid)s - tunneling disabled"),
@@ -663,7 +833,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                            'net_uuid': net_uuid})
         elif network_type == p_const.TYPE_FLAT:
             if physical_network in self.phys_brs:
-                self._local_vlan_for_flat(lvid, physical_network)
+                self._local_vlan_for_flat(lvid, physical_network,
+                                          cookie=lvm.cookie,
+                                          int_br_provisioned=provisioned)
             else:
                 LOG.error(_LE("Cannot provision flat network for "
                               "net-id=%(net_uuid)s - no bridge for "
@@ -673,7 +845,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         elif network_type == p_const.TYPE_VLAN:
             if physical_network in self.phys_brs:
                 self._local_vlan_for_vlan(lvid, physical_network,
-                                          segmentation_id)
+                                          segmentation_id,
+                                          cookie=lvm.cookie,
+                                          int_br_provisioned=provisioned)
             else:
                 LOG.error(_LE("Cannot provision VLAN network for "
                               "net-id=%(net_uuid)s - no bridge for "
@@ -840,9 +1014,10 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 LOG.debug("Setting status for %s to DOWN", device)
                 devices_down.append(device)
         if devices_up or devices_down:
-            devices_set = self.plugin_rpc.update_device_list(
-                self.context, devices_up, devices_down, self.agent_id,
-                self.conf.host)
+            with self.loop_timer.measure('update_device_list'):
+                devices_set = self.plugin_rpc.update_device_list(
+                    self.context, devices_up, devices_down, self.agent_id,
+                    self.conf.host)
             failed_devices = (devices_set.get('failed_devices_up') +
                 devices_set.get('failed_devices_down'))
             if failed_devices:
@@ -1386,6 +1561,41 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                                             ofports)
         return ofport
 
+    def _setup_tunnel_ports(self, br, tunnels, tunnel_type):
+        """Set up tunnel ports with a single call per step.
+
+        :param tunnels: a dict of the tunnel port names by remote IP
+        """
+        ofports = br.add_tunnel_ports(
+            {port_name: remote_ip
+             for remote_ip, port_name in six.iteritems(tunnels)},
+            self.local_ip,
+            tunnel_type,
+            self.vxlan_udp_port,
+            self.dont_fragment,
+            self.tunnel_csum)
+        with br.deferred() as deferred_br:
+            for remote_ip, port_name in six.iteritems(tunnels):
+                ofport = ofports[port_name]
+                if ofport == ovs_lib.INVALID_OFPORT:
+                    LOG.error(_LE("Failed to set-up %(type)s tunnel port to "
+                                  "%(ip)s"),
+                              {'type': tunnel_type, 'ip': remote_ip})
+                    continue
+                self.tun_br_ofports[tunnel_type][remote_ip] = ofport
+                # Add flow in default table to resubmit to the right
+                # tunneling table (lvid will be set in the latter)
+                deferred_br.setup_tunnel_port(tunnel_type, ofport)
+
+            ofports = self.tun_br_ofports[tunnel_type].values()
+            if ofports and not self.l2_pop:
+                # Update flooding flows once to include the new tunnels
+                for vlan_mapping in list(self.local_vlan_map.values()):
+                    if vlan_mapping.network_type == tunnel_type:
+                        deferred_br.install_flood_to_tun(
+                            vlan_mapping.vlan, vlan_mapping.segmentation_id,
+                            ofports)
+
     def setup_tunnel_port(self, br, remote_ip, network_type):
         port_name = self.get_tunnel_name(
             network_type, self.local_ip, remote_ip)
@@ -1428,47 +1638,94 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         devices = devices_details_list.get('devices')
         vif_by_id = self.int_br.get_vifs_by_ids(
             [vif['device'] for vif in devices])
-        for details in devices:
-            device = details['device']
-            LOG.debug("Processing port: %s", device)
-            port = vif_by_id.get(device)
-            if not port:
-                # The port disappeared and cannot be processed
-                LOG.info(_LI("Port %s was not found on the integration bridge "
-                             "and will therefore not be processed"), device)
-                skipped_devices.append(device)
-                continue
 
-            if 'port_id' in details:
-                LOG.info(_LI("Port %(device)s updated. Details: %(details)s"),
-                         {'device': device, 'details': details})
-                details['vif_port'] = port
-                need_binding = self.treat_vif_port(port, details['port_id'],
-                                                   details['network_id'],
-                                                   details['network_type'],
-                                                   details['physical_network'],
-                                                   details['segmentation_id'],
-                                                   details['admin_state_up'],
-                                                   details['fixed_ips'],
-                                                   details['device_owner'],
-                                                   ovs_restarted)
-                if need_binding:
-                    need_binding_devices.append(details)
-
-                port_security = details['port_security_enabled']
-                has_sgs = 'security_groups' in details
-                if not port_security or not has_sgs:
-                    security_disabled_devices.append(device)
-                self._update_port_network(details['port_id'],
-                                          details['network_id'])
-                self.ext_manager.handle_port(self.context, details)
-            else:
-                LOG.warn(_LW("Device %s not defined on plugin"), device)
-                if (port and port.ofport != -1):
-                    self.port_dead(port)
+        def _treat_devices(devices_details):
+            for details in devices_details:
+                self._treat_device_added_or_updated(
+                    details, vif_by_id.get(details['device']),
+                    ovs_restarted, skipped_devices, need_binding_devices,
+                    security_disabled_devices)
+                self.treated_devices += 1
+
+        if self.device_processing_workers > 1:
+            # The devices of a network are treated in order, the first one
+            # provisions the local VLAN used by the others.
+            details_by_network = collections.OrderedDict()
+            for details in devices:
+                details_by_network.setdefault(
+                    details.get('network_id'), []).append(details)
+
+            errors = []
+
+            def _treat_network_devices(network_id):
+                try:
+                    _treat_devices(details_by_network[network_id])
+                except Exception:
+                    # the other networks may still be being treated, the
+                    # exception is raised once all of them are done
+                    errors.append((network_id, sys.exc_info()))
+                return network_id
+
+            pool = eventlet.GreenPool(size=self.device_processing_workers)
+            for network_id in pool.imap(_treat_network_devices,
+                                        details_by_network):
+                LOG.debug("Treated the devices of network %(network_id)s, "
+                          "%(treated)d of %(total)d devices treated",
+                          {'network_id': network_id,
+                           'treated': self.treated_devices,
+                           'total': len(devices)})
+            pool.waitall()
+            if errors:
+                for network_id, exc_info in errors[1:]:
+                    LOG.error(_LE("Error while treating the devices of "
+                                  "network %s"), network_id,
+                              exc_info=exc_info)
+                six.reraise(*errors[0][1])
+        else:
+            _treat_devices(devices)
         return (skipped_devices, need_binding_devices,
                 security_disabled_devices, failed_devices)
 
+    def _treat_device_added_or_updated(self, details, port, ovs_restarted,
+                                       skipped_devices, need_binding_devices,
+                                       security_disabled_devices):
+        device = details['device']
+        LOG.debug("Processing port: %s", device)
+        if not port:
+            # The port disappeared and cannot be processed
+            LOG.info(_LI("Port %s was not found on the integration bridge "
+                         "and will therefore not be processed"), device)
+            skipped_devices.append(device)
+            return
+
+        if 'port_id' in details:
+            LOG.info(_LI("Port %(device)s updated. Details: %(details)s"),
+                     {'device': device, 'details': details})
+            details['vif_port'] = port
+            need_binding = self.treat_vif_port(port, details['port_id'],
+                                               details['network_id'],
+                                               details['network_type'],
+                                               details['physical_network'],
+                                               details['segmentation_id'],
+                                               details['admin_state_up'],
+                                               details['fixed_ips'],
+                                               details['device_owner'],
+                                               ovs_restarted)
+            if need_binding:
+                need_binding_devices.append(details)
+
+            port_security = details['port_security_enabled']
+            has_sgs = 'security_groups' in details
+            if not port_security or not has_sgs:
+                security_disabled_devices.append(device)
+            self._update_port_network(details['port_id'],
+                                      details['network_id'])
+            self.ext_manager.handle_port(self.context, details)
+        else:
+            LOG.warn(_LW("Device %s not defined on plugin"), device)
+            if (port and port.ofport != -1):
+                self.port_dead(port)
+
     def _update_port_network(self, port_id, network_id):
         self._clean_network_ports(port_id)
         self.network_ports[network_id].add(port_id)
@@ -1500,11 +1757,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
     def treat_devices_removed(self, devices):
         self.sg_agent.remove_devices_filter(devices)
         LOG.info(_LI("Ports %s removed"), devices)
-        devices_down = self.plugin_rpc.update_device_list(self.context,
-                                                          [],
-                                                          devices,
-                                                          self.agent_id,
-                                                          self.conf.host)
+        with self.loop_timer.measure('update_device_list'):
+            devices_down = self.plugin_rpc.update_device_list(
+                self.context, [], devices, self.agent_id, self.conf.host)
         failed_devices = set(devices_down.get('failed_devices_down'))
         LOG.debug("Port removal failed for %s", failed_devices)
         for device in devices:
@@ -1549,10 +1804,11 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         security_disabled_ports = []
         if devices_added_updated:
             start = time.time()
-            (skipped_devices, need_binding_devices,
-            security_disabled_ports, failed_devices['added']) = (
-                self.treat_devices_added_or_updated(
-                    devices_added_updated, ovs_restarted))
+            with self.loop_timer.measure('treat_devices_added_or_updated'):
+                (skipped_devices, need_binding_devices,
+                 security_disabled_ports, failed_devices['added']) = (
+                    self.treat_devices_added_or_updated(
+                        devices_added_updated, ovs_restarted))
             LOG.debug("process_network_ports - iteration:%(iter_num)d - "
                       "treat_devices_added_or_updated completed. "
                       "Skipped %(num_skipped)d devices of "
@@ -1572,14 +1828,18 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         added_ports = port_info.get('added', set())
         if security_disabled_ports:
             added_ports -= set(security_disabled_ports)
-        self.sg_agent.setup_port_filters(added_ports,
-                                         port_info.get('updated', set()))
+        with self.loop_timer.measure('setup_port_filters'):
+            self.sg_agent.setup_port_filters(added_ports,
+                                             port_info.get('updated', set()))
+        # the flows of the ports must be in place before they are reported up
+        self._apply_flow_bundles()
         failed_devices['added'] |= self._bind_devices(need_binding_devices)
 
         if 'removed' in port_info and port_info['removed']:
             start = time.time()
-            failed_devices['removed'] |= self.treat_devices_removed(
-                port_info['removed'])
+            with self.loop_timer.measure('treat_devices_removed'):
+                failed_devices['removed'] |= self.treat_devices_removed(
+                    port_info['removed'])
             LOG.debug("process_network_ports - iteration:%(iter_num)d - "
                       "treat_devices_removed completed in %(elapsed).3f",
                       {'iter_num': self.iter_num,
@@ -1628,18 +1888,18 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                                                       tunnel_type,
                                                       self.conf.host)
                 if not self.l2_pop:
-                    tunnels = details['tunnels']
-                    for tunnel in tunnels:
+                    tunnels = {}
+                    for tunnel in details['tunnels']:
                         if self.local_ip != tunnel['ip_address']:
                             remote_ip = tunnel['ip_address']
                             tun_name = self.get_tunnel_name(
                                 tunnel_type, self.local_ip, remote_ip)
                             if tun_name is None:
                                 continue
-                            self._setup_tunnel_port(self.tun_br,
-                                                    tun_name,
-                                                    tunnel['ip_address'],
-                                                    tunnel_type)
+                            tunnels[remote_ip] = tun_name
+                    if tunnels:
+                        self._setup_tunnel_ports(self.tun_br, tunnels,
+                                                 tunnel_type)
         except Exception as e:
             LOG.debug("Unable to sync tunnel IP %(local_ip)s: %(e)s",
                       {'local_ip': self.local_ip, 'e': e})
@@ -1680,10 +1940,14 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         elapsed = time.time() - start_time
         LOG.debug("Agent rpc_loop - iteration:%(iter_num)d "
                   "completed. Processed ports statistics: "
-                  "%(port_stats)s. Elapsed:%(elapsed).3f",
+                  "%(port_stats)s. Phases: %(phases)s. "
+                  "Elapsed:%(elapsed).3f",
                   {'iter_num': self.iter_num,
                    'port_stats': port_stats,
+                   'phases': self.loop_timer.get_iteration_phases(),
                    'elapsed': elapsed})
+        self.loop_timer.complete_iteration(self.iter_num, elapsed,
+                                           port_stats)
         if elapsed < self.polling_interval:
             time.sleep(self.polling_interval - elapsed)
         else:
@@ -1692,26 +1956,68 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                       {'polling_interval': self.polling_interval,
                        'elapsed': elapsed})
         self.iter_num = self.iter_num + 1
+        self.treated_devices = 0
 
     def get_port_stats(self, port_info, ancillary_port_info):
         port_stats = {
             'regular': {
                 'added': len(port_info.get('added', [])),
                 'updated': len(port_info.get('updated', [])),
-                'removed': len(port_info.get('removed', []))}}
+                'removed': len(port_info.get('removed', [])),
+                'treated': self.treated_devices}}
         if self.ancillary_brs:
             port_stats['ancillary'] = {
                 'added': len(ancillary_port_info.get('added', [])),
                 'removed': len(ancillary_port_info.get('removed', []))}
         return port_stats
 
-    def cleanup_stale_flows(self):
+    def _get_flow_bundle_bridges(self):
+        if not self.use_flow_bundles:
+            return []
         bridges = [self.int_br]
         if self.enable_tunneling:
             bridges.append(self.tun_br)
-        for bridge in bridges:
+        bridges.extend(self.phys_brs.values())
+        return bridges
+
+    def _start_flow_bundles(self):
+        for bridge in self._get_flow_bundle_bridges():
+            bridge.start_flow_bundle()
+
+    def _apply_flow_bundles(self):
+        for bridge in self._get_flow_bundle_bridges():
+            bridge.apply_flow_bundle()
+
+    def _stop_flow_bundles(self):
+        for bridge in self._get_flow_bundle_bridges():
+            bridge.stop_flow_bundle()
+
+    def _get_cleanup_bridges(self):
+        bridges = [self.int_br]
+        if self.enable_tunneling:
+            bridges.append(self.tun_br)
+        return bridges
+
+    def _load_flow_mirrors(self):
+        if not self.mirror_installed_flows:
+            return
+        for bridge in self._get_cleanup_bridges():
+            bridge.load_flow_mirror()
+
+    def _stop_flow_mirrors(self):
+        if not self.mirror_installed_flows:
+            return
+        for bridge in self._get_cleanup_bridges():
+            bridge.stop_flow_mirror()
+
+    def cleanup_stale_flows(self):
+        # the flows provisioning the networks are installed with their own
+        # cookie
+        kept_cookies = set(lvm.cookie for lvm in self.local_vlan_map.values()
+                           if lvm.cookie is not None)
+        for bridge in self._get_cleanup_bridges():
             LOG.info(_LI("Cleaning stale %s flows"), bridge.br_name)
-            bridge.cleanup_flows()
+            bridge.cleanup_flows(kept_cookies)
 
     def process_port_info(self, start, polling_manager, sync, ovs_restarted,
                        ports, ancillary_ports, updated_ports_copy,
@@ -1724,6 +2030,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         if sync or not (hasattr(polling_manager, 'get_events')):
             if sync:
                 LOG.info(_LI("Agent out of sync with plugin!"))
+                self.sg_agent.invalidate_firewall_state()
                 consecutive_resyncs = consecutive_resyncs + 1
                 if (consecutive_resyncs >=
                         constants.MAX_DEVICE_RETRIES):
@@ -1746,8 +2053,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
             # the agent might miss some event (for example a port
             # deletion)
             reg_ports = (set() if ovs_restarted else ports)
-            port_info = self.scan_ports(reg_ports, sync,
-                                        updated_ports_copy)
+            with self.loop_timer.measure('scan_ports'):
+                port_info = self.scan_ports(reg_ports, sync,
+                                            updated_ports_copy)
             # Treat ancillary devices if they exist
             if self.ancillary_brs:
                 ancillary_port_info = self.scan_ancillary_ports(
@@ -1763,12 +2071,14 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         else:
             consecutive_resyncs = 0
             events = polling_manager.get_events()
-            port_info, ancillary_port_info, ports_not_ready_yet = (
-                self.process_ports_events(events, ports, ancillary_ports,
-                                          ports_not_ready_yet,
-                                          failed_devices,
-                                          failed_ancillary_devices,
-                                          updated_ports_copy))
+            with self.loop_timer.measure('process_ports_events'):
+                port_info, ancillary_port_info, ports_not_ready_yet = (
+                    self.process_ports_events(events, ports,
+                                              ancillary_ports,
+                                              ports_not_ready_yet,
+                                              failed_devices,
+                                              failed_ancillary_devices,
+                                              updated_ports_copy))
         return (port_info, ancillary_port_info, consecutive_resyncs,
                 ports_not_ready_yet)
 
@@ -1847,6 +2157,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         failed_devices = {'added': set(), 'removed': set()}
         failed_ancillary_devices = {'added': set(), 'removed': set()}
         failed_devices_retries_map = {}
+        # the flows installed by a previous run are kept until the stale
+        # flows are cleaned up, see cleanup_flows
+        self._load_flow_mirrors()
         while self._check_and_handle_signal():
             if self.fullsync:
                 LOG.info(_LI("rpc_loop doing a full sync."))
@@ -1859,6 +2172,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                       self.iter_num)
             ovs_status = self.check_ovs_status()
             if ovs_status == constants.OVS_RESTARTED:
+                self._stop_flow_mirrors()
                 self.setup_integration_br()
                 self.setup_physical_bridges(self.bridge_mappings)
                 if self.enable_tunneling:
@@ -1893,7 +2207,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
             if self.enable_tunneling and tunnel_sync:
                 LOG.info(_LI("Agent tunnel out of sync with plugin!"))
                 try:
-                    tunnel_sync = self.tunnel_sync()
+                    with self.loop_timer.measure('tunnel_sync'):
+                        tunnel_sync = self.tunnel_sync()
                 except Exception:
                     LOG.exception(_LE("Error while synchronizing tunnels"))
                     tunnel_sync = True
@@ -1903,6 +2218,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 ports_not_ready_yet)
             if (self._agent_has_updates(polling_manager) or sync
                     or devices_need_retry):
+                # the flows modified during the iteration are applied in
+                # bundles, at the latest when it completes
+                self._start_flow_bundles()
                 try:
                     LOG.debug("Agent rpc_loop - iteration:%(iter_num)d - "
                               "starting polling. Elapsed:%(elapsed).3f",
@@ -1970,11 +2288,14 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                     # so we can sure that no other Exception occurred.
                     ovs_restarted = False
                     self._dispose_local_vlan_hints()
+                    self.persist_local_vlan_state()
                 except Exception:
                     LOG.exception(_LE("Error while processing VIF ports"))
                     # Put the ports back in self.updated_port
                     self.updated_ports |= updated_ports_copy
                     sync = True
+                finally:
+                    self._stop_flow_bundles()
             port_stats = self.get_port_stats(port_info, ancillary_port_info)
             self.loop_count_and_wait(start, port_stats)
 
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the iptables firewall drivers against synthetic topologies.
+
+The firewall is driven through SecurityGroupAgentRpc, the same way an L2
+agent does, with a fake plugin RPC and a fake execute emulating
+iptables-save/iptables-restore, so no kernel or root access is needed:
+
+    python -m neutron.tests.common.firewall_benchmark --ports 200 \\
+        --groups 10 --rules 20 --remote-groups 2
+"""
+
+import argparse
+import collections
+import contextlib
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import mock
+from oslo_config import cfg
+import six
+
+from neutron.agent.common import config
+from neutron.agent import securitygroups_rpc as sg_rpc
+from neutron.common import constants
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+DRIVERS = {
+    'iptables': 'neutron.agent.linux.iptables_firewall.'
+                'IptablesFirewallDriver',
+    'hybrid': 'neutron.agent.linux.iptables_firewall.'
+              'OVSHybridIptablesFirewallDriver',
+}
+BUILTIN_CHAINS = {
+    'filter': ['INPUT', 'FORWARD', 'OUTPUT'],
+    'mangle': ['PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING'],
+    'nat': ['PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING'],
+    'raw': ['PREROUTING', 'OUTPUT'],
+}
+
+Topology = collections.namedtuple(
+    'Topology', ['ports', 'groups', 'rules', 'remote_groups', 'members'])
+
+
+class FakeIptables(object):
+    """Minimal model of the kernel tables behind iptables-save/restore.
+
+    It understands the statements IptablesManager sends to
+    iptables-restore --noflush: chain creation, indexed insertion and
+    deletion, and chain removal.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        for table, chains in six.iteritems(BUILTIN_CHAINS):
+            self.tables[table] = collections.OrderedDict(
+                (chain, []) for chain in chains)
+
+    def save(self, table=None):
+        lines = ['# Generated by iptables-save']
+        for name in sorted(self.tables):
+            if table and name != table:
+                continue
+            chains = self.tables[name]
+            lines.append('*%s' % name)
+            for chain in chains:
+                policy = 'ACCEPT' if chain in BUILTIN_CHAINS[name] else '-'
+                lines.append(':%s %s [0:0]' % (chain, policy))
+            for chain, rules in six.iteritems(chains):
+                lines += ['-A %s %s' % (chain, rule) for rule in rules]
+            lines.append('COMMIT')
+        lines.append('# Completed by iptables-save')
+        return '\n'.join(lines) + '\n'
+
+    def restore(self, process_input):
+        chains = None
+        for line in process_input.split('\n'):
+            if not line or line.startswith('#') or line == 'COMMIT':
+                continue
+            if line.startswith('*'):
+                chains = self.tables.setdefault(
+                    line[1:], collections.OrderedDict())
+            elif line.startswith(':'):
+                chains.setdefault(line[1:].split(' ', 1)[0], [])
+            elif line.startswith('-X '):
+                del chains[line[3:]]
+            elif line.startswith('-D '):
+                chain, index = line[3:].split(' ')
+                del chains[chain][int(index) - 1]
+            elif line.startswith('-I '):
+                chain, index, rule = line[3:].split(' ', 2)
+                chains[chain].insert(int(index) - 1, rule)
+            else:
+                raise RuntimeError('Unsupported statement: %s' % line)
+
+    def rule_count(self):
+        return sum(len(rules) for chains in self.tables.values()
+                   for rules in chains.values())
+
+
+class FakeExecute(object):
+    """Replacement for utils.execute recording what would be executed."""
+
+    def __init__(self):
+        self.iptables = {'iptables': FakeIptables(),
+                         'ip6tables': FakeIptables()}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.restore_calls = 0
+        self.restore_bytes = 0
+        self.save_calls = 0
+        self.other_calls = collections.Counter()
+
+    def __call__(self, cmd, process_input=None, **kwargs):
+        binary = cmd[0]
+        if binary.endswith('-save'):
+            self.save_calls += 1
+            table = cmd[cmd.index('-t') + 1] if '-t' in cmd else None
+            return self.iptables[binary[:-len('-save')]].save(table)
+        if binary.endswith('-restore'):
+            self.restore_calls += 1
+            self.restore_bytes += len(process_input)
+            self.iptables[binary[:-len('-restore')]].restore(process_input)
+            return ''
+        self.other_calls[binary] += 1
+        return ''
+
+    def rule_count(self):
+        return sum(iptables.rule_count()
+                   for iptables in self.iptables.values())
+
+
+def _sg_id(index):
+    return '5eb04c1d-8e8f-4a2b-9c3d-%012x' % index
+
+
+def _port_ip(index):
+    return '10.%d.%d.%d' % (index >> 16 & 255, index >> 8 & 255,
+                            (index & 255) or 1)
+
+
+class FakePluginRpc(object):
+    """Serves the security group information of a synthetic topology.
+
+    Each port is in one group, round robin. Each group has rules TCP
+    rules, and remote_groups of them reference the following groups
+    instead of a prefix. Each group also has members remote IPs on top
+    of the addresses of its ports.
+    """
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.sg_rules = {}
+        self.sg_member_ips = {}
+        self.ports = {}
+        for group in range(topology.groups):
+            sg_id = _sg_id(group)
+            rules = []
+            for rule in range(topology.rules):
+                sg_rule = {'direction': 'ingress',
+                           'ethertype': constants.IPv4,
+                           'protocol': constants.PROTO_NAME_TCP,
+                           'port_range_min': 1000 + rule,
+                           'port_range_max': 1000 + rule}
+                if rule < topology.remote_groups:
+                    sg_rule['remote_group_id'] = _sg_id(
+                        (group + rule + 1) % topology.groups)
+                else:
+                    sg_rule['source_ip_prefix'] = '192.168.%d.0/24' % (
+                        rule % 256)
+                rules.append(sg_rule)
+            rules.append({'direction': 'egress',
+                          'ethertype': constants.IPv4})
+            self.sg_rules[sg_id] = rules
+            self.sg_member_ips[sg_id] = {
+                constants.IPv4: ['172.16.%d.%d' % (group % 256, member + 1)
+                                 for member in range(topology.members)],
+                constants.IPv6: []}
+        for index in range(topology.ports):
+            sg_id = _sg_id(index % topology.groups)
+            device = 'tap%08d-00' % index
+            self.ports[device] = {
+                'device': device,
+                'network_id': 'net-%d' % (index % 4),
+                'mac_address': 'fa:16:3e:%02x:%02x:%02x' % (
+                    index >> 16 & 255, index >> 8 & 255, index & 255),
+                'fixed_ips': [_port_ip(index)],
+                'allowed_address_pairs': [],
+                'security_groups': [sg_id],
+                'security_group_source_groups': [],
+                'security_group_rules': []}
+            self.sg_member_ips[sg_id][constants.IPv4].append(_port_ip(index))
+
+    def security_group_info_for_devices(self, context, devices):
+        ports = dict((device, dict(self.ports[device]))
+                     for device in devices)
+        sg_ids = set()
+        for port in ports.values():
+            sg_ids.update(port['security_groups'])
+        remote_sg_ids = set()
+        for sg_id in sg_ids:
+            remote_sg_ids.update(rule['remote_group_id']
+                                 for rule in self.sg_rules[sg_id]
+                                 if rule.get('remote_group_id'))
+        for port in ports.values():
+            port['security_group_source_groups'] = sorted(remote_sg_ids)
+        return {
+            'devices': ports,
+            'security_groups': dict(
+                (sg_id, [dict(rule) for rule in self.sg_rules[sg_id]])
+                for sg_id in sg_ids),
+            'sg_member_ips': dict(
+                (sg_id, dict((ethertype, list(ips)) for ethertype, ips in
+                             six.iteritems(self.sg_member_ips[sg_id])))
+                for sg_id in remote_sg_ids)}
+
+
+class Result(collections.namedtuple(
+        'Result', ['step', 'seconds', 'rules', 'restore_calls',
+                   'restore_bytes', 'save_calls', 'peak_memory_kb'])):
+
+    FORMAT = '%-14s %10s %8s %9s %14s %6s %15s'
+
+    @classmethod
+    def header(cls):
+        return cls.FORMAT % ('step', 'seconds', 'rules', 'restores',
+                             'restore bytes', 'saves', 'peak memory kB')
+
+    def __str__(self):
+        return self.FORMAT % (self.step, '%.3f' % self.seconds, self.rules,
+                              self.restore_calls, self.restore_bytes,
+                              self.save_calls, self.peak_memory_kb)
+
+
+def _peak_memory_kb():
+    if tracemalloc and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1] // 1024
+    # the process wide high water mark, it can't be reset between steps
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextlib.contextmanager
+def _configured(driver, enable_ipset, shared_sg_chains, incremental_apply):
+    config.register_root_helper(cfg.CONF)
+    config.register_iptables_opts(cfg.CONF)
+    lock_path = tempfile.mkdtemp()
+    overrides = [('firewall_driver', DRIVERS[driver], 'SECURITYGROUP'),
+                 ('enable_security_group', True, 'SECURITYGROUP'),
+                 ('enable_ipset', enable_ipset, 'SECURITYGROUP'),
+                 ('shared_sg_chains', shared_sg_chains, 'SECURITYGROUP'),
+                 ('iptables_incremental_apply', incremental_apply, 'AGENT'),
+                 ('comment_iptables_rules', False, 'AGENT'),
+                 ('lock_path', lock_path, 'oslo_concurrency')]
+    try:
+        for name, value, group in overrides:
+            cfg.CONF.set_override(name, value, group)
+        yield
+    finally:
+        for name, _value, group in overrides:
+            cfg.CONF.clear_override(name, group)
+        shutil.rmtree(lock_path, ignore_errors=True)
+
+
+def _run(topology, driver, enable_ipset, shared_sg_chains,
+         incremental_apply, trace_memory):
+    """Run the benchmark steps once and return a list of Result.
+
+    With trace_memory, the memory allocations of each step are traced,
+    which slows the step down.
+    """
+    execute = FakeExecute()
+    plugin_rpc = FakePluginRpc(topology)
+    results = []
+
+    def measure(step, func, *args):
+        execute.reset_counters()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.time()
+        try:
+            func(*args)
+            seconds = time.time() - start
+            peak_memory_kb = _peak_memory_kb()
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        results.append(Result(step, seconds, execute.rule_count(),
+                              execute.restore_calls, execute.restore_bytes,
+                              execute.save_calls, peak_memory_kb))
+
+    with _configured(driver, enable_ipset, shared_sg_chains,
+                     incremental_apply), \
+            mock.patch('neutron.agent.linux.utils.execute', new=execute):
+        agent = sg_rpc.SecurityGroupAgentRpc(mock.Mock(), plugin_rpc)
+        devices = sorted(plugin_rpc.ports)
+        sg_id = _sg_id(0)
+        measure('prepare', agent.prepare_devices_filter, devices)
+        measure('refresh', agent.refresh_firewall, devices)
+
+        plugin_rpc.sg_rules[sg_id].append(
+            {'direction': 'ingress', 'ethertype': constants.IPv4,
+             'protocol': constants.PROTO_NAME_UDP,
+             'port_range_min': 53, 'port_range_max': 53})
+        measure('rule_update', agent.security_groups_rule_updated, [sg_id])
+
+        plugin_rpc.sg_member_ips[sg_id][constants.IPv4].append('172.31.0.1')
+        measure('member_update', agent.security_groups_member_updated,
+                [sg_id])
+    return results
+
+
+def run(topology, driver='iptables', enable_ipset=True,
+        shared_sg_chains=False, incremental_apply=False):
+    """Run the benchmark steps and return a list of Result.
+
+    The steps are the initial filtering of all the ports, a refresh of
+    all the ports without any change, a rule update of one group and a
+    member update of one group.
+
+    When tracemalloc is available, the steps are run a second time with
+    memory tracing on, and the peak memory of the steps is taken from
+    that run. The other figures come from the first run, done with
+    tracing off so that it does not distort the time.
+    """
+    args = (topology, driver, enable_ipset, shared_sg_chains,
+            incremental_apply)
+    results = _run(*args, trace_memory=False)
+    if tracemalloc:
+        traced_results = _run(*args, trace_memory=True)
+        results = [
+            result._replace(peak_memory_kb=traced_result.peak_memory_kb)
+            for result, traced_result in six.moves.zip(results,
+                                                       traced_results)]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ports', type=int, default=100,
+                        help='Number of ports filtered on the host.')
+    parser.add_argument('--groups', type=int, default=10,
+                        help='Number of security groups of the ports.')
+    parser.add_argument('--rules', type=int, default=10,
+                        help='Number of ingress rules per security group.')
+    parser.add_argument('--remote-groups', type=int, default=2,
+                        help='Number of rules per security group which '
+                             'reference a remote group.')
+    parser.add_argument('--members', type=int, default=10,
+                        help='Number of remote members per security group '
+                             'besides the local ports.')
+    parser.add_argument('--driver', choices=sorted(DRIVERS),
+                        default='iptables')
+    parser.add_argument('--no-ipset', dest='enable_ipset',
+                        action='store_false')
+    parser.add_argument('--shared-sg-chains', action='store_true')
+    parser.add_argument('--incremental-apply', action='store_true')
+    args = parser.parse_args(argv)
+    if args.remote_groups > args.rules:
+        parser.error('--remote-groups can not be larger than --rules')
+
+    topology = Topology(args.ports, args.groups, args.rules,
+                        args.remote_groups, args.members)
+    results = run(topology, driver=args.driver,
+                  enable_ipset=args.enable_ipset,
+                  shared_sg_chains=args.shared_sg_chains,
+                  incremental_apply=args.incremental_apply)
+    print(Result.header())
+    for result in results:
+        print(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Copyright 2016 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_serialization import jsonutils
+
+from neutron.agent.common import loop_timing
+from neutron.tests import base
+
+
+class TestGetPercentile(base.BaseTestCase):
+
+    def test_get_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(50, loop_timing.get_percentile(samples, 50))
+        self.assertEqual(99, loop_timing.get_percentile(samples, 99))
+        self.assertEqual(1, loop_timing.get_percentile([1, 2], 10))
+
+    def test_get_percentile_no_sample(self):
+        self.assertIsNone(loop_timing.get_percentile([], 50))
+
+
+class TestLoopTimer(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestLoopTimer, self).setUp()
+        self.timer = loop_timing.LoopTimer(max_samples=3)
+
+    def test_measure(self):
+        with mock.patch.object(loop_timing.time, 'time',
+                               side_effect=[10, 12.5]):
+            with self.timer.measure('scan_ports'):
+                pass
+        self.assertEqual({'scan_ports': 2.5},
+                         self.timer.get_iteration_phases())
+
+    def test_measure_raises(self):
+        def _measure():
+            with self.timer.measure('tunnel_sync'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, _measure)
+        self.assertIn('tunnel_sync', self.timer.get_iteration_phases())
+
+    def test_complete_iteration(self):
+        self.timer.add_sample('update_device_list', 1)
+        self.timer.add_sample('update_device_list', 2)
+        port_stats = {'regular': {'added': 2}}
+        self.timer.complete_iteration(7, 4, port_stats)
+        self.assertEqual({}, self.timer.get_iteration_phases())
+        stats = self.timer.get_stats()
+        self.assertEqual({'iteration': 7,
+                          'elapsed': 4,
+                          'phases': {'update_device_list': 3},
+                          'port_stats': port_stats},
+                         stats['last_iteration'])
+        self.assertEqual({'count': 2, 'max': 2, 'p50': 1, 'p90': 2,
+                          'p99': 2},
+                         stats['phases']['update_device_list'])
+        self.assertEqual(1, stats['phases']['iteration']['count'])
+
+    def test_samples_are_bounded(self):
+        for elapsed in (10, 1, 2, 3):
+            self.timer.add_sample('scan_ports', elapsed)
+        stats = self.timer.get_stats()['phases']['scan_ports']
+        self.assertEqual(4, stats['count'])
+        self.assertEqual(3, stats['max'])
+
+    def test_complete_iteration_dumps_stats(self):
+        self.timer.dump_file = '/tmp/loop_timing.json'
+        with mock.patch.object(loop_timing.common_utils,
+                               'replace_file') as replace_file:
+            self.timer.complete_iteration(1, 2, {})
+        replace_file.assert_called_once_with('/tmp/loop_timing.json',
+                                             mock.ANY)
+        self.assertEqual(self.timer.get_stats(), jsonutils.loads(
+            replace_file.call_args[0][1]))
+
+    def test_dump_failure_is_logged(self):
+        self.timer.dump_file = '/nonexistent/loop_timing.json'
+        with mock.patch.object(loop_timing.LOG, 'exception') as log_exc:
+            self.timer.dump()
+        self.assertTrue(log_exc.called)
@@ -291,6 +291,106 @@ class OVS_Lib_Test(base.BaseTestCase):
         ]
         self.execute.assert_has_calls(expected_calls)
 
+    def test_flow_bundle(self):
+        self.br.start_flow_bundle()
+        self.br.add_flow(cookie=1234, priority=2, actions='normal')
+        self.br.delete_flows(in_port=5)
+        self.assertFalse(self.execute.called)
+        self.br.stop_flow_bundle()
+        self._verify_ofctl_mock(
+            "add-flows", self.BR_NAME, '--bundle', '-',
+            process_input="add hard_timeout=0,idle_timeout=0,priority=2,"
+                          "cookie=1234,actions=normal\n"
+                          "delete in_port=5")
+        self.br.delete_flows(in_port=5)
+        self.assertEqual(2, self.execute.call_count)
+
+    def test_flow_bundle_applied_before_other_commands(self):
+        self.execute.return_value = 'ignore\nflow-1\n'
+        self.br.start_flow_bundle()
+        self.br.mod_flow(in_port=5, actions='drop')
+        self.br.count_flows()
+        self.execute.assert_has_calls([
+            self._ofctl_mock("add-flows", self.BR_NAME, '--bundle', '-',
+                             process_input="modify in_port=5,cookie=0,"
+                                           "actions=drop"),
+            self._ofctl_mock("dump-flows", self.BR_NAME, process_input=None)])
+
+    def test_flow_bundle_failure(self):
+        self.execute.side_effect = [RuntimeError, '', RuntimeError]
+        self.br.start_flow_bundle()
+        self.br.delete_flows(in_port=5)
+        self.br.delete_flows(in_port=6)
+        with mock.patch.object(ovs_lib.LOG, 'error') as log_error:
+            self.br.apply_flow_bundle()
+        self.execute.assert_has_calls([
+            self._ofctl_mock("add-flows", self.BR_NAME, '--bundle', '-',
+                             process_input="delete in_port=5\n"
+                                           "delete in_port=6"),
+            self._ofctl_mock("del-flows", self.BR_NAME, '-',
+                             process_input="in_port=5"),
+            self._ofctl_mock("del-flows", self.BR_NAME, '-',
+                             process_input="in_port=6")])
+        # the bundle, the second flow and which flow failed are reported
+        self.assertEqual(3, log_error.call_count)
+        self.assertEqual('in_port=6', log_error.call_args[0][1]['flow'])
+
+    def _load_flow_mirror(self):
+        self.execute.return_value = "\n".join([
+            "NXST_FLOW reply (xid=0x4):",
+            " cookie=0x4d2, duration=8.5s, table=0, n_packets=0, n_bytes=0, "
+            "idle_age=8, priority=2,in_port=0x5 actions=drop",
+            " cookie=0x4d2, duration=8.5s, table=22, n_packets=0, "
+            "n_bytes=0, idle_age=8, priority=1,dl_vlan=7 actions=NORMAL",
+            " cookie=0x4d2, duration=8.5s, table=0, n_packets=0, n_bytes=0, "
+            "idle_timeout=300, idle_age=8, priority=3,in_port=6 "
+            "actions=drop"])
+        self.br.load_flow_mirror()
+        self.execute.reset_mock()
+
+    def test_flow_mirror_skips_installed_flows(self):
+        self._load_flow_mirror()
+        self.br.add_flow(priority=2, in_port=5, actions='drop')
+        self.br.add_flow(table=22, priority=1, dl_vlan=7, actions='normal')
+        self.assertFalse(self.execute.called)
+        # other actions, a timeout or another match are installed
+        self.br.add_flow(table=22, priority=1, dl_vlan=7, actions='drop')
+        self.br.add_flow(priority=3, in_port=6, actions='drop',
+                         idle_timeout=300)
+        self.br.add_flow(priority=2, in_port=7, actions='drop')
+        self.assertEqual(3, self.execute.call_count)
+        self.assertEqual({('0', '2', frozenset([('in_port', '5')]))},
+                         self.br.stop_flow_mirror())
+        self.br.add_flow(priority=2, in_port=5, actions='drop')
+        self.assertEqual(4, self.execute.call_count)
+
+    def test_flow_mirror_forgets_modified_flows(self):
+        self._load_flow_mirror()
+        # in_port=6 can't match the mirrored flows
+        self.br.delete_flows(in_port=6)
+        self.br.add_flow(priority=2, in_port=5, actions='drop')
+        self.assertEqual(1, self.execute.call_count)
+        self.br.delete_flows(table=22, dl_dst='aa:bb:cc:dd:ee:ff')
+        self.br.mod_flow(in_port=5, actions='normal')
+        self.br.add_flow(priority=2, in_port=5, actions='drop')
+        self.br.add_flow(table=22, priority=1, dl_vlan=7, actions='normal')
+        self.assertEqual(5, self.execute.call_count)
+        self.assertEqual(set(), self.br.stop_flow_mirror())
+
+    def test_get_flow_key(self):
+        dumped_flow = (" cookie=0x4d2, duration=8.5s, table=3, n_packets=0, "
+                       "n_bytes=0, idle_age=8, priority=2,arp,in_port=5,"
+                       "dl_src=AA:BB:CC:DD:EE:FF actions=drop")
+        built_flow = ovs_lib._build_flow_expr_str(
+            {'table': 3, 'priority': 2, 'cookie': 1234, 'proto': 'arp',
+             'in_port': '0x5', 'dl_src': 'aa:bb:cc:dd:ee:ff',
+             'actions': 'drop'}, 'add')
+        self.assertEqual(ovs_lib.get_flow_key(dumped_flow),
+                         ovs_lib.get_flow_key(built_flow))
+        self.assertEqual('table=3,priority=2,arp,in_port=5,'
+                         'dl_src=AA:BB:CC:DD:EE:FF',
+                         ovs_lib.get_flow_match_str(dumped_flow))
+
     def test_delete_flow_with_priority_set(self):
         params = {'in_port': '1',
                   'priority': '1'}
@@ -435,6 +535,46 @@ class OVS_Lib_Test(base.BaseTestCase):
 
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
+    def test_add_tunnel_ports(self):
+        local_ip = "1.1.1.1"
+        tunnels = collections.OrderedDict([('gre-1', '9.9.9.9'),
+                                           ('gre-2', '8.8.8.8')])
+        command = []
+        for pname, remote_ip in tunnels.items():
+            command.extend(["--may-exist", "add-port", self.BR_NAME, pname,
+                            "--", "set", "Interface", pname,
+                            "type=gre", "options:df_default=true",
+                            "options:remote_ip=" + remote_ip,
+                            "options:local_ip=" + local_ip,
+                            "options:in_key=flow",
+                            "options:out_key=flow", "--"])
+        # Each element is a tuple of (expected mock call, return_value)
+        expected_calls_and_values = [
+            (self._vsctl_mock(*command[:-1]), None),
+            (self._vsctl_mock("--if-exists", "--columns=name,ofport", "list",
+                              "Interface", "gre-1", "gre-2"),
+             self._encode_ovs_json(['name', 'ofport'],
+                                   [['gre-1', 6], ['gre-2', -1]])),
+        ]
+        tools.setup_mock_calls(self.execute, expected_calls_and_values)
+
+        self.assertEqual(
+            {'gre-1': 6, 'gre-2': ovs_lib.INVALID_OFPORT},
+            self.br.add_tunnel_ports(tunnels, local_ip))
+
+        tools.verify_mock_calls(self.execute, expected_calls_and_values)
+
+    def test_get_ports_ofports_timeout(self):
+        self.br.vsctl_timeout = 0.1
+        with mock.patch.object(
+                self.br, 'get_ports_attributes',
+                return_value=[{'name': 'gre-1', 'ofport': 6}]),\
+                mock.patch.object(ovs_lib.LOG, 'error') as log_error:
+            self.assertEqual(
+                {'gre-1': 6, 'gre-2': ovs_lib.INVALID_OFPORT},
+                self.br.get_ports_ofports(['gre-1', 'gre-2']))
+        self.assertEqual(['gre-2'], log_error.call_args[0][1])
+
     def _test_get_vif_ports(self, is_xen=False):
         pname = "tap99"
         ofport = 6
@@ -530,6 +670,19 @@ class OVS_Lib_Test(base.BaseTestCase):
     def test_get_vif_ports_xen(self):
         self._test_get_vif_ports(is_xen=True)
 
+    def test_get_ports_attributes_from_local_db_copy(self):
+        rows = [{'name': 'tap99', 'tag': 1}]
+        with mock.patch.object(self.br.ovsdb,
+                               'list_bridge_rows') as list_bridge_rows:
+            list_bridge_rows.return_value.execute.return_value = rows
+            self.assertEqual(rows, self.br.get_ports_attributes(
+                'Port', columns=['name', 'tag'], if_exists=True))
+        list_bridge_rows.assert_called_once_with(
+            self.BR_NAME, 'Port', columns=['name', 'tag'])
+        list_bridge_rows.return_value.execute.assert_called_once_with(
+            check_error=True, log_errors=True)
+        self.assertFalse(self.execute.called)
+
     def test_get_vif_port_set_nonxen(self):
         self._test_get_vif_port_set(False)
 
@@ -796,7 +949,8 @@ class TestDeferredOVSBridge(base.BaseTestCase):
         self.del_flow_dict2 = dict(in_port=32)
 
     def test_right_allowed_passthroughs(self):
-        expected_passthroughs = ('add_port', 'add_tunnel_port', 'delete_port')
+        expected_passthroughs = ('add_port', 'add_tunnel_port',
+                                 'add_tunnel_ports', 'delete_port')
         self.assertEqual(expected_passthroughs,
                          ovs_lib.DeferredOVSBridge.ALLOWED_PASSTHROUGHS)
 
@@ -0,0 +1,93 @@
+# Copyright 2016 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_serialization import jsonutils
+
+from neutron.agent.common import state_file
+from neutron.tests import base
+
+
+class TestStateFile(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestStateFile, self).setUp()
+        self.path = self.get_temp_file_path('state.json')
+        self.state_file = state_file.StateFile(self.path, 'entries',
+                                               entry_keys=('value',))
+
+    def _write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_save_and_load(self):
+        entries = {'entry1': {'value': 1}, 'entry2': {'value': 2}}
+        self.state_file.save(entries)
+        loaded = state_file.StateFile(self.path, 'entries').load()
+        self.assertEqual(entries, loaded)
+
+    def test_load_no_file(self):
+        self.assertEqual({}, self.state_file.load())
+
+    def test_load_no_path(self):
+        self.assertEqual({}, state_file.StateFile(None, 'entries').load())
+
+    def test_load_invalid_json(self):
+        self._write('{"entries": ')
+        self.assertEqual({}, self.state_file.load())
+
+    def test_load_unexpected_document(self):
+        for content in ([], {}, {'entries': []}, {'entries': None}, 'value'):
+            self._write(jsonutils.dumps(content))
+            self.assertEqual({}, self.state_file.load())
+
+    def test_load_invalid_entries(self):
+        self._write(jsonutils.dumps({'entries': {'entry1': {'value': 1},
+                                                 'entry2': {'other': 2},
+                                                 'entry3': [1]}}))
+        self.assertEqual({'entry1': {'value': 1}}, self.state_file.load())
+
+    def test_save_unchanged(self):
+        with mock.patch.object(state_file.common_utils,
+                               'replace_file') as replace_file:
+            self.state_file.save({'entry1': {'value': 1}})
+            self.state_file.save({'entry1': {'value': 1}})
+        replace_file.assert_called_once_with(
+            self.path, jsonutils.dumps({'entries': {'entry1': {'value': 1}}}))
+
+    def test_save_unchanged_since_load(self):
+        self._write(jsonutils.dumps({'entries': {'entry1': {'value': 1}}}))
+        entries = self.state_file.load()
+        with mock.patch.object(state_file.common_utils,
+                               'replace_file') as replace_file:
+            self.state_file.save(entries)
+            self.assertFalse(replace_file.called)
+            # the loaded entries can be changed in place
+            entries['entry1']['value'] = 2
+            self.state_file.save(entries)
+            self.assertTrue(replace_file.called)
+
+    def test_save_failed(self):
+        with mock.patch.object(state_file.common_utils, 'replace_file',
+                               side_effect=IOError()) as replace_file:
+            self.state_file.save({'entry1': {'value': 1}})
+            self.state_file.save({'entry1': {'value': 1}})
+        # the state is written again as it was not persisted
+        self.assertEqual(2, replace_file.call_count)
+
+    def test_save_no_path(self):
+        with mock.patch.object(state_file.common_utils,
+                               'replace_file') as replace_file:
+            state_file.StateFile(None, 'entries').save({})
+        self.assertFalse(replace_file.called)
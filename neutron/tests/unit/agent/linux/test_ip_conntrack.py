@@ -0,0 +1,83 @@
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import mock
+
+from neutron.agent.linux import ip_conntrack
+from neutron.tests import base
+
+DEVICES = [{'device': 'tapdev1', 'fixed_ips': ['10.0.0.1']},
+           {'device': 'tapdev2', 'fixed_ips': ['10.0.0.2']}]
+ZONES = {'tapdev1': 1, 'tapdev2': 2}
+RULE = {'ethertype': 'IPv4', 'direction': 'ingress'}
+
+
+class IpConntrackTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IpConntrackTestCase, self).setUp()
+        self.execute = mock.Mock()
+        self.mgr = ip_conntrack.IpConntrackManager(
+            ZONES.get, execute=self.execute)
+
+    def _cmd(self, ip, zone, remote_ip=None):
+        cmd = ['conntrack', '-D', '-f', 'ipv4', '-d', ip, '-w', zone]
+        if remote_ip:
+            cmd.extend(['-s', remote_ip])
+        return mock.call(cmd, run_as_root=True, check_exit_code=True,
+                         extra_ok_codes=[1])
+
+    def test_delete_by_rule_is_synchronous(self):
+        self.mgr.delete_conntrack_state_by_rule(DEVICES, RULE)
+        self.execute.assert_has_calls([self._cmd('10.0.0.1', 1),
+                                       self._cmd('10.0.0.2', 2)])
+        self.assertEqual(0, self.mgr.get_queue_stats()['pending'])
+        self.assertEqual(2, self.mgr.get_queue_stats()['purged'])
+
+    def test_deletions_are_deduplicated_and_grouped_by_zone(self):
+        self.mgr._delete_conntrack_state(DEVICES, RULE, '10.0.0.9')
+        self.mgr._delete_conntrack_state(DEVICES[1:], RULE)
+        self.mgr._delete_conntrack_state(DEVICES, RULE, '10.0.0.9')
+        self.mgr._delete_conntrack_state(DEVICES[:1], RULE)
+        stats = self.mgr.get_queue_stats()
+        self.assertEqual(4, stats['pending'])
+        self.assertEqual(2, stats['zones_pending'])
+        self.assertEqual(2, stats['deduplicated'])
+
+        self.mgr._process_pending()
+        self.assertEqual([self._cmd('10.0.0.1', 1, '10.0.0.9'),
+                          self._cmd('10.0.0.1', 1),
+                          self._cmd('10.0.0.2', 2, '10.0.0.9'),
+                          self._cmd('10.0.0.2', 2)],
+                         self.execute.call_args_list)
+
+    def test_failed_deletion_is_counted(self):
+        self.execute.side_effect = RuntimeError
+        self.mgr.delete_conntrack_state_by_remote_ips(DEVICES[:1], 'IPv4',
+                                                      set())
+        self.assertEqual(1, self.mgr.get_queue_stats()['failed'])
+
+    def test_async_purge_uses_worker(self):
+        self.mgr.async_purge = True
+        with mock.patch('eventlet.spawn_n') as spawn_n:
+            self.mgr.delete_conntrack_state_by_rule(DEVICES, RULE)
+            self.mgr.delete_conntrack_state_by_remote_ips(
+                DEVICES, 'IPv4', ['10.0.0.9'])
+        spawn_n.assert_called_once_with(self.mgr._purge_worker)
+        self.assertFalse(self.execute.called)
+        self.assertEqual(4, self.mgr.get_queue_stats()['pending'])
+
+        self.mgr._purge_worker()
+        self.assertEqual(4, self.execute.call_count)
+        self.assertFalse(self.mgr._worker_running)
+        self.assertEqual(0, self.mgr.get_queue_stats()['pending'])
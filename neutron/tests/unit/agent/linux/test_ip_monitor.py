@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import mock
+
 from neutron.agent.linux import ip_monitor
 from neutron.tests import base
 
@@ -34,3 +36,57 @@ class TestIPMonitorEvent(base.BaseTestCase):
         self.assertEqual('lo', event.interface)
         self.assertFalse(event.added)
         self.assertEqual('127.0.0.2/8', event.cidr)
+
+
+class TestIPLinkMonitorEvent(base.BaseTestCase):
+    def test_from_text_parses_added_line(self):
+        event = ip_monitor.IPLinkMonitorEvent.from_text(
+            '12: tap1234567-89: <BROADCAST,MULTICAST> mtu 1500 qdisc noop '
+            'state DOWN group default \    link/ether 52:54:00:12:34:56 '
+            'brd ff:ff:ff:ff:ff:ff')
+        self.assertEqual('tap1234567-89', event.interface)
+        self.assertTrue(event.added)
+
+    def test_from_text_parses_deleted_line(self):
+        event = ip_monitor.IPLinkMonitorEvent.from_text(
+            'Deleted 13: vxlan-100@eth0: <BROADCAST,MULTICAST> mtu 1450 '
+            'qdisc noop state DOWN group default')
+        self.assertEqual('vxlan-100', event.interface)
+        self.assertFalse(event.added)
+
+
+class TestIPLinkMonitor(base.BaseTestCase):
+    def setUp(self):
+        super(TestIPLinkMonitor, self).setUp()
+        self.monitor = ip_monitor.IPLinkMonitor()
+        mock.patch.object(self.monitor, 'is_active',
+                          return_value=True).start()
+
+    def _put_lines(self, *lines):
+        for line in lines:
+            self.monitor._stdout_lines.put(line)
+
+    def test_get_events(self):
+        self._put_lines('1: tap1: <BROADCAST> mtu 1500',
+                        '2: tap2: <BROADCAST> mtu 1500',
+                        'Deleted 2: tap2: <BROADCAST> mtu 1500',
+                        'Deleted 3: tap3: <BROADCAST> mtu 1500',
+                        'unparsable')
+        self.assertTrue(self.monitor.has_updates)
+        self.assertEqual({'added': set(['tap1']),
+                          'removed': set(['tap2', 'tap3'])},
+                         self.monitor.get_events())
+        self.assertFalse(self.monitor.has_updates)
+
+    def test_has_updates_not_active(self):
+        self.monitor.is_active.return_value = False
+        self.assertTrue(self.monitor.has_updates)
+
+    def test_wait_for_events(self):
+        self._put_lines('1: tap1: <BROADCAST> mtu 1500')
+        self.monitor.wait_for_events(1)
+        self.assertEqual(set(['tap1']), self.monitor.new_events['added'])
+
+    def test_wait_for_events_timeout(self):
+        self.monitor.wait_for_events(0.01)
+        self.assertFalse(self.monitor.has_updates)
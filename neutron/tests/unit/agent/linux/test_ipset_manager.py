@@ -163,3 +163,83 @@ class IpsetManagerTestCase(BaseIpsetManagerTest):
         self.expect_destroy()
         self.ipset.destroy(TEST_SET_ID, ETHERTYPE)
         self.verify_mock_calls()
+
+
+class IpsetManagerDeferApplyTestCase(BaseIpsetManagerTest):
+
+    def setUp(self):
+        super(IpsetManagerDeferApplyTestCase, self).setUp()
+        self.expected_calls = []
+
+    def expect_restore(self, lines):
+        self.expected_calls.append(
+            mock.call(['ipset', 'restore', '-exist'],
+                      process_input='\n'.join(lines),
+                      run_as_root=True,
+                      check_exit_code=True))
+
+    def _swap_lines(self, set_name, addresses):
+        new_set_name = set_name + ipset_manager.SWAP_SUFFIX
+        return (['create %s hash:net family inet' % new_set_name] +
+                ['add %s %s' % (new_set_name, ip)
+                 for ip in self.ipset._sanitize_addresses(addresses)] +
+                ['swap %s %s' % (new_set_name, set_name),
+                 'destroy %s' % new_set_name])
+
+    def test_new_sets_are_restored_once(self):
+        other_set_name = self.ipset.get_name('other_sgid', ETHERTYPE)
+        self.expect_restore(
+            ['create %s hash:net family inet' % TEST_SET_NAME] +
+            self._swap_lines(TEST_SET_NAME, FAKE_IPS[:2]) +
+            ['create %s hash:net family inet' % other_set_name] +
+            self._swap_lines(other_set_name, FAKE_IPS[2:3]))
+
+        self.ipset.defer_apply_on()
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[:2])
+        self.ipset.set_members('other_sgid', ETHERTYPE, FAKE_IPS[2:3])
+        self.assertFalse(self.execute.called)
+        self.assertTrue(self.ipset.set_name_exists(TEST_SET_NAME))
+        self.ipset.defer_apply_off()
+
+        self.verify_mock_calls()
+        self.assertEqual(1, self.execute.call_count)
+
+    def test_small_changes_are_coalesced(self):
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[:3])
+        self.execute.reset_mock()
+        self.expect_restore(['del %s %s/32' % (TEST_SET_NAME, FAKE_IPS[0]),
+                             'add %s %s/32' % (TEST_SET_NAME, FAKE_IPS[3])])
+
+        self.ipset.defer_apply_on()
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[1:3])
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[1:4])
+        self.ipset.defer_apply_off()
+
+        self.execute.assert_has_calls(self.expected_calls)
+        self.assertEqual(1, self.execute.call_count)
+
+    def test_defer_apply_off_without_changes(self):
+        self.ipset.defer_apply_on()
+        self.ipset.defer_apply_off()
+        self.assertFalse(self.execute.called)
+
+    def test_restore_failure_forgets_sets(self):
+        self.execute.side_effect = RuntimeError
+        self.ipset.defer_apply_on()
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[:2])
+        self.assertRaises(RuntimeError, self.ipset.defer_apply_off)
+        self.assertFalse(self.ipset.set_name_exists(TEST_SET_NAME))
+
+    def test_destroy_flushes_pending_changes(self):
+        self.expect_restore(
+            ['create %s hash:net family inet' % TEST_SET_NAME] +
+            self._swap_lines(TEST_SET_NAME, FAKE_IPS[:1]))
+        self.expect_destroy()
+
+        self.ipset.defer_apply_on()
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[:1])
+        self.ipset.destroy(TEST_SET_ID, ETHERTYPE)
+        self.ipset.defer_apply_off()
+
+        self.verify_mock_calls()
+        self.assertEqual(2, self.execute.call_count)
@@ -111,7 +111,6 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                  mock.call.add_rule(
                      'sg-fallback', '-j DROP',
                      comment=ic.UNMATCH_DROP),
-                 mock.call.remove_chain('sg-chain'),
                  mock.call.add_chain('sg-chain'),
                  mock.call.add_chain('ifake_dev'),
                  mock.call.add_rule('FORWARD',
@@ -965,7 +964,6 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                      'sg-fallback',
                      '-j DROP',
                      comment=ic.UNMATCH_DROP),
-                 mock.call.remove_chain('sg-chain'),
                  mock.call.add_chain('sg-chain'),
                  mock.call.add_chain('ifake_dev'),
                  mock.call.add_rule('FORWARD',
@@ -1143,7 +1141,6 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                      'sg-fallback',
                      '-j DROP',
                      comment=ic.UNMATCH_DROP),
-                 mock.call.remove_chain('sg-chain'),
                  mock.call.add_chain('sg-chain'),
                  mock.call.add_chain('ifake_dev'),
                  mock.call.add_rule(
@@ -1214,22 +1211,8 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                      'ofake_dev',
                      '-j $sg-fallback', comment=None),
                  mock.call.add_rule('sg-chain', '-j ACCEPT'),
-                 mock.call.remove_chain('ifake_dev'),
-                 mock.call.remove_chain('ofake_dev'),
                  mock.call.remove_chain('sfake_dev'),
-                 mock.call.remove_chain('sg-chain'),
-                 mock.call.add_chain('sg-chain'),
-                 mock.call.add_chain('ifake_dev'),
-                 mock.call.add_rule(
-                     'FORWARD',
-                     '-m physdev --physdev-out tapfake_dev '
-                     '--physdev-is-bridged -j $sg-chain',
-                     comment=ic.VM_INT_SG),
-                 mock.call.add_rule(
-                     'sg-chain',
-                     '-m physdev --physdev-out tapfake_dev '
-                     '--physdev-is-bridged -j $ifake_dev',
-                     comment=ic.SG_TO_VM_SG),
+                 mock.call.empty_chain('ifake_dev'),
                  mock.call.add_rule(
                      'ifake_dev',
                      '-m state --state RELATED,ESTABLISHED -j RETURN',
@@ -1240,22 +1223,7 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                  mock.call.add_rule(
                      'ifake_dev',
                      '-j $sg-fallback', comment=None),
-                 mock.call.add_chain('ofake_dev'),
-                 mock.call.add_rule(
-                     'FORWARD',
-                     '-m physdev --physdev-in tapfake_dev '
-                     '--physdev-is-bridged -j $sg-chain',
-                     comment=ic.VM_INT_SG),
-                 mock.call.add_rule(
-                     'sg-chain',
-                     '-m physdev --physdev-in tapfake_dev '
-                     '--physdev-is-bridged -j $ofake_dev',
-                     comment=ic.SG_TO_VM_SG),
-                 mock.call.add_rule(
-                     'INPUT',
-                     '-m physdev --physdev-in tapfake_dev '
-                     '--physdev-is-bridged -j $ofake_dev',
-                     comment=ic.INPUT_TO_SG),
+                 mock.call.empty_chain('ofake_dev'),
                  mock.call.add_chain('sfake_dev'),
                  mock.call.add_rule(
                      'sfake_dev',
@@ -1287,12 +1255,17 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                  mock.call.add_rule('ofake_dev',
                                     '-j $sg-fallback',
                                     comment=None),
-                 mock.call.add_rule('sg-chain', '-j ACCEPT'),
                  mock.call.remove_chain('ifake_dev'),
+                 mock.call.remove_rule(
+                     'FORWARD',
+                     '-m physdev --physdev-out tapfake_dev '
+                     '--physdev-is-bridged -j $sg-chain'),
                  mock.call.remove_chain('ofake_dev'),
-                 mock.call.remove_chain('sfake_dev'),
-                 mock.call.remove_chain('sg-chain'),
-                 mock.call.add_chain('sg-chain')]
+                 mock.call.remove_rule(
+                     'FORWARD',
+                     '-m physdev --physdev-in tapfake_dev '
+                     '--physdev-is-bridged -j $sg-chain'),
+                 mock.call.remove_chain('sfake_dev')]
 
         self.v4filter_inst.assert_has_calls(calls)
 
@@ -1392,7 +1365,6 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                  mock.call.add_rule(
                      'sg-fallback', '-j DROP',
                      comment=ic.UNMATCH_DROP),
-                 mock.call.remove_chain('sg-chain'),
                  mock.call.add_chain('sg-chain'),
                  mock.call.add_chain('ifake_dev'),
                  mock.call.add_rule('FORWARD',
@@ -1472,7 +1444,6 @@ class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
                  mock.call.add_rule(
                      'sg-fallback', '-j DROP',
                      comment=ic.UNMATCH_DROP),
-                 mock.call.remove_chain('sg-chain'),
                  mock.call.add_chain('sg-chain'),
                  mock.call.add_chain('ifake_dev'),
                  mock.call.add_rule('FORWARD',
@@ -1851,6 +1822,309 @@ class IptablesFirewallEnhancedIpsetTestCase(BaseIptablesFirewallTestCase):
         calls = [mock.call.set_members(FAKE_SGID, constants.IPv4, [])]
         self.firewall.ipset.assert_has_calls(calls)
 
+    def _prepare_cached_port(self):
+        self.firewall.sg_rules = self._fake_sg_rules()
+        self.firewall.sg_members = self._fake_sg_members()
+        port = self._fake_port()
+        self.firewall.prepare_port_filter(port)
+        return port
+
+    def test_unchanged_port_chains_are_kept(self):
+        port = self._prepare_cached_port()
+        self.v4filter_inst.reset_mock()
+        with mock.patch.object(self.firewall,
+                               '_convert_sgr_to_iptables_rules') as convert:
+            self.firewall.update_port_filter(port)
+        self.assertFalse(convert.called)
+        self.assertFalse(self.v4filter_inst.remove_chain.called)
+        self.assertFalse(self.v4filter_inst.add_chain.called)
+        self.assertIn('tapfake_dev', self.firewall._port_chains)
+
+    def test_only_affected_ports_are_fingerprinted(self):
+        port = self._prepare_cached_port()
+        other_port = dict(self._fake_port(), device='tapother_dev',
+                          security_groups=['other_sgid'])
+        self.firewall.prepare_port_filter(other_port)
+        with mock.patch.object(
+                self.firewall, '_get_port_chains_fingerprint',
+                wraps=self.firewall._get_port_chains_fingerprint) as fp:
+            self.firewall.update_security_group_rules(
+                'other_sgid', [{'direction': 'ingress', 'ethertype': _IPv4,
+                                'protocol': 'udp'}])
+            self.firewall.update_port_filter(port)
+            self.assertEqual(
+                set(['tapfake_dev', 'tapother_dev']),
+                set(call[0][0]['device'] for call in fp.call_args_list))
+            fp.reset_mock()
+            self.firewall.update_port_filter(port)
+            self.assertEqual(
+                set(['tapfake_dev']),
+                set(call[0][0]['device'] for call in fp.call_args_list))
+
+    def test_changed_port_chains_are_refilled_in_place(self):
+        port = self._prepare_cached_port()
+        self.v4filter_inst.reset_mock()
+        port = dict(port, fixed_ips=['10.0.0.9'])
+        self.firewall.update_port_filter(port)
+        calls = self.v4filter_inst.mock_calls
+        self.assertEqual(
+            [mock.call.remove_chain('sfake_dev'),
+             mock.call.empty_chain('ifake_dev')],
+            calls[:2])
+        self.assertIn(mock.call.empty_chain('ofake_dev'), calls)
+        # the jumps to the chains and the accept rule are kept
+        self.assertFalse([call for call in calls
+                          if call[0] == 'remove_rule'])
+        for chain in ('ifake_dev', 'ofake_dev'):
+            self.assertNotIn(mock.call.remove_chain(chain), calls)
+            self.assertNotIn(mock.call.add_chain(chain), calls)
+        self.assertNotIn(mock.call.add_rule('sg-chain', '-j ACCEPT'), calls)
+
+    def test_sg_rule_change_regenerates_port_rules(self):
+        port = self._prepare_cached_port()
+        self.firewall.sg_rules[FAKE_SGID].append(
+            {'direction': 'ingress', 'ethertype': _IPv4,
+             'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22})
+        with mock.patch.object(self.firewall,
+                               '_convert_sgr_to_iptables_rules',
+                               return_value=[]) as convert:
+            self.firewall.update_port_filter(port)
+        # ipv4 and ipv6 rules of both directions
+        self.assertEqual(4, convert.call_count)
+
+    def test_remote_set_creation_regenerates_port_rules(self):
+        port = self._prepare_cached_port()
+        self.firewall.ipset.set_name_exists.return_value = False
+        with mock.patch.object(self.firewall,
+                               '_convert_sgr_to_iptables_rules',
+                               return_value=[]) as convert:
+            self.firewall.update_port_filter(port)
+        # the chains of the port are rebuilt
+        self.assertEqual(4, convert.call_count)
+
+    def _prepare_port_for_member_update(self):
+        self.firewall.sg_rules = self._fake_sg_rules()
+        self.firewall.sg_members = self._fake_sg_members()
+        port = self._fake_port()
+        self.firewall.prepare_port_filter(port)
+        self.v4filter_inst.reset_mock()
+        self.firewall.ipset.reset_mock()
+        return port
+
+    def test_apply_security_group_members(self):
+        port = self._prepare_port_for_member_update()
+        members = {FAKE_SGID: {_IPv4: ['10.0.0.1', '10.0.0.5'],
+                               _IPv6: ['fe80::1']}}
+        self.assertTrue(self.firewall.apply_security_group_members(
+            {port['device']: port}, self._fake_sg_rules(), members))
+        self.firewall.ipset.set_members.assert_any_call(
+            FAKE_SGID, _IPv4, ['10.0.0.1', '10.0.0.5'])
+        self.assertEqual(['10.0.0.1', '10.0.0.5'],
+                         self.firewall.sg_members[FAKE_SGID][_IPv4])
+        self.assertFalse(self.v4filter_inst.add_rule.called)
+        self.assertFalse(self.v4filter_inst.remove_chain.called)
+
+    def test_apply_security_group_members_rules_changed(self):
+        port = self._prepare_port_for_member_update()
+        sg_rules = self._fake_sg_rules()
+        sg_rules[FAKE_SGID].append({'direction': 'egress',
+                                    'ethertype': _IPv4})
+        self.assertFalse(self.firewall.apply_security_group_members(
+            {port['device']: port}, sg_rules, self._fake_sg_members()))
+        self.assertFalse(self.firewall.ipset.set_members.called)
+
+    def test_apply_security_group_members_ipv6_icmp_rule(self):
+        icmp_rule = {'direction': 'ingress', 'ethertype': _IPv6,
+                     'protocol': 'icmp'}
+        self.firewall.sg_rules = self._fake_sg_rules()
+        self.firewall.sg_rules[FAKE_SGID].append(dict(icmp_rule))
+        self.firewall.sg_members = self._fake_sg_members()
+        port = self._fake_port()
+        self.firewall.prepare_port_filter(port)
+        # the stored rule was rewritten when rendered
+        self.assertEqual('ipv6-icmp',
+                         self.firewall.sg_rules[FAKE_SGID][-1]['protocol'])
+        sg_rules = self._fake_sg_rules()
+        sg_rules[FAKE_SGID].append(icmp_rule)
+        self.assertTrue(self.firewall.apply_security_group_members(
+            {port['device']: port}, sg_rules, self._fake_sg_members()))
+
+    def test_apply_security_group_members_port_changed(self):
+        port = self._prepare_port_for_member_update()
+        port = dict(port, fixed_ips=['10.0.0.9'])
+        self.assertFalse(self.firewall.apply_security_group_members(
+            {port['device']: port}, self._fake_sg_rules(),
+            self._fake_sg_members()))
+
+    def test_apply_security_group_members_without_set(self):
+        port = self._prepare_port_for_member_update()
+        self.firewall.ipset.set_name_exists.return_value = False
+        self.assertFalse(self.firewall.apply_security_group_members(
+            {port['device']: port}, self._fake_sg_rules(),
+            self._fake_sg_members()))
+
+    def test_apply_security_group_members_without_ipset(self):
+        port = self._prepare_port_for_member_update()
+        self.firewall.enable_ipset = False
+        self.assertFalse(self.firewall.apply_security_group_members(
+            {port['device']: port}, self._fake_sg_rules(),
+            self._fake_sg_members()))
+
+    def test_removed_port_chains_are_forgotten(self):
+        port = self._prepare_cached_port()
+        self.firewall.remove_port_filter(port)
+        self.assertEqual({}, self.firewall._port_chains)
+        self.assertEqual({}, self.firewall._sg_devices)
+
+
+class IptablesFirewallSharedChainTestCase(BaseIptablesFirewallTestCase):
+    def setUp(self):
+        super(IptablesFirewallSharedChainTestCase, self).setUp()
+        self.firewall.ipset = mock.Mock()
+        self.firewall.ipset.get_name.side_effect = (
+            ipset_manager.IpsetManager.get_name)
+        self.firewall.ipset.set_name_exists.return_value = True
+        self.firewall.shared_sg_chains = True
+        self.firewall.sg_rules = {FAKE_SGID: [
+            {'direction': 'ingress', 'ethertype': _IPv4,
+             'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22},
+            {'direction': 'ingress', 'ethertype': _IPv4,
+             'remote_group_id': FAKE_SGID}]}
+        self.firewall.sg_members = {FAKE_SGID: copy.copy(FAKE_IP)}
+        self.ingress_chain = self.firewall._sg_chain_name(FAKE_SGID,
+                                                          'ingress')
+        self.egress_chain = self.firewall._sg_chain_name(FAKE_SGID, 'egress')
+
+    def _fake_port(self, device):
+        return {'device': device,
+                'mac_address': 'ff:ff:ff:ff:ff:ff',
+                'network_id': 'fake_net',
+                'fixed_ips': [FAKE_IP['IPv4']],
+                'security_groups': [FAKE_SGID]}
+
+    def test_sg_chain_is_shared_between_ports(self):
+        self.firewall.prepare_port_filter(self._fake_port('tapfake_dev1'))
+        self.firewall.prepare_port_filter(self._fake_port('tapfake_dev2'))
+        add_chain_calls = [call for call in self.v4filter_inst.mock_calls
+                           if call == mock.call.add_chain(self.ingress_chain)]
+        self.assertEqual(1, len(add_chain_calls))
+        self.assertEqual({self.ingress_chain: FAKE_SGID,
+                          self.egress_chain: FAKE_SGID},
+                         dict((chain_name, sg_chain[0]) for chain_name,
+                              sg_chain in self.firewall._sg_chains.items()))
+        mark = iptables_firewall.SG_MATCH_MARK
+        calls = [
+            mock.call.add_rule(
+                'sg-match', '-j MARK --set-xmark %s/%s' % (mark, mark),
+                comment=None),
+            mock.call.add_rule(
+                self.ingress_chain, '-p tcp -m tcp --dport 22 -g $sg-match',
+                comment=None),
+            mock.call.add_rule(
+                self.ingress_chain,
+                '-m set --match-set NIPv4fake_sgid src -g $sg-match',
+                comment=None)]
+        for device in ('ifake_dev1', 'ifake_dev2'):
+            calls += [
+                mock.call.add_rule(
+                    device, '-m state --state RELATED,ESTABLISHED -j RETURN',
+                    comment=None),
+                mock.call.add_rule(
+                    device, '-j MARK --set-xmark 0x0/%s' % mark,
+                    comment=None),
+                mock.call.add_rule(device, '-j $%s' % self.ingress_chain,
+                                   comment=None),
+                mock.call.add_rule(
+                    device, '-m mark --mark %s/%s -j RETURN' % (mark, mark),
+                    comment=None),
+                mock.call.add_rule(
+                    device, '-m state --state INVALID -j DROP',
+                    comment=None),
+                mock.call.add_rule(device, '-j $sg-fallback', comment=None)]
+        self.v4filter_inst.assert_has_calls(calls, any_order=True)
+
+    def test_port_chain_returns_after_each_sg_chain(self):
+        other_sgid = 'other_sgid'
+        self.firewall.sg_rules[other_sgid] = [
+            {'direction': 'ingress', 'ethertype': _IPv4,
+             'protocol': 'udp', 'port_range_min': 53, 'port_range_max': 53}]
+        port = self._fake_port('tapfake_dev1')
+        port['security_groups'] = [FAKE_SGID, other_sgid]
+        ipv4_rules, _ipv6_rules = (
+            self.firewall._get_shared_sg_iptables_rules(port, 'ingress'))
+        mark = iptables_firewall.SG_MATCH_MARK
+        return_rule = '-m mark --mark %s/%s -j RETURN' % (mark, mark)
+        self.assertEqual(
+            ['-j MARK --set-xmark 0x0/%s' % mark,
+             '-j $%s' % self.ingress_chain, return_rule,
+             '-j $%s' % self.firewall._sg_chain_name(other_sgid, 'ingress'),
+             return_rule],
+            ipv4_rules[1:6])
+
+    def test_shared_sg_chains_require_ipset(self):
+        cfg.CONF.set_override('shared_sg_chains', True, 'SECURITYGROUP')
+        cfg.CONF.set_override('enable_ipset', False, 'SECURITYGROUP')
+        firewall = iptables_firewall.IptablesFirewallDriver()
+        self.assertFalse(firewall.shared_sg_chains)
+
+    def test_port_without_sg_does_not_jump(self):
+        port = self._fake_port('tapfake_dev1')
+        port['security_groups'] = []
+        ipv4_rules, _ipv6_rules = (
+            self.firewall._get_shared_sg_iptables_rules(port, 'ingress'))
+        self.assertNotIn('-j $%s' % self.ingress_chain, ipv4_rules)
+        self.assertEqual({}, self.firewall._sg_chains)
+
+    def test_remove_port_filter_removes_sg_chains(self):
+        port = self._fake_port('tapfake_dev1')
+        self.firewall.prepare_port_filter(port)
+        self.firewall.remove_port_filter(port)
+        self.v4filter_inst.remove_chain.assert_has_calls(
+            [mock.call(self.ingress_chain), mock.call(self.egress_chain)],
+            any_order=True)
+        self.assertEqual({}, self.firewall._sg_chains)
+
+    def test_sg_rule_change_rebuilds_sg_chain_in_place(self):
+        port = self._fake_port('tapfake_dev1')
+        self.firewall.prepare_port_filter(port)
+        self.v4filter_inst.reset_mock()
+        self.firewall.update_security_group_rules(FAKE_SGID, [
+            {'direction': 'ingress', 'ethertype': _IPv4,
+             'protocol': 'udp', 'port_range_min': 53, 'port_range_max': 53}])
+        self.firewall.update_port_filter(port)
+        self.v4filter_inst.empty_chain.assert_called_once_with(
+            self.ingress_chain)
+        self.v4filter_inst.add_rule.assert_called_once_with(
+            self.ingress_chain, '-p udp -m udp --dport 53 -g $sg-match',
+            comment=None)
+        # the port chains keep jumping to the shared chain
+        self.assertFalse(self.v4filter_inst.remove_chain.called)
+
+    def test_sg_chain_names_of_ids_sharing_a_prefix(self):
+        self.assertNotEqual(
+            self.firewall._sg_chain_name(
+                'b5e5e1c5-1b5f-4c5d-8e5f-0a1b2c3d4e5f', 'ingress'),
+            self.firewall._sg_chain_name(
+                'b5e5e1c5-1b5f-4c5d-8e5f-0a1b2c3d4e60', 'ingress'))
+
+    def test_sg_chain_name_collision(self):
+        other_sgid = 'other_sgid'
+        self.firewall.sg_rules[other_sgid] = [
+            {'direction': 'ingress', 'ethertype': _IPv4,
+             'protocol': 'udp', 'port_range_min': 53, 'port_range_max': 53}]
+        port = self._fake_port('tapfake_dev1')
+        port['security_groups'] = [FAKE_SGID, other_sgid]
+        with mock.patch.object(self.firewall, '_sg_chain_name',
+                               return_value=self.ingress_chain):
+            ipv4_rules, _ipv6_rules = (
+                self.firewall._get_shared_sg_iptables_rules(port, 'ingress'))
+        # the rules of the second group are held by the port chain
+        self.assertEqual(1, ipv4_rules.count('-j $%s' % self.ingress_chain))
+        self.assertIn('-p udp -m udp --dport 53 -j RETURN', ipv4_rules)
+        self.assertEqual({self.ingress_chain: (FAKE_SGID, 'ingress',
+                                               mock.ANY)},
+                         self.firewall._sg_chains)
+
 
 class OVSHybridIptablesFirewallTestCase(BaseIptablesFirewallTestCase):
 
@@ -146,6 +146,58 @@ class IptablesTestCase(base.BaseTestCase):
             self.assertEqual('python_-m_unitte', binary_name)
 
 
+class IptablesTableTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesTableTestCase, self).setUp()
+        self.table = iptables_manager.IptablesTable(binary_name='bn')
+        self.table.add_chain('a')
+        self.table.add_chain('b')
+
+    def _rule_strs(self):
+        return [str(r) for r in self.table.rules]
+
+    def test_rules_keep_insertion_order(self):
+        self.table.add_rule('b', '-j DROP')
+        self.table.add_rule('a', '-j ACCEPT', tag='t')
+        self.table.add_rule('b', '-j RETURN', tag='t')
+        self.table.add_rule('a', '-j DROP')
+        self.assertEqual(['-A bn-b -j DROP', '-A bn-a -j ACCEPT',
+                          '-A bn-b -j RETURN', '-A bn-a -j DROP'],
+                         self._rule_strs())
+
+    def test_clear_rules_by_tag(self):
+        self.table.add_rule('a', '-j ACCEPT', tag='t')
+        self.table.add_rule('a', '-j DROP')
+        self.table.add_rule('b', '-j RETURN', tag='t')
+        self.table.clear_rules_by_tag('t')
+        self.assertEqual(['-A bn-a -j DROP'], self._rule_strs())
+        self.table.clear_rules_by_tag('t')
+        self.assertEqual(['-A bn-a -j DROP'], self._rule_strs())
+
+    def test_remove_rule_removes_one_duplicate(self):
+        self.table.add_rule('a', '-j DROP')
+        self.table.add_rule('a', '-j ACCEPT')
+        self.table.add_rule('a', '-j DROP')
+        self.table.remove_rule('a', '-j DROP')
+        self.assertEqual(['-A bn-a -j ACCEPT', '-A bn-a -j DROP'],
+                         self._rule_strs())
+
+    def test_empty_chain(self):
+        self.table.add_rule('a', '-j DROP')
+        self.table.add_rule('b', '-j DROP')
+        self.table.empty_chain('a')
+        self.assertEqual(['-A bn-b -j DROP'], self._rule_strs())
+        self.assertEqual([], self.table._get_chain_rules('a', True))
+
+    def test_remove_chain_removes_jumps(self):
+        self.table.add_rule('a', '-j $b')
+        self.table.add_rule('a', '-j DROP')
+        self.table.add_rule('b', '-j ACCEPT')
+        self.table.remove_chain('b')
+        self.assertEqual(['-A bn-a -j DROP'], self._rule_strs())
+
+
 class IptablesCommentsTestCase(base.BaseTestCase):
 
     def setUp(self):
@@ -1132,3 +1184,135 @@ class IptablesManagerStateLessTestCase(base.BaseTestCase):
 
     def test_mangle_not_found(self):
         self.assertNotIn('mangle', self.iptables.ipv4)
+
+
+STATELESS_SAVE_DUMP = ('# Generated by iptables-save\n'
+                       '*raw\n'
+                       ':PREROUTING ACCEPT [0:0]\n'
+                       ':OUTPUT ACCEPT [0:0]\n'
+                       'COMMIT\n'
+                       '*filter\n'
+                       ':INPUT ACCEPT [0:0]\n'
+                       ':FORWARD ACCEPT [0:0]\n'
+                       ':OUTPUT ACCEPT [0:0]\n'
+                       'COMMIT\n'
+                       '# Completed\n')
+
+
+class IptablesManagerIncrementalApplyTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesManagerIncrementalApplyTestCase, self).setUp()
+        cfg.CONF.set_override('comment_iptables_rules', False, 'AGENT')
+        cfg.CONF.set_override('iptables_incremental_apply', True, 'AGENT')
+        self.iptables = iptables_manager.IptablesManager(state_less=True)
+        self.execute = mock.patch.object(self.iptables, "execute").start()
+        self.execute.return_value = STATELESS_SAVE_DUMP
+
+    def _save_calls(self):
+        return [c for c in self.execute.call_args_list
+                if c[0][0] == ['iptables-save']]
+
+    def test_apply_saves_only_once(self):
+        self.iptables.apply()
+        self.assertEqual(1, len(self._save_calls()))
+        self.execute.reset_mock()
+
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-s 1.2.3.4 -j DROP')
+        self.iptables.apply()
+
+        expected = ('# Generated by iptables_manager\n'
+                    '*filter\n'
+                    '-I %(bn)s-INPUT 1 -s 1.2.3.4 -j DROP\n'
+                    'COMMIT\n'
+                    '# Completed by iptables_manager\n' % IPTABLES_ARG)
+        self.execute.assert_called_once_with(['iptables-restore', '-n'],
+                                             process_input=expected,
+                                             run_as_root=True)
+
+    def test_apply_without_changes_does_not_execute(self):
+        self.iptables.apply()
+        self.execute.reset_mock()
+        self.iptables.apply()
+        self.assertFalse(self.execute.called)
+
+    def test_removed_rule_only_deletes_it(self):
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-s 1.2.3.4 -j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-s 1.2.3.5 -j DROP')
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+        self.iptables.ipv4['filter'].remove_rule('INPUT',
+                                                 '-s 1.2.3.4 -j DROP')
+        self.iptables.apply()
+
+        expected = ('# Generated by iptables_manager\n'
+                    '*filter\n'
+                    '-D %(bn)s-INPUT 1\n'
+                    'COMMIT\n'
+                    '# Completed by iptables_manager\n' % IPTABLES_ARG)
+        self.execute.assert_called_once_with(['iptables-restore', '-n'],
+                                             process_input=expected,
+                                             run_as_root=True)
+
+    def test_restore_failure_forces_save(self):
+        self.iptables.apply()
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-s 1.2.3.4 -j DROP')
+
+        def iptables_restore_failer(*args, **kwargs):
+            if 'iptables-restore' in args[0]:
+                raise RuntimeError()
+            return STATELESS_SAVE_DUMP
+        self.execute.side_effect = iptables_restore_failer
+        self.assertRaises(RuntimeError, self.iptables.apply)
+
+        self.execute.reset_mock()
+        self.execute.side_effect = None
+        self.iptables.apply()
+        self.assertEqual(1, len(self._save_calls()))
+
+    def test_invalidate_saved_state(self):
+        self.iptables.apply()
+        self.iptables.invalidate_saved_state()
+        self.execute.reset_mock()
+        self.iptables.apply()
+        self.assertEqual(1, len(self._save_calls()))
+
+    def test_missing_table_is_not_cached(self):
+        self.execute.return_value = ''
+        self.iptables.apply()
+        self.execute.reset_mock()
+        self.iptables.apply()
+        self.assertEqual(1, len(self._save_calls()))
+
+    def test_wrapped_chains_changes_use_saved_state(self):
+        self.iptables.apply()
+        self.execute.reset_mock()
+        self.iptables.ipv4['filter'].add_chain('test')
+        self.iptables.ipv4['filter'].add_rule('test', '-s 1.2.3.4 -j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j $test')
+        self.iptables.apply()
+        self.assertEqual([], self._save_calls())
+
+    def test_builtin_chains_changes_save_again(self):
+        self.iptables.apply()
+        # another program added a rule to a built-in chain
+        self.execute.return_value = STATELESS_SAVE_DUMP.replace(
+            ':OUTPUT ACCEPT [0:0]\nCOMMIT\n# Completed',
+            ':OUTPUT ACCEPT [0:0]\n'
+            '-A FORWARD -s 5.6.7.8 -j DROP\n'
+            'COMMIT\n# Completed')
+        self.execute.reset_mock()
+
+        self.iptables.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4 -j DROP',
+                                              wrap=False)
+        self.iptables.apply()
+
+        self.assertEqual(1, len(self._save_calls()))
+        # the fresh iptables-save output lacks the jumps of the first apply,
+        # so they are added again
+        restore_input = self.execute.call_args[1]['process_input']
+        self.assertIn('-I FORWARD 1 -j neutron-filter-top\n'
+                      '-I FORWARD 2 -j %(bn)s-FORWARD\n'
+                      '-I FORWARD 3 -s 1.2.3.4 -j DROP\n' % IPTABLES_ARG,
+                      restore_input)
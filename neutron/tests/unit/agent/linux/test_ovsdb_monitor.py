@@ -70,3 +70,72 @@ class TestSimpleInterfaceMonitor(base.BaseTestCase):
             self.monitor.process_events()
             self.assertEqual(self.monitor.new_events['added'][0]['ofport'],
                              ovs_lib.UNASSIGNED_OFPORT)
+
+
+class TestIdlInterfaceMonitor(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIdlInterfaceMonitor, self).setUp()
+        self.ovsdb = mock.Mock()
+        mock.patch.object(ovsdb_monitor.ovsdb.API, 'get',
+                          return_value=self.ovsdb).start()
+        self.monitor = ovsdb_monitor.IdlInterfaceMonitor()
+        self.connection = self.ovsdb.ovsdb_connection
+
+    def _get_row(self, name, ofport=None, external_ids=None, table=None):
+        row = mock.Mock(ofport=[ofport] if ofport else [],
+                        external_ids=external_ids or {})
+        row.name = name
+        row._table.name = table or 'Interface'
+        return row
+
+    def test_start_reports_existing_interfaces(self):
+        device = {'name': 'tap0', 'ofport': 1, 'external_ids': {}}
+        self.ovsdb.db_list.return_value.execute.return_value = [device]
+        self.monitor.start()
+        self.connection.add_row_event_handler.assert_called_once_with(
+            self.monitor._handle_row_event)
+        self.assertTrue(self.monitor.is_active())
+        self.assertTrue(self.monitor.has_updates)
+        self.assertEqual({'added': [device], 'removed': []},
+                         self.monitor.get_events())
+        self.assertFalse(self.monitor.has_updates)
+        self.monitor.stop()
+        self.connection.remove_row_event_handler.assert_called_once_with(
+            self.monitor._handle_row_event)
+
+    def test_row_events(self):
+        self.monitor._handle_row_event(
+            'create', self._get_row('tap0', external_ids={'a': 'b'}))
+        self.monitor._handle_row_event('create', self._get_row('br-int',
+                                                               table='Port'))
+        self.monitor._handle_row_event('delete', self._get_row('tap1', 2))
+        self.assertEqual(
+            {'added': [{'name': 'tap0', 'ofport': ovs_lib.UNASSIGNED_OFPORT,
+                        'external_ids': {'a': 'b'}}],
+             'removed': [{'name': 'tap1', 'ofport': 2,
+                          'external_ids': {}}]},
+            self.monitor.get_events())
+
+    def test_row_update_events(self):
+        self.monitor._handle_row_event(
+            'update', self._get_row('tap0', 3),
+            mock.Mock(spec=['statistics']))
+        self.assertFalse(self.monitor.has_updates)
+        self.monitor._handle_row_event(
+            'update', self._get_row('tap0', 3), mock.Mock(spec=['ofport']))
+        self.assertEqual(
+            {'added': [{'name': 'tap0', 'ofport': 3, 'external_ids': {}}],
+             'removed': []},
+            self.monitor.get_events())
+
+    def test_get_interface_monitor(self):
+        self.assertIsInstance(ovsdb_monitor.get_interface_monitor(),
+                              ovsdb_monitor.SimpleInterfaceMonitor)
+        self.config(ovsdb_interface='native', group='OVS')
+        self.connection.supports_row_events = True
+        self.assertIsInstance(ovsdb_monitor.get_interface_monitor(),
+                              ovsdb_monitor.IdlInterfaceMonitor)
+        self.connection.supports_row_events = False
+        self.assertIsInstance(ovsdb_monitor.get_interface_monitor(),
+                              ovsdb_monitor.SimpleInterfaceMonitor)
@@ -0,0 +1,71 @@
+# Copyright 2016 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.agent.ovsdb.native import connection
+from neutron.agent.ovsdb.native import idlutils
+from neutron.tests import base
+
+
+class TestOVSNativeConnection(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOVSNativeConnection, self).setUp()
+        mock.patch.object(connection, 'TransactionQueue').start()
+        self.connection = connection.Connection(
+            'tcp:127.0.0.1:6640', 10, 'Open_vSwitch', max_batch_size=3)
+
+    def _get_txn(self, coalescable=True):
+        return mock.Mock(coalescable=coalescable)
+
+    def test_get_queued_txns(self):
+        txns = [self._get_txn() for i in range(4)]
+        self.connection.txns.get_nowait.side_effect = txns
+        self.assertEqual(txns[:3], self.connection._get_queued_txns())
+        self.connection.txns.get_nowait.side_effect = [txns[3], None]
+        self.assertEqual(txns[3:], self.connection._get_queued_txns())
+
+    def test_commit_coalesced_txns(self):
+        txns = [self._get_txn() for i in range(3)]
+        txns[0].do_commit_coalesced.return_value = [['a'], ['b'], ['c']]
+        self.connection._commit_txns(txns)
+        txns[0].do_commit_coalesced.assert_called_once_with(txns[1:])
+        for txn, result in zip(txns, ['a', 'b', 'c']):
+            txn.results.put.assert_called_once_with([result])
+            self.assertFalse(txn.do_commit.called)
+        self.assertEqual(3, self.connection.txns.task_done.call_count)
+
+    def test_commit_coalesced_txns_one_by_one_on_failure(self):
+        txns = [self._get_txn() for i in range(2)]
+        txns[0].do_commit_coalesced.return_value = None
+        txns[1].do_commit.side_effect = RuntimeError
+        self.connection._commit_txns(txns)
+        txns[0].results.put.assert_called_once_with(
+            txns[0].do_commit.return_value)
+        result = txns[1].results.put.call_args[0][0]
+        self.assertIsInstance(result, idlutils.ExceptionResult)
+        self.assertEqual(2, self.connection.txns.task_done.call_count)
+
+    def test_run_keeps_the_txns_order(self):
+        txns = [self._get_txn(), self._get_txn(False), self._get_txn()]
+        self.connection.idl = mock.Mock()
+        self.connection.poller = mock.Mock()
+        with mock.patch.object(self.connection, '_get_queued_txns',
+                               side_effect=[txns, StopIteration]), \
+                mock.patch.object(self.connection,
+                                  '_commit_txns') as commit_txns:
+            self.assertRaises(StopIteration, self.connection.run)
+        self.assertEqual([mock.call(txns[:1]), mock.call(txns[1:2]),
+                          mock.call(txns[2:])], commit_txns.mock_calls)
@@ -15,6 +15,7 @@
 
 import collections
 import contextlib
+import time
 
 import mock
 from oslo_config import cfg
@@ -30,6 +31,7 @@ from neutron.common import constants as const
 from neutron.common import ipv6_utils as ipv6
 from neutron.common import rpc as n_rpc
 from neutron import context
+from neutron.db import securitygroups_db as sg_db
 from neutron.db import securitygroups_rpc_base as sg_db_rpc
 from neutron.extensions import allowedaddresspairs as addr_pair
 from neutron.extensions import securitygroup as ext_sg
@@ -543,6 +545,114 @@ class SGServerRpcCallBackTestCase(test_sg.SecurityGroupDBTestCase):
             self._delete('ports', port_id1)
             self._delete('ports', port_id2)
 
+    def test_security_group_info_for_devices_cached(self):
+        cfg.CONF.set_override('security_group_info_cache_time', 600)
+        with self.network() as n,\
+                self.subnet(n),\
+                self.security_group() as sg1,\
+                self.security_group() as sg2:
+            sg1_id = sg1['security_group']['id']
+            sg2_id = sg2['security_group']['id']
+            rule1 = self._build_security_group_rule(
+                sg1_id,
+                'ingress', const.PROTO_NAME_TCP, '24',
+                '25', remote_group_id=sg2_id)
+            rules = {
+                'security_group_rules': [rule1['security_group_rule']]}
+            res = self._create_security_group_rule(self.fmt, rules)
+            self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+
+            res1 = self._create_port(
+                self.fmt, n['network']['id'],
+                security_groups=[sg1_id])
+            ports_rest1 = self.deserialize(self.fmt, res1)
+            port_id1 = ports_rest1['port']['id']
+            res2 = self._create_port(
+                self.fmt, n['network']['id'],
+                security_groups=[sg2_id])
+            ports_rest2 = self.deserialize(self.fmt, res2)
+            port_id2 = ports_rest2['port']['id']
+            ctx = context.get_admin_context()
+
+            self.rpc.devices = {port_id1: ports_rest1['port']}
+            ports_rpc = self.rpc.security_group_info_for_devices(
+                ctx, devices=[port_id1])
+            self.assertEqual(set([u'10.0.0.3']),
+                             ports_rpc['sg_member_ips'][sg2_id]['IPv4'])
+            self.assertEqual([sg2_id], ports_rpc['devices'][port_id1][
+                'security_group_source_groups'])
+
+            # the rules of unchanged groups are not selected again
+            plugin = manager.NeutronManager.get_plugin()
+            with mock.patch.object(
+                    plugin, '_select_rules_for_security_groups') as select:
+                self.rpc.devices = {port_id1: ports_rest1['port']}
+                self.rpc.security_group_info_for_devices(
+                    ctx, devices=[port_id1])
+                self.assertFalse(select.called)
+
+            # changes are seen right away, including those made by other
+            # server processes
+            rule2 = self._build_security_group_rule(
+                sg1_id, 'ingress', const.PROTO_NAME_UDP, '53', '53')
+            res = self._create_security_group_rule(
+                self.fmt, {'security_group_rules': [
+                    rule2['security_group_rule']]})
+            self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+            rule1_id = [rule['id'] for rule in plugin.get_security_group_rules(
+                ctx, filters={'security_group_id': [sg1_id],
+                              'protocol': [const.PROTO_NAME_TCP]})][0]
+            sg_db.SecurityGroupDbMixin.delete_security_group_rule(
+                plugin, ctx, rule1_id)
+
+            self.rpc.devices = {port_id1: ports_rest1['port']}
+            ports_rpc = self.rpc.security_group_info_for_devices(
+                ctx, devices=[port_id1])
+            self.assertEqual({}, ports_rpc['sg_member_ips'])
+            self.assertEqual([{'direction': 'ingress',
+                               'protocol': const.PROTO_NAME_UDP,
+                               'ethertype': const.IPv4,
+                               'port_range_max': 53, 'port_range_min': 53}],
+                             [rule for rule in
+                              ports_rpc['security_groups'][sg1_id]
+                              if rule['direction'] == 'ingress'])
+            self._delete('ports', port_id1)
+            self._delete('ports', port_id2)
+
+    def test_notify_security_group_deltas(self):
+        cfg.CONF.set_override('security_group_rpc_deltas', True)
+        with self.network() as n,\
+                self.subnet(n),\
+                self.security_group() as sg1:
+            sg1_id = sg1['security_group']['id']
+            rule1 = self._build_security_group_rule(
+                sg1_id, 'ingress', const.PROTO_NAME_TCP, '22', '22',
+                remote_group_id=sg1_id)
+            res = self._create_security_group_rule(
+                self.fmt, {'security_group_rules': [
+                    rule1['security_group_rule']]})
+            self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+            self.notifier.security_groups_rule_updated.assert_called_with(
+                mock.ANY, [sg1_id], rule_deltas={sg1_id: {
+                    'added': [{'direction': 'ingress',
+                               'protocol': const.PROTO_NAME_TCP,
+                               'ethertype': const.IPv4,
+                               'port_range_max': 22, 'port_range_min': 22,
+                               'remote_group_id': sg1_id}],
+                    'removed': []}})
+
+            res1 = self._create_port(
+                self.fmt, n['network']['id'],
+                security_groups=[sg1_id])
+            port_id1 = self.deserialize(self.fmt, res1)['port']['id']
+            self.notifier.security_groups_member_updated.assert_called_with(
+                mock.ANY, [sg1_id], member_deltas={sg1_id: {
+                    'added': [u'10.0.0.2'], 'removed': []}})
+            self._delete('ports', port_id1)
+            self.notifier.security_groups_member_updated.assert_called_with(
+                mock.ANY, [sg1_id], member_deltas={sg1_id: {
+                    'added': [], 'removed': [u'10.0.0.2']}})
+
     def test_security_group_rules_for_devices_ipv6_ingress(self):
         fake_prefix = FAKE_PREFIX[const.IPv6]
         fake_gateway = FAKE_IP[const.IPv6]
@@ -1108,6 +1218,34 @@ class SGServerRpcCallBackTestCase(test_sg.SecurityGroupDBTestCase):
             self._delete('ports', port_id2)
 
 
+class SecurityGroupRulesCacheTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SecurityGroupRulesCacheTestCase, self).setUp()
+        self.cache = sg_db_rpc.SecurityGroupRulesCache(60)
+        self.cache.set_rules('sg1', ['rule1'], [{'direction': 'ingress'}])
+        self.cache.set_rules('sg2', [], [])
+
+    def test_get_rules(self):
+        self.assertEqual({'sg1': [{'direction': 'ingress'}], 'sg2': []},
+                         self.cache.get_rules({'sg1': set(['rule1']),
+                                               'sg2': set(),
+                                               'sg3': set()}))
+
+    def test_get_rules_changed(self):
+        self.assertEqual({}, self.cache.get_rules(
+            {'sg1': set(['rule1', 'rule2']), 'sg2': set(['rule3'])}))
+        self.assertEqual({}, self.cache.get_rules({'sg1': set()}))
+
+    def test_unused_entries_expire(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now + 30):
+            self.cache.get_rules({'sg1': set(['rule1'])})
+        with mock.patch('time.time', return_value=now + 61):
+            self.assertEqual({'sg1': [{'direction': 'ingress'}]},
+                             self.cache.get_rules({'sg1': set(['rule1'])}))
+            self.assertEqual({}, self.cache.get_rules({'sg2': set()}))
+
+
 class SecurityGroupAgentRpcTestCaseForNoneDriver(base.BaseTestCase):
     def test_init_firewall_with_none_driver(self):
         set_enable_security_groups(False)
@@ -1129,6 +1267,7 @@ class BaseSecurityGroupAgentRpcTestCase(base.BaseTestCase):
         self.firewall = mock.Mock()
         firewall_object = FakeFirewallDriver()
         self.firewall.defer_apply.side_effect = firewall_object.defer_apply
+        self.firewall.apply_security_group_members.return_value = False
         self.agent.firewall = self.firewall
         self.fake_device = {'device': 'fake_device',
                             'network_id': 'fake_net',
@@ -1225,6 +1364,7 @@ class SecurityGroupAgentRpcTestCase(BaseSecurityGroupAgentRpcTestCase):
         self.agent.refresh_firewall()
         calls = [mock.call.defer_apply(),
                  mock.call.prepare_port_filter(self.fake_device),
+                 mock.call.invalidate_saved_state(),
                  mock.call.defer_apply(),
                  mock.call.update_port_filter(self.fake_device)]
         self.firewall.assert_has_calls(calls)
@@ -1237,6 +1377,11 @@ class SecurityGroupAgentRpcTestCase(BaseSecurityGroupAgentRpcTestCase):
                  mock.call.defer_apply(),
                  mock.call.update_port_filter(self.fake_device)]
         self.firewall.assert_has_calls(calls)
+        self.assertFalse(self.firewall.invalidate_saved_state.called)
+
+    def test_invalidate_firewall_state(self):
+        self.agent.invalidate_firewall_state()
+        self.firewall.invalidate_saved_state.assert_called_once_with()
 
     def test_refresh_firewall_none(self):
         self.agent.refresh_firewall([])
@@ -1354,6 +1499,9 @@ class SecurityGroupAgentEnhancedRpcTestCase(
                  mock.call.update_security_group_members(
                      'fake_sgid2', {'IPv4': [], 'IPv6': []}),
                  mock.call.prepare_port_filter(self.fake_device),
+                 mock.call.invalidate_saved_state(),
+                 mock.call.apply_security_group_members(
+                     mock.ANY, mock.ANY, mock.ANY),
                  mock.call.defer_apply(),
                  mock.call.update_security_group_rules('fake_sgid2', []),
                  mock.call.update_security_group_rules(
@@ -1375,6 +1523,8 @@ class SecurityGroupAgentEnhancedRpcTestCase(
                      'IPv4': [], 'IPv6': []
                  }),
                  mock.call.prepare_port_filter(self.fake_device),
+                 mock.call.apply_security_group_members(
+                     mock.ANY, mock.ANY, mock.ANY),
                  mock.call.defer_apply(),
                  mock.call.update_security_group_rules('fake_sgid2', []),
                  mock.call.update_security_group_rules('fake_sgid1', [
@@ -1385,10 +1535,173 @@ class SecurityGroupAgentEnhancedRpcTestCase(
                  ]
         self.firewall.assert_has_calls(calls)
 
+    def test_refresh_firewall_members_applied_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.firewall.reset_mock()
+        self.firewall.apply_security_group_members.return_value = True
+        self.agent.refresh_firewall(['fake_device'])
+        self.firewall.apply_security_group_members.assert_called_once_with(
+            self.firewall.ports,
+            {'fake_sgid2': [],
+             'fake_sgid1': [{'remote_group_id': 'fake_sgid2'}]},
+            {'fake_sgid2': {'IPv4': [], 'IPv6': []}})
+        self.assertFalse(self.firewall.defer_apply.called)
+        self.assertFalse(self.firewall.update_port_filter.called)
+
     def test_refresh_firewall_none_enhanced_rpc(self):
         self.agent.refresh_firewall([])
         self.assertFalse(self.firewall.called)
 
+    def _notify_rule_deltas(self, number, rule_deltas,
+                            sender='fake_sender'):
+        self.agent.security_groups_rule_updated(
+            list(rule_deltas), rule_deltas=rule_deltas,
+            sequence={'sender': sender, 'number': number})
+
+    def test_security_groups_rule_deltas_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.agent.plugin_rpc.reset_mock()
+        self.firewall.reset_mock()
+        # the first notification of a sender can't be checked for gaps
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        plugin_rpc = self.agent.plugin_rpc
+        self.assertEqual(
+            1, plugin_rpc.security_group_info_for_devices.call_count)
+        self.agent.plugin_rpc.reset_mock()
+        new_rule = {'direction': 'ingress', 'ethertype': 'IPv4',
+                    'remote_group_id': 'fake_sgid2'}
+        self._notify_rule_deltas(
+            2, {'fake_sgid1': {'added': [new_rule],
+                               'removed': [{'remote_group_id':
+                                            'fake_sgid2'}]}})
+        self.assertFalse(
+            self.agent.plugin_rpc.security_group_info_for_devices.called)
+        self.firewall.update_security_group_rules.assert_any_call(
+            'fake_sgid1', [new_rule])
+        self.firewall.update_port_filter.assert_called_with(self.fake_device)
+
+    def test_security_groups_rule_deltas_ipv6_icmp_enhanced_rpc(self):
+        def update_security_group_rules(sg_id, sg_rules):
+            # like the iptables firewall, rewrite the rules in place
+            for rule in sg_rules:
+                if rule.get('protocol') == 'icmp':
+                    rule['protocol'] = 'ipv6-icmp'
+
+        self.firewall.update_security_group_rules.side_effect = (
+            update_security_group_rules)
+        icmp_rule = {'direction': 'ingress', 'ethertype': 'IPv6',
+                     'protocol': 'icmp'}
+        self.agent.plugin_rpc.security_group_info_for_devices.return_value[
+            'security_groups']['fake_sgid1'] = [dict(icmp_rule)]
+        self.agent.prepare_devices_filter(['fake_device'])
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        self._notify_rule_deltas(2, {'fake_sgid1': {}})
+        self.firewall.reset_mock()
+        self._notify_rule_deltas(
+            3, {'fake_sgid1': {'removed': [dict(icmp_rule)]}})
+        self.firewall.update_security_group_rules.assert_any_call(
+            'fake_sgid1', [])
+
+    def test_security_groups_rule_deltas_senders_interleaved_enhanced_rpc(
+            self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        self._notify_rule_deltas(1, {'fake_sgid1': {}},
+                                 sender='fake_sender2')
+        self.agent.plugin_rpc.reset_mock()
+        # the sequence of each sender is checked on its own
+        self._notify_rule_deltas(2, {'fake_sgid1': {}})
+        self._notify_rule_deltas(2, {'fake_sgid1': {}},
+                                 sender='fake_sender2')
+        self._notify_rule_deltas(3, {'fake_sgid1': {}})
+        self.assertFalse(
+            self.agent.plugin_rpc.security_group_info_for_devices.called)
+
+    def test_security_groups_rule_deltas_during_pull_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        self.agent.refresh_firewall = mock.Mock()
+        self.agent._security_group_pulls = 1
+        self._notify_rule_deltas(2, {'fake_sgid1': {}})
+        self.agent.refresh_firewall.assert_called_once_with(['fake_device'])
+
+    def test_security_groups_rule_deltas_unknown_remote_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        self.agent.plugin_rpc.reset_mock()
+        new_rule = {'direction': 'ingress', 'ethertype': 'IPv4',
+                    'remote_group_id': 'fake_sgid3'}
+        self._notify_rule_deltas(2, {'fake_sgid1': {'added': [new_rule]}})
+        self.agent.plugin_rpc.security_group_info_for_devices.\
+            assert_called_once_with(None, ['fake_device'])
+
+    def test_security_groups_rule_deltas_gap_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        self.agent.refresh_firewall = mock.Mock()
+        self._notify_rule_deltas(3, {'fake_sgid1': {}})
+        # only the devices of the notified groups are refreshed
+        self.agent.refresh_firewall.assert_called_once_with(['fake_device'])
+        self.assertEqual({}, self.agent._security_groups)
+        self.assertEqual({}, self.agent._security_group_member_ips)
+
+    def test_security_groups_rule_deltas_after_gap_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self._notify_rule_deltas(1, {'fake_sgid1': {}})
+        # no device uses the notified group, nothing is refreshed yet
+        self._notify_rule_deltas(3, {'fake_sgid3': {}})
+        self.agent.plugin_rpc.reset_mock()
+        # the information of the other groups is requested again
+        self._notify_rule_deltas(4, {'fake_sgid1': {}})
+        self.agent.plugin_rpc.security_group_info_for_devices.\
+            assert_called_once_with(None, ['fake_device'])
+
+    def test_security_groups_member_deltas_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        sequence = {'sender': 'fake_sender', 'number': 1}
+        self.agent.security_groups_member_updated(['fake_sgid2'],
+                                                  sequence=sequence)
+        self.agent.plugin_rpc.reset_mock()
+        self.firewall.reset_mock()
+        self.firewall.apply_security_group_members.return_value = True
+        sequence = {'sender': 'fake_sender', 'number': 2}
+        self.agent.security_groups_member_updated(
+            ['fake_sgid2'],
+            member_deltas={'fake_sgid2': {'added': ['10.0.0.1', '::1'],
+                                          'removed': ['10.0.0.2']},
+                           'fake_sgid3': {'added': ['10.0.0.3']}},
+            sequence=sequence)
+        self.assertFalse(
+            self.agent.plugin_rpc.security_group_info_for_devices.called)
+        self.firewall.apply_security_group_members.assert_called_once_with(
+            self.firewall.ports,
+            {'fake_sgid1': [{'remote_group_id': 'fake_sgid2'}],
+             'fake_sgid2': []},
+            {'fake_sgid2': {'IPv4': ['10.0.0.1'], 'IPv6': ['::1']}})
+
+    def test_remove_devices_filter_prunes_security_groups_enhanced_rpc(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.assertEqual({'fake_sgid1', 'fake_sgid2'},
+                         set(self.agent._security_groups))
+        self.assertEqual({'fake_sgid2'},
+                         set(self.agent._security_group_member_ips))
+        self.firewall.ports = {}
+        self.agent.remove_devices_filter(['fake_device'])
+        self.assertEqual({}, self.agent._security_groups)
+        self.assertEqual({}, self.agent._security_group_member_ips)
+
+    def test_remove_devices_filter_keeps_used_security_groups_enhanced_rpc(
+            self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.firewall.ports = {'fake_device2': {
+            'device': 'fake_device2', 'security_groups': ['fake_sgid1'],
+            'security_group_source_groups': []}}
+        self.agent.remove_devices_filter(['fake_device'])
+        # the remote group of the rules of the remaining group is kept
+        self.assertEqual({'fake_sgid1'}, set(self.agent._security_groups))
+        self.assertEqual({'fake_sgid2'},
+                         set(self.agent._security_group_member_ips))
+
 
 class SecurityGroupAgentRpcWithDeferredRefreshTestCase(
     SecurityGroupAgentRpcTestCase):
@@ -1664,6 +1977,8 @@ class SecurityGroupAgentRpcApiTestCase(base.BaseTestCase):
         self.mock_cast.assert_has_calls(
             [mock.call(None, 'security_groups_rule_updated',
                        security_groups=['fake_sgid'])])
+        self.mock_prepare.assert_called_once_with(
+            version='1.1', topic=mock.ANY, fanout=True)
 
     def test_security_groups_member_updated(self):
         self.notifier.security_groups_member_updated(
@@ -1682,6 +1997,31 @@ class SecurityGroupAgentRpcApiTestCase(base.BaseTestCase):
             None, security_groups=[])
         self.assertFalse(self.mock_cast.called)
 
+    def test_security_groups_rule_updated_with_deltas(self):
+        rule_deltas = {'fake_sgid': {'added': [], 'removed': []}}
+        for i in range(2):
+            self.notifier.security_groups_rule_updated(
+                None, ['fake_sgid'], rule_deltas=rule_deltas)
+        sequences = [kwargs['sequence']
+                     for args, kwargs in self.mock_cast.call_args_list]
+        self.assertEqual([1, 2], [seq['number'] for seq in sequences])
+        self.assertEqual(sequences[0]['sender'], sequences[1]['sender'])
+        self.mock_cast.assert_called_with(
+            None, 'security_groups_rule_updated',
+            security_groups=['fake_sgid'], rule_deltas=rule_deltas,
+            sequence=sequences[1])
+
+    def test_security_groups_member_updated_with_deltas(self):
+        member_deltas = {'fake_sgid': {'added': ['10.0.0.1'], 'removed': []}}
+        self.notifier.security_groups_member_updated(
+            None, ['fake_sgid'], member_deltas=member_deltas)
+        self.mock_cast.assert_called_once_with(
+            None, 'security_groups_member_updated',
+            security_groups=['fake_sgid'], member_deltas=member_deltas,
+            sequence={'sender': mock.ANY, 'number': 1})
+        self.mock_prepare.assert_called_once_with(
+            version='1.5', topic=mock.ANY, fanout=True)
+
 #Note(nati) bn -> binary_name
 # id -> device_id
 
@@ -3024,8 +3364,8 @@ class TestSecurityGroupAgentEnhancedIpsetWithIptables(
                               IPTABLES_RAW_DEFAULT)
         self._replay_iptables(IPSET_FILTER_2, IPTABLES_FILTER_V6_2,
                               IPTABLES_RAW_DEFAULT)
-        self._replay_iptables(IPSET_FILTER_2, IPTABLES_FILTER_V6_2,
-                              IPTABLES_RAW_DEFAULT)
+        # the second member update only changes the ipset, the next apply
+        # is the removal of tap_port2
         self._replay_iptables(IPSET_FILTER_1, IPTABLES_FILTER_V6_1,
                               IPTABLES_RAW_DEFAULT)
         self._replay_iptables(IPTABLES_FILTER_EMPTY, IPTABLES_FILTER_V6_EMPTY,
@@ -3193,6 +3533,65 @@ class TestSecurityGroupAgentWithOVSIptables(
             self)._regex(value)
 
 
+class TestSecurityGroupAgentResyncWithIptables(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSecurityGroupAgentResyncWithIptables, self).setUp()
+        set_firewall_driver(FIREWALL_IPTABLES_DRIVER)
+        cfg.CONF.set_override('enable_ipset', False, group='SECURITYGROUP')
+        cfg.CONF.set_override('iptables_incremental_apply', True, 'AGENT')
+        mock.patch('neutron.agent.linux.utils.execute').start()
+        rpc = mock.Mock()
+        rpc.security_group_info_for_devices.side_effect = (
+            oslo_messaging.UnsupportedVersion('1.2'))
+        device = {'device': 'tap_port1',
+                  'network_id': 'fakenet',
+                  'fixed_ips': ['10.0.0.3/32'],
+                  'mac_address': '12:34:56:78:9a:bc',
+                  'security_groups': ['security_group1'],
+                  'security_group_rules': [{'direction': 'egress',
+                                            'ethertype': const.IPv4}],
+                  'security_group_source_groups': []}
+        rpc.security_group_rules_for_devices.return_value = {
+            'tap_port1': device}
+        self.agent = sg_rpc.SecurityGroupAgentRpc(context=None,
+                                                  plugin_rpc=rpc)
+        iptables = self.agent.firewall.iptables
+        builtin_chains = {'filter': ['INPUT', 'FORWARD', 'OUTPUT'],
+                          'mangle': ['PREROUTING', 'INPUT', 'FORWARD',
+                                     'OUTPUT', 'POSTROUTING'],
+                          'nat': ['PREROUTING', 'INPUT', 'OUTPUT',
+                                  'POSTROUTING'],
+                          'raw': ['PREROUTING', 'OUTPUT']}
+        dump = ''.join(
+            '*%s\n%sCOMMIT\n' % (table, ''.join(
+                ':%s ACCEPT [0:0]\n' % chain
+                for chain in builtin_chains[table]))
+            for table in sorted(iptables.ipv4))
+        self.execute = mock.patch.object(iptables, 'execute',
+                                         return_value=dump).start()
+        iptables.use_ipv6 = False
+        self.agent.prepare_devices_filter(['tap_port1'])
+        self.execute.reset_mock()
+
+    def _save_calls(self):
+        return [c for c in self.execute.call_args_list
+                if c[0][0] == ['iptables-save']]
+
+    def test_refresh_firewall_devices_uses_saved_state(self):
+        self.agent.refresh_firewall(['tap_port1'])
+        self.assertEqual([], self._save_calls())
+
+    def test_refresh_firewall_runs_iptables_save(self):
+        self.agent.refresh_firewall()
+        self.assertEqual(1, len(self._save_calls()))
+
+    def test_resync_runs_iptables_save(self):
+        self.agent.invalidate_firewall_state()
+        self.agent.setup_port_filters(set(['tap_port1']), set())
+        self.assertEqual(1, len(self._save_calls()))
+
+
 class TestSecurityGroupExtensionControl(base.BaseTestCase):
     def test_disable_security_group_extension_by_config(self):
         set_enable_security_groups(False)
@@ -53,6 +53,24 @@ class SGAgentRpcCallBackMixinTestCase(base.BaseTestCase):
         self.rpc.sg_agent.assert_has_calls(
             [mock.call.security_groups_member_updated(['fake_sgid'])])
 
+    def test_security_groups_rule_updated_with_deltas(self):
+        sequence = {'sender': 'fake_sender', 'number': 1}
+        self.rpc.security_groups_rule_updated(
+            None, security_groups=['fake_sgid'], rule_deltas={},
+            sequence=sequence)
+        self.rpc.sg_agent.assert_has_calls(
+            [mock.call.security_groups_rule_updated(
+                ['fake_sgid'], rule_deltas={}, sequence=sequence)])
+
+    def test_security_groups_member_updated_with_deltas(self):
+        sequence = {'sender': 'fake_sender', 'number': 1}
+        self.rpc.security_groups_member_updated(
+            None, security_groups=['fake_sgid'], member_deltas={},
+            sequence=sequence)
+        self.rpc.sg_agent.assert_has_calls(
+            [mock.call.security_groups_member_updated(
+                ['fake_sgid'], member_deltas={}, sequence=sequence)])
+
     def test_security_groups_provider_updated(self):
         self.rpc.security_groups_provider_updated(None)
         self.rpc.sg_agent.assert_has_calls(
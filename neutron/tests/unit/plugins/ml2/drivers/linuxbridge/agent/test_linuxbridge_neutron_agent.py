@@ -17,7 +17,9 @@ import sys
 
 import mock
 from oslo_config import cfg
+from oslo_serialization import jsonutils
 
+from neutron.agent.common import state_file
 from neutron.agent.linux import bridge_lib
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import utils
@@ -357,6 +359,62 @@ class TestCommonAgentLoop(base.BaseTestCase):
         self._test_scan_devices(previous, updated, fake_current, expected,
                                 sync=True)
 
+    def test_scan_devices_monitored_no_updates(self):
+        previous = {'current': set([1, 2]),
+                    'updated': set(),
+                    'added': set(),
+                    'removed': set()}
+        self.agent.device_monitor = mock.Mock(has_updates=False)
+        self.agent.rpc_callbacks.get_and_clear_updated_devices.return_value =\
+            set()
+        results = self.agent.scan_devices(previous, sync=False)
+        self.assertFalse(self.agent.mgr.get_all_devices.called)
+        self.assertEqual(set([1, 2]), results['current'])
+        self.assertEqual(set(), results['added'])
+
+    def test_scan_devices_monitored_updates(self):
+        previous = {'current': set([1, 2]),
+                    'updated': set(),
+                    'added': set(),
+                    'removed': set()}
+        fake_current = set([2, 3])
+        expected = {'current': set([2, 3]),
+                    'updated': set(),
+                    'added': set([3]),
+                    'removed': set([1])}
+        self.agent.device_monitor = mock.Mock(has_updates=True)
+        self._test_scan_devices(previous, set(), fake_current, expected,
+                                sync=False)
+        self.agent.device_monitor.get_events.assert_called_once_with()
+
+    def test_scan_devices_monitored_on_sync(self):
+        previous = {'current': set([1, 2]),
+                    'updated': set(),
+                    'added': set(),
+                    'removed': set()}
+        self.agent.device_monitor = mock.Mock(has_updates=False)
+        self.agent.mgr.get_all_devices.return_value = set([1, 2])
+        self.agent.rpc_callbacks.get_and_clear_updated_devices.return_value =\
+            set()
+        results = self.agent.scan_devices(previous, sync=True)
+        self.assertTrue(self.agent.mgr.get_all_devices.called)
+        self.assertEqual(set([1, 2]), results['added'])
+
+    def test_wait_for_devices(self):
+        with mock.patch.object(linuxbridge_neutron_agent.time,
+                               'sleep') as sleep:
+            self.agent._wait_for_devices(1.5)
+        sleep.assert_called_once_with(1.5)
+
+    def test_wait_for_devices_monitored(self):
+        self.agent.device_monitor = mock.Mock()
+        with mock.patch.object(linuxbridge_neutron_agent.time,
+                               'sleep') as sleep:
+            self.agent._wait_for_devices(1.5)
+        self.assertFalse(sleep.called)
+        self.agent.device_monitor.wait_for_events.assert_called_once_with(
+            1.5)
+
     def test_scan_devices_with_prevent_arp_spoofing_true(self):
         self.agent.prevent_arp_spoofing = True
         previous = None
@@ -410,6 +468,96 @@ class TestCommonAgentLoop(base.BaseTestCase):
         agent.treat_devices_added_updated(set(['tap1']))
         self.assertFalse(agent.mgr.ensure_port_admin_state.called)
 
+    def test_treat_devices_added_updated_restored_device(self):
+        agent = self.agent
+        mock_details = {'device': 'dev123',
+                        'port_id': 'port123',
+                        'network_id': 'net123',
+                        'admin_state_up': True,
+                        'network_type': 'vlan',
+                        'segmentation_id': 100,
+                        'physical_network': 'physnet1',
+                        'device_owner': constants.DEVICE_OWNER_NETWORK_PREFIX}
+        changed_details = dict(mock_details, device='dev456',
+                               admin_state_up=False)
+        agent.ext_manager = mock.Mock()
+        agent.plugin_rpc = mock.Mock()
+        agent.plugin_rpc.get_devices_details_list.return_value = [
+            mock_details, changed_details]
+        agent.mgr = mock.Mock()
+        agent.mgr.plug_interface.return_value = True
+        fingerprint = linuxbridge_neutron_agent.get_device_fingerprint(
+            mock_details)
+        agent.restored_devices = {'dev123': fingerprint,
+                                  'dev456': fingerprint}
+
+        agent.treat_devices_added_updated(set(['dev123', 'dev456']))
+
+        # only the device whose details changed is plugged again
+        agent.mgr.plug_interface.assert_called_once_with(
+            'net123', mock.ANY, 'dev456',
+            constants.DEVICE_OWNER_NETWORK_PREFIX)
+        agent.mgr.ensure_port_admin_state.assert_called_once_with(
+            'dev456', False)
+        agent.plugin_rpc.update_device_up.assert_called_once_with(
+            mock.ANY, 'dev123', mock.ANY, mock.ANY)
+        self.assertEqual({}, agent.restored_devices)
+        self.assertEqual(fingerprint,
+                         agent.device_states['dev123']['fingerprint'])
+        self.assertIn('dev456', agent.device_states)
+
+    def test_restore_device_state(self):
+        agent = self.agent
+        agent.device_state.path = '/tmp/device_state.json'
+        state = {'network_id': 'net123',
+                 'network_type': 'vlan',
+                 'physical_network': 'physnet1',
+                 'segmentation_id': 100,
+                 'fingerprint': 'fingerprint'}
+        persisted = {'devices': {'dev123': state,
+                                 'dev456': dict(state, network_id='net456')}}
+        agent.mgr.is_device_plugged.side_effect = (
+            lambda network_id, segment, device: network_id == 'net123')
+        with mock.patch.object(state_file, 'open',
+                               mock.mock_open(
+                                   read_data=jsonutils.dumps(persisted)),
+                               create=True):
+            agent.restore_device_state()
+        self.assertEqual({'dev123': 'fingerprint'}, agent.restored_devices)
+        self.assertEqual({'dev123': state}, agent.device_states)
+
+    def test_restore_device_state_no_file(self):
+        agent = self.agent
+        agent.device_state.path = '/tmp/device_state.json'
+        with mock.patch.object(state_file, 'open',
+                               side_effect=IOError(), create=True):
+            agent.restore_device_state()
+        self.assertEqual({}, agent.restored_devices)
+
+    def test_restore_device_state_invalid_file(self):
+        agent = self.agent
+        agent.device_state.path = '/tmp/device_state.json'
+        with mock.patch.object(state_file, 'open',
+                               mock.mock_open(
+                                   read_data=jsonutils.dumps({'devices': []})),
+                               create=True):
+            agent.restore_device_state()
+        self.assertEqual({}, agent.restored_devices)
+        self.assertFalse(agent.mgr.is_device_plugged.called)
+
+    def test_persist_device_state(self):
+        agent = self.agent
+        agent.device_state.path = '/tmp/device_state.json'
+        agent.device_states = {'dev123': {'network_id': 'net123'}}
+        with mock.patch.object(state_file.common_utils,
+                               'replace_file') as replace_file:
+            agent.persist_device_state()
+            # the device states did not change since they were persisted
+            agent.persist_device_state()
+        replace_file.assert_called_once_with(
+            '/tmp/device_state.json',
+            jsonutils.dumps({'devices': agent.device_states}))
+
     def test_treat_devices_added_updated_admin_state_up_true(self):
         agent = self.agent
         mock_details = {'device': 'dev123',
@@ -442,6 +590,8 @@ class TestCommonAgentLoop(base.BaseTestCase):
             self.assertFalse(resync_needed)
             agent.rpc_callbacks.add_network.assert_called_with('net123',
                                                                mock_segment)
+            agent.mgr.setup_networks.assert_called_once_with(
+                {'net123': mock_segment})
             agent.mgr.plug_interface.assert_called_with(
                 'net123', mock_segment, 'dev123',
                 constants.DEVICE_OWNER_NETWORK_PREFIX)
@@ -788,11 +938,16 @@ class TestLinuxBridgeManager(base.BaseTestCase):
             with mock.patch.object(self.lbm.ip,
                                    'add_vxlan') as add_vxlan_fn:
                 add_vxlan_fn.return_value = FakeIpDevice()
+                self.lbm.fdb_entries = {"vxlan-" + seg_id: {}}
+                self.lbm.neigh_entries = {"vxlan-" + seg_id: {}}
                 self.assertEqual("vxlan-" + seg_id,
                                  self.lbm.ensure_vxlan(seg_id))
                 add_vxlan_fn.assert_called_with("vxlan-" + seg_id, seg_id,
                                                 group="224.0.0.1",
                                                 dev=self.lbm.local_int)
+                # the entries of a previous interface are forgotten
+                self.assertEqual({}, self.lbm.fdb_entries)
+                self.assertEqual({}, self.lbm.neigh_entries)
                 cfg.CONF.set_override('l2_population', 'True', 'VXLAN')
                 self.assertEqual("vxlan-" + seg_id,
                                  self.lbm.ensure_vxlan(seg_id))
@@ -1000,6 +1155,80 @@ class TestLinuxBridgeManager(base.BaseTestCase):
     def test_add_tap_interface_owner_neutron(self):
         self._test_add_tap_interface(constants.DEVICE_OWNER_NEUTRON_PREFIX)
 
+    def test_add_tap_interface_waits_network_setup(self):
+        network_setup = mock.Mock()
+        network_setup.wait.return_value = "eth0.1"
+        self.lbm.network_setups = {"123": network_setup}
+        with mock.patch.object(ip_lib, "device_exists", return_value=True),\
+                mock.patch.object(self.lbm,
+                                  "ensure_physical_in_bridge") as ens_fn,\
+                mock.patch.object(self.lbm, "ensure_tap_mtu") as en_mtu_fn,\
+                mock.patch.object(bridge_lib.BridgeDevice,
+                                  "get_interface_bridge", return_value=True):
+            self.assertTrue(self.lbm.add_tap_interface(
+                "123", p_const.TYPE_VLAN, "physnet1", "1", "tap1",
+                constants.DEVICE_OWNER_NETWORK_PREFIX))
+        self.assertFalse(ens_fn.called)
+        en_mtu_fn.assert_called_once_with("tap1", "eth0.1")
+
+    def test_setup_networks_single_worker(self):
+        segment = amb.NetworkSegment(p_const.TYPE_VLAN, "physnet1", "1")
+        with mock.patch.object(self.lbm,
+                               "ensure_physical_in_bridge") as ens_fn:
+            self.lbm.setup_networks({"123": segment})
+        self.assertEqual({}, self.lbm.network_setups)
+        self.assertFalse(ens_fn.called)
+
+    def test_setup_networks(self):
+        self.lbm.network_setup_workers = 2
+        segments = {
+            "123": amb.NetworkSegment(p_const.TYPE_VLAN, "physnet1", "1"),
+            "456": amb.NetworkSegment(p_const.TYPE_VXLAN, None, "2"),
+            "789": amb.NetworkSegment(p_const.TYPE_LOCAL, None, None)}
+        with mock.patch.object(self.lbm, "_ensure_physical_in_bridge",
+                               side_effect=lambda network_id, *args:
+                               "dev-%s" % network_id) as ens_fn:
+            self.lbm.setup_networks(segments)
+            self.assertEqual(set(["123", "456"]),
+                             set(self.lbm.network_setups))
+            self.assertEqual(
+                "dev-123", self.lbm.network_setups["123"].wait())
+            self.assertEqual(
+                "dev-456", self.lbm.network_setups["456"].wait())
+        ens_fn.assert_has_calls(
+            [mock.call("123", p_const.TYPE_VLAN, "physnet1", "1"),
+             mock.call("456", p_const.TYPE_VXLAN, None, "2")],
+            any_order=True)
+
+    def test_is_device_plugged(self):
+        vlan_segment = amb.NetworkSegment(p_const.TYPE_VLAN, "physnet1", "1")
+        vxlan_segment = amb.NetworkSegment(p_const.TYPE_VXLAN, None, "2")
+        bridge = mock.Mock()
+        bridge.name = "brq123"
+        bridge.owns_interface.return_value = True
+        with mock.patch.object(bridge_lib.BridgeDevice,
+                               "get_interface_bridge",
+                               return_value=bridge):
+            self.assertTrue(
+                self.lbm.is_device_plugged("123", vlan_segment, "tap1"))
+            bridge.owns_interface.assert_called_with("eth1.1")
+            self.assertTrue(
+                self.lbm.is_device_plugged("123", vxlan_segment, "tap1"))
+            bridge.owns_interface.assert_called_with("vxlan-2")
+            # plugged into the bridge of another network
+            self.assertFalse(
+                self.lbm.is_device_plugged("456", vlan_segment, "tap1"))
+            bridge.owns_interface.return_value = False
+            self.assertFalse(
+                self.lbm.is_device_plugged("123", vlan_segment, "tap1"))
+
+    def test_is_device_plugged_not_in_bridge(self):
+        segment = amb.NetworkSegment(p_const.TYPE_FLAT, "physnet1", None)
+        with mock.patch.object(bridge_lib.BridgeDevice,
+                               "get_interface_bridge", return_value=None):
+            self.assertFalse(
+                self.lbm.is_device_plugged("123", segment, "tap1"))
+
     def test_plug_interface(self):
         segment = amb.NetworkSegment(p_const.TYPE_VLAN, "physnet-1", "1")
         with mock.patch.object(self.lbm, "add_tap_interface") as add_tap:
@@ -1141,6 +1370,127 @@ class TestLinuxBridgeManager(base.BaseTestCase):
             self.assertTrue(down_fn.called)
             self.assertTrue(delete_fn.called)
 
+    def test_delete_interface_clears_fdb_entries(self):
+        self.lbm.fdb_entries = {'vxlan-1': {'mac': set(['agent_ip'])}}
+        self.lbm.neigh_entries = {'vxlan-1': {'ip': 'mac'}}
+        with mock.patch.object(ip_lib.IPDevice, "exists",
+                               return_value=True),\
+                mock.patch.object(ip_lib.IpLinkCommand, "set_down"),\
+                mock.patch.object(ip_lib.IpLinkCommand, "delete"):
+            self.lbm.delete_interface("vxlan-1")
+        self.assertEqual({}, self.lbm.fdb_entries)
+        self.assertEqual({}, self.lbm.neigh_entries)
+
+    def test_fdb_entries_read_once(self):
+        fdb_output = ('00:00:00:00:00:00 dst 10.0.0.2 self permanent\n'
+                      '00:00:00:00:00:00 dst 10.0.0.3 self permanent\n'
+                      'fa:16:3e:00:00:01 dst 10.0.0.2 self permanent\n'
+                      'fa:16:3e:00:00:02 master brq1 permanent\n')
+        with mock.patch.object(utils, 'execute',
+                               return_value=fdb_output) as execute_fn:
+            self.assertTrue(self.lbm.fdb_bridge_entry_exists(
+                '00:00:00:00:00:00', 'vxlan-1', '10.0.0.3'))
+            self.assertTrue(self.lbm.fdb_bridge_entry_exists(
+                'fa:16:3e:00:00:02', 'vxlan-1'))
+            self.assertFalse(self.lbm.fdb_bridge_entry_exists(
+                'fa:16:3e:00:00:01', 'vxlan-1', '10.0.0.3'))
+            self.assertFalse(self.lbm.fdb_bridge_entry_exists(
+                'fa:16:3e:00:00:03', 'vxlan-1'))
+        execute_fn.assert_called_once_with(
+            ['bridge', 'fdb', 'show', 'dev', 'vxlan-1'], run_as_root=True)
+
+    def test_neigh_entries_read_once(self):
+        neigh_output = ('10.1.0.2 lladdr fa:16:3e:00:00:01 PERMANENT\n'
+                        '10.1.0.3  FAILED\n')
+        with mock.patch.object(utils, 'execute',
+                               return_value=neigh_output) as execute_fn:
+            self.assertTrue(self.lbm.fdb_ip_entry_exists(
+                'fa:16:3e:00:00:01', '10.1.0.2', 'vxlan-1'))
+            self.assertFalse(self.lbm.fdb_ip_entry_exists(
+                'fa:16:3e:00:00:02', '10.1.0.2', 'vxlan-1'))
+            self.assertFalse(self.lbm.fdb_ip_entry_exists(
+                'fa:16:3e:00:00:01', '10.1.0.3', 'vxlan-1'))
+        execute_fn.assert_called_once_with(
+            ['ip', 'neigh', 'show', 'dev', 'vxlan-1'], run_as_root=True)
+
+    def test_add_fdb_ip_entry_exists(self):
+        self.lbm.neigh_entries = {'vxlan-1': {'ip': 'mac'}}
+        with mock.patch.object(ip_lib.IpNeighCommand, 'add') as add_fn:
+            self.lbm.add_fdb_ip_entry('mac', 'ip', 'vxlan-1')
+            self.lbm.add_fdb_ip_entry('mac2', 'ip', 'vxlan-1')
+        # the entries are replaced even if known to exist
+        add_fn.assert_has_calls([mock.call('ip', 'mac'),
+                                 mock.call('ip', 'mac2')])
+        self.assertEqual({'vxlan-1': {'ip': 'mac2'}}, self.lbm.neigh_entries)
+
+    def test_add_fdb_ip_entry_not_read(self):
+        with mock.patch.object(ip_lib.IpNeighCommand, 'add') as add_fn,\
+                mock.patch.object(utils, 'execute') as execute_fn:
+            self.lbm.add_fdb_ip_entry('mac', 'ip', 'vxlan-1')
+        add_fn.assert_called_once_with('ip', 'mac')
+        self.assertFalse(execute_fn.called)
+        self.assertEqual({}, self.lbm.neigh_entries)
+
+    def test_clear_cache(self):
+        self.lbm.fdb_entries = {'vxlan-1': {'mac': set(['agent_ip'])}}
+        self.lbm.neigh_entries = {'vxlan-1': {'ip': 'mac'}}
+        self.lbm.clear_cache()
+        self.assertEqual({}, self.lbm.fdb_entries)
+        self.assertEqual({}, self.lbm.neigh_entries)
+
+    def test_apply_fdb_batch_not_supported(self):
+        batch = ['fdb add mac dev vxlan-1 dst agent_ip',
+                 'fdb del mac2 dev vxlan-1 dst agent_ip']
+        with mock.patch.object(ip_lib, 'iproute_arg_supported',
+                               return_value=False),\
+                mock.patch.object(utils, 'execute') as execute_fn:
+            self.lbm.apply_fdb_batch(batch)
+        execute_fn.assert_has_calls([
+            mock.call(['bridge', 'fdb', 'add', 'mac', 'dev', 'vxlan-1',
+                       'dst', 'agent_ip'],
+                      run_as_root=True),
+            mock.call(['bridge', 'fdb', 'del', 'mac2', 'dev', 'vxlan-1',
+                       'dst', 'agent_ip'],
+                      run_as_root=True)])
+
+    def test_apply_fdb_batch_failed(self):
+        batch = ['fdb add mac dev vxlan-1 dst agent_ip',
+                 'fdb del mac2 dev vxlan-2 dst agent_ip']
+        self.lbm.fdb_entries = {'vxlan-1': {}, 'vxlan-2': {}, 'vxlan-3': {}}
+        self.lbm.neigh_entries = {'vxlan-1': {}, 'vxlan-3': {}}
+        with mock.patch.object(ip_lib, 'iproute_arg_supported',
+                               return_value=True),\
+                mock.patch.object(utils, 'execute',
+                                  side_effect=RuntimeError()):
+            self.lbm.apply_fdb_batch(batch)
+        # the entries of the interfaces are read again when needed
+        self.assertEqual({'vxlan-3': {}}, self.lbm.fdb_entries)
+        self.assertEqual({'vxlan-3': {}}, self.lbm.neigh_entries)
+
+    def test_apply_fdb_batch_not_supported_failed(self):
+        batch = ['fdb add mac dev vxlan-1 dst agent_ip',
+                 'fdb del mac2 dev vxlan-2 dst agent_ip']
+        self.lbm.fdb_entries = {'vxlan-1': {}, 'vxlan-2': {}}
+        with mock.patch.object(ip_lib, 'iproute_arg_supported',
+                               return_value=False),\
+                mock.patch.object(utils, 'execute',
+                                  side_effect=[None, RuntimeError()]):
+            self.lbm.apply_fdb_batch(batch)
+        self.assertEqual({'vxlan-1': {}}, self.lbm.fdb_entries)
+
+    def test_fdb_batch_applied_on_error(self):
+        def _add_fdb_entry():
+            with self.lbm.fdb_batch() as batch:
+                self.lbm.add_fdb_bridge_entry('mac', 'agent_ip', 'vxlan-1',
+                                              batch=batch)
+                raise RuntimeError()
+
+        self.lbm.fdb_entries = {'vxlan-1': {}}
+        with mock.patch.object(self.lbm, 'apply_fdb_batch') as apply_fn:
+            self.assertRaises(RuntimeError, _add_fdb_entry)
+        apply_fn.assert_called_once_with(
+            ['fdb add mac dev vxlan-1 dst agent_ip'])
+
     def _check_vxlan_support(self, expected, vxlan_ucast_supported,
                              vxlan_mcast_supported):
         with mock.patch.object(self.lbm,
@@ -1352,6 +1702,9 @@ class TestLinuxBridgeRpcCallbacks(base.BaseTestCase):
 
         with mock.patch.object(utils, 'execute',
                                return_value='') as execute_fn, \
+                mock.patch.object(self.lb_rpc.agent.mgr,
+                                  'fdb_batch_supported',
+                                  return_value=True), \
                 mock.patch.object(ip_lib.IpNeighCommand, 'add',
                                   return_value='') as add_fn:
             self.lb_rpc.fdb_add(None, fdb_entries)
@@ -1359,19 +1712,44 @@ class TestLinuxBridgeRpcCallbacks(base.BaseTestCase):
             expected = [
                 mock.call(['bridge', 'fdb', 'show', 'dev', 'vxlan-1'],
                           run_as_root=True),
-                mock.call(['bridge', 'fdb', 'add',
-                           constants.FLOODING_ENTRY[0],
-                           'dev', 'vxlan-1', 'dst', 'agent_ip'],
-                          run_as_root=True,
-                          check_exit_code=False),
-                mock.call(['bridge', 'fdb', 'replace', 'port_mac', 'dev',
-                           'vxlan-1', 'dst', 'agent_ip'],
-                          run_as_root=True,
-                          check_exit_code=False),
+                mock.call(['bridge', '-force', '-batch', '-'],
+                          process_input='fdb add %s dev vxlan-1 dst agent_ip\n'
+                                        'fdb replace port_mac dev vxlan-1 '
+                                        'dst agent_ip\n' %
+                                        constants.FLOODING_ENTRY[0],
+                          run_as_root=True),
             ]
-            execute_fn.assert_has_calls(expected)
+            self.assertEqual(expected, execute_fn.call_args_list)
             add_fn.assert_called_with('port_ip', 'port_mac')
 
+    def test_fdb_add_several_agents(self):
+        fdb_entries = {'net_id':
+                       {'ports':
+                        {'agent_ip1': [constants.FLOODING_ENTRY],
+                         'agent_ip2': [constants.FLOODING_ENTRY]},
+                        'network_type': 'vxlan',
+                        'segment_id': 1}}
+        mgr = self.lb_rpc.agent.mgr
+        mgr.fdb_entries = {'vxlan-1': {}}
+
+        with mock.patch.object(utils, 'execute',
+                               return_value='') as execute_fn, \
+                mock.patch.object(mgr, 'fdb_batch_supported',
+                                  return_value=True):
+            self.lb_rpc.fdb_add(None, fdb_entries)
+
+        # a single command is run for the whole rpc
+        execute_fn.assert_called_once_with(
+            ['bridge', '-force', '-batch', '-'], process_input=mock.ANY,
+            run_as_root=True)
+        commands = execute_fn.call_args[1]['process_input'].splitlines()
+        self.assertEqual(['add', 'append'],
+                         sorted(command.split()[1] for command in commands))
+        self.assertEqual(
+            {'vxlan-1': {constants.FLOODING_ENTRY[0]:
+                         set(['agent_ip1', 'agent_ip2'])}},
+            mgr.fdb_entries)
+
     def test_fdb_ignore(self):
         fdb_entries = {'net_id':
                        {'ports':
@@ -1408,26 +1786,31 @@ class TestLinuxBridgeRpcCallbacks(base.BaseTestCase):
                                       ['port_mac', 'port_ip']]},
                         'network_type': 'vxlan',
                         'segment_id': 1}}
+        mgr = self.lb_rpc.agent.mgr
+        mgr.fdb_entries = {'vxlan-1': {
+            constants.FLOODING_ENTRY[0]: set(['agent_ip', 'agent_ip2']),
+            'port_mac': set(['agent_ip'])}}
+        mgr.neigh_entries = {'vxlan-1': {'port_ip': 'port_mac'}}
 
         with mock.patch.object(utils, 'execute',
                                return_value='') as execute_fn, \
+                mock.patch.object(mgr, 'fdb_batch_supported',
+                                  return_value=True), \
                 mock.patch.object(ip_lib.IpNeighCommand, 'delete',
                                   return_value='') as del_fn:
             self.lb_rpc.fdb_remove(None, fdb_entries)
 
-            expected = [
-                mock.call(['bridge', 'fdb', 'del',
-                           constants.FLOODING_ENTRY[0],
-                           'dev', 'vxlan-1', 'dst', 'agent_ip'],
-                          run_as_root=True,
-                          check_exit_code=False),
-                mock.call(['bridge', 'fdb', 'del', 'port_mac',
-                           'dev', 'vxlan-1', 'dst', 'agent_ip'],
-                          run_as_root=True,
-                          check_exit_code=False),
-            ]
-            execute_fn.assert_has_calls(expected)
+            execute_fn.assert_called_once_with(
+                ['bridge', '-force', '-batch', '-'],
+                process_input='fdb del %s dev vxlan-1 dst agent_ip\n'
+                              'fdb del port_mac dev vxlan-1 dst agent_ip\n' %
+                              constants.FLOODING_ENTRY[0],
+                run_as_root=True)
             del_fn.assert_called_with('port_ip', 'port_mac')
+        self.assertEqual(
+            {'vxlan-1': {constants.FLOODING_ENTRY[0]: set(['agent_ip2'])}},
+            mgr.fdb_entries)
+        self.assertEqual({'vxlan-1': {}}, mgr.neigh_entries)
 
     def test_fdb_update_chg_ip(self):
         fdb_entries = {'chg_ip':
@@ -1436,6 +1819,9 @@ class TestLinuxBridgeRpcCallbacks(base.BaseTestCase):
                          {'before': [['port_mac', 'port_ip_1']],
                           'after': [['port_mac', 'port_ip_2']]}}}}
 
+        self.lb_rpc.agent.mgr.neigh_entries = {
+            'vxlan-1': {'port_ip_1': 'port_mac'}}
+
         with mock.patch.object(ip_lib.IpNeighCommand, 'add',
                                return_value='') as add_fn, \
                 mock.patch.object(ip_lib.IpNeighCommand, 'delete',
@@ -78,13 +78,47 @@ class TestESwitchManagerApi(base.BaseTestCase):
             self.eswitch_mgr = esm.ESwitchManager()
             self.eswitch_mgr.discover_devices(device_mappings, None)
 
+    def _get_assigned_devices_info(self, link_state="enable"):
+        vf_details = {"vf": 0, "MAC": self.ASSIGNED_MAC,
+                      "link-state": link_state}
+        with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
+                        "eswitch_manager.EmbSwitch.get_assigned_vfs_details",
+                        return_value={self.PCI_SLOT: vf_details}),\
+                mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
+                           "pci_lib.PciDeviceIPWrapper."
+                           "get_macvtap_vf_interfaces",
+                           return_value=set()):
+            return self.eswitch_mgr.get_assigned_devices_info()
+
     def test_get_assigned_devices_info(self):
+        result = self._get_assigned_devices_info()
+        self.assertEqual(set([(self.ASSIGNED_MAC, self.PCI_SLOT)]), result)
+
+    def test_get_assigned_devices_info_caches_vfs(self):
+        self._get_assigned_devices_info(link_state="disable")
         with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
-                        "eswitch_manager.EmbSwitch.get_assigned_devices_info",
-                        return_value=[(self.ASSIGNED_MAC, self.PCI_SLOT)]):
-            result = self.eswitch_mgr.get_assigned_devices_info()
-            self.assertIn(self.ASSIGNED_MAC, list(result)[0])
-            self.assertIn(self.PCI_SLOT, list(result)[0])
+                        "eswitch_manager.EmbSwitch.get_pci_device")\
+                as get_pci_mock,\
+                mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
+                           "eswitch_manager.EmbSwitch.get_device_state")\
+                as get_state_mock:
+            self.assertTrue(self.eswitch_mgr.device_exists(
+                self.ASSIGNED_MAC, self.PCI_SLOT))
+            self.assertFalse(self.eswitch_mgr.device_exists(
+                self.ASSIGNED_MAC, "0000:06:00.2"))
+            self.assertFalse(self.eswitch_mgr.get_device_state(
+                self.ASSIGNED_MAC, self.PCI_SLOT))
+            self.assertFalse(get_pci_mock.called)
+            self.assertFalse(get_state_mock.called)
+
+    def test_set_device_state_updates_cache(self):
+        self._get_assigned_devices_info(link_state="disable")
+        with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
+                        "eswitch_manager.EmbSwitch.set_device_state"):
+            self.eswitch_mgr.set_device_state(self.ASSIGNED_MAC,
+                                              self.PCI_SLOT, True)
+        self.assertTrue(self.eswitch_mgr.get_device_state(
+            self.ASSIGNED_MAC, self.PCI_SLOT))
 
     def test_get_device_status_true(self):
         with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
@@ -252,8 +286,10 @@ class TestEmbSwitch(base.BaseTestCase):
     def test_get_assigned_devices_info(self, *args):
         emb_switch = esm.EmbSwitch(self.PHYS_NET, self.DEV_NAME, ())
         with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent.pci_lib."
-                        "PciDeviceIPWrapper.get_assigned_macs",
-                        return_value={0: self.ASSIGNED_MAC}),\
+                        "PciDeviceIPWrapper.get_vfs_details",
+                        return_value={0: {"vf": 0,
+                                          "MAC": self.ASSIGNED_MAC,
+                                          "link-state": "enable"}}),\
                 mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
                            "eswitch_manager.PciOsWrapper.is_assigned_vf",
                            return_value=True):
@@ -266,9 +302,12 @@ class TestEmbSwitch(base.BaseTestCase):
                 return_value=SCANNED_DEVICES)
     def test_get_assigned_devices_info_multiple_slots(self, *args):
         emb_switch = esm.EmbSwitch(self.PHYS_NET, self.DEV_NAME, ())
+        vfs_details = {vf_index: {"vf": vf_index, "MAC": mac,
+                                  "link-state": "enable"}
+                       for vf_index, mac in self.VF_TO_MAC_MAPPING.items()}
         with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent.pci_lib."
-                        "PciDeviceIPWrapper.get_assigned_macs",
-                        return_value=self.VF_TO_MAC_MAPPING),\
+                        "PciDeviceIPWrapper.get_vfs_details",
+                        return_value=vfs_details) as get_vfs_mock,\
                 mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
                            "eswitch_manager.PciOsWrapper.is_assigned_vf",
                            return_value=True):
@@ -278,6 +317,8 @@ class TestEmbSwitch(base.BaseTestCase):
                 pci_slot = device_info[1]
                 self.assertEqual(
                     self.EXPECTED_MAC_TO_PCI[mac], pci_slot)
+            # a single ip link show lists the VFs of the device
+            get_vfs_mock.assert_called_once_with()
 
     def test_get_assigned_devices_empty(self):
         with mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent."
@@ -476,6 +517,17 @@ class TestPciOsWrapper(base.BaseTestCase):
         esm.PciOsWrapper.is_assigned_vf(self.DEV_NAME, self.VF_INDEX)
         mock_is_macvtap_assigned.called_with(self.VF_INDEX, "eth0")
 
+    @mock.patch("os.listdir", return_value=["eth0", "eth1"])
+    @mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent.pci_lib."
+                "PciDeviceIPWrapper.is_macvtap_assigned")
+    def test_is_assigned_vf_macvtap_interfaces(
+        self, mock_is_macvtap_assigned, *args):
+        self.assertTrue(esm.PciOsWrapper.is_assigned_vf(
+            self.DEV_NAME, self.VF_INDEX, set(["eth1"])))
+        self.assertFalse(esm.PciOsWrapper.is_assigned_vf(
+            self.DEV_NAME, self.VF_INDEX, set(["eth2"])))
+        self.assertFalse(mock_is_macvtap_assigned.called)
+
     @mock.patch("os.listdir", side_effect=OSError())
     @mock.patch("neutron.plugins.ml2.drivers.mech_sriov.agent.pci_lib."
                 "PciDeviceIPWrapper.is_macvtap_assigned")
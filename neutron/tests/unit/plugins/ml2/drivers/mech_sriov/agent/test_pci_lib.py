@@ -70,6 +70,26 @@ class TestPciLib(base.BaseTestCase):
                               self.pci_wrapper.get_assigned_macs,
                               [self.VF_INDEX])
 
+    def test_get_vfs_details(self):
+        with mock.patch.object(self.pci_wrapper,
+                               "_as_root") as mock_as_root:
+            mock_as_root.return_value = self.VF_LINK_SHOW
+            result = self.pci_wrapper.get_vfs_details()
+            mock_as_root.assert_called_once_with(
+                [], "link", ("show", self.DEV_NAME))
+            self.assertEqual(
+                {index: {"vf": index, "MAC": mac,
+                         "link-state": "disable" if index == 0 else "enable"}
+                 for index, mac in self.MAC_MAPPING.items()},
+                result)
+
+    def test_get_vfs_details_fail(self):
+        with mock.patch.object(self.pci_wrapper,
+                               "_as_root") as mock_as_root:
+            mock_as_root.side_effect = Exception()
+            self.assertRaises(exc.IpCommandDeviceError,
+                              self.pci_wrapper.get_vfs_details)
+
     def test_get_vf_state_enable(self):
         with mock.patch.object(self.pci_wrapper,
                                "_as_root") as mock_as_root:
@@ -163,6 +183,14 @@ class TestPciLib(base.BaseTestCase):
             self.assertFalse(
                 pci_lib.PciDeviceIPWrapper.is_macvtap_assigned('enp129s0f2'))
 
+    def test_get_macvtap_vf_interfaces(self):
+        with mock.patch.object(pci_lib.PciDeviceIPWrapper,
+                               "_execute") as mock_exec:
+            mock_exec.return_value = self.IP_LINK_SHOW_WITH_MACVTAP
+            self.assertEqual(
+                set(['enp129s0f1']),
+                pci_lib.PciDeviceIPWrapper.get_macvtap_vf_interfaces())
+
     def test_is_macvtap_assigned_failed(self):
         with mock.patch.object(pci_lib.PciDeviceIPWrapper,
                                "_execute") as mock_exec:
@@ -83,6 +83,32 @@ class OVSIntegrationBridgeTest(ovs_bridge_test_base.OVSBridgeTestBase):
         ]
         self.assertEqual(expected, self.mock.mock_calls)
 
+    def test_provision_local_vlan_cookie(self):
+        port = 999
+        lvid = 888
+        segmentation_id = 777
+        self.br.provision_local_vlan(port=port, lvid=lvid,
+                                     segmentation_id=segmentation_id,
+                                     cookie=1234)
+        (dp, ofp, ofpp) = self._get_dp()
+        expected = [
+            call._send_msg(ofpp.OFPFlowMod(dp,
+                cookie=1234,
+                instructions=[
+                    ofpp.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, [
+                        ofpp.OFPActionSetField(
+                            vlan_vid=lvid | ofp.OFPVID_PRESENT),
+                        ofpp.OFPActionOutput(ofp.OFPP_NORMAL, 0)
+                    ]),
+                ],
+                match=ofpp.OFPMatch(
+                    in_port=port,
+                    vlan_vid=segmentation_id | ofp.OFPVID_PRESENT),
+                priority=3,
+                table_id=0)),
+        ]
+        self.assertEqual(expected, self.mock.mock_calls)
+
     def test_provision_local_vlan_novlan(self):
         port = 999
         lvid = 888
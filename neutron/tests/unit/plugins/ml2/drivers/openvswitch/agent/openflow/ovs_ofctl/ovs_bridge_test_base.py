@@ -16,6 +16,7 @@
 
 import mock
 
+from neutron.agent.common import ovs_lib
 from neutron.common import constants
 from neutron.tests.unit.plugins.ml2.drivers.openvswitch.agent \
     import ovs_test_base
@@ -90,6 +91,62 @@ class OVSBridgeTestBase(ovs_test_base.OVSOFCtlTestBase):
             self.br.dump_flows_all_tables()
             run_ofctl.assert_has_calls([mock.call("dump-flows", [])])
 
+    def _cleanup_flows(self, claimed_flows, kept_cookies=()):
+        self.br.set_agent_uuid_stamp(1234)
+        flows = [
+            " cookie=0x4d2, duration=2.1s, table=0, priority=2,in_port=5 "
+            "actions=drop",
+            " cookie=0x1, duration=9.5s, table=0, priority=2,in_port=6 "
+            "actions=drop",
+            " cookie=0x1, duration=9.5s, table=0, priority=2,in_port=7 "
+            "actions=drop",
+            " cookie=0x1, duration=9.5s, table=3, priority=1 actions=drop",
+            " cookie=0x2, duration=9.5s, table=0, priority=3,in_port=8 "
+            "actions=drop"]
+        claimed_flows = set(ovs_lib.get_flow_key(flows[i])
+                            for i in claimed_flows)
+        with mock.patch.object(self.br, 'dump_flows_all_tables',
+                               return_value=flows), \
+                mock.patch.object(self.br, 'stop_flow_mirror',
+                                  return_value=claimed_flows), \
+                mock.patch.object(self.br, 'run_ofctl') as run_ofctl, \
+                mock.patch.object(self.br,
+                                  'do_action_flows') as do_action_flows:
+            self.br.cleanup_flows(kept_cookies)
+        return run_ofctl, do_action_flows
+
+    def test_cleanup_flows(self):
+        run_ofctl, do_action_flows = self._cleanup_flows([])
+        do_action_flows.assert_called_once_with('del', [
+            {'cookie': '0x1/-1', 'table': '0'},
+            {'cookie': '0x1/-1', 'table': '3'},
+            {'cookie': '0x2/-1', 'table': '0'}])
+        self.assertFalse(run_ofctl.called)
+
+    def test_cleanup_flows_keeps_kept_cookies(self):
+        run_ofctl, do_action_flows = self._cleanup_flows([], {2})
+        do_action_flows.assert_called_once_with('del', [
+            {'cookie': '0x1/-1', 'table': '0'},
+            {'cookie': '0x1/-1', 'table': '3'}])
+
+    def test_dump_flow_cookies(self):
+        flows = [
+            "NXST_FLOW reply (xid=0x4):",
+            " cookie=0x4d2, duration=2.1s, table=0, priority=2,in_port=5 "
+            "actions=drop",
+            " cookie=0x1, duration=9.5s, table=3, priority=1 actions=drop"]
+        with mock.patch.object(self.br, 'dump_flows_all_tables',
+                               return_value=flows):
+            self.assertEqual({1234, 1}, self.br.dump_flow_cookies())
+
+    def test_cleanup_flows_keeps_claimed_flows(self):
+        run_ofctl, do_action_flows = self._cleanup_flows([1])
+        run_ofctl.assert_called_once_with(
+            'del-flows', ['--strict', '-'],
+            'table=0,priority=2,in_port=7\ntable=3,priority=1\n'
+            'table=0,priority=3,in_port=8')
+        self.assertFalse(do_action_flows.called)
+
 
 class OVSDVRProcessTestMixin(object):
     def test_install_dvr_process_ipv4(self):
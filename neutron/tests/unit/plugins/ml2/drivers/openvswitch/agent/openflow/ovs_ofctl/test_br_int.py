@@ -51,6 +51,21 @@ class OVSIntegrationBridgeTest(ovs_bridge_test_base.OVSBridgeTestBase):
         ]
         self.assertEqual(expected, self.mock.mock_calls)
 
+    def test_provision_local_vlan_cookie(self):
+        port = 999
+        lvid = 888
+        segmentation_id = 777
+        self.br.provision_local_vlan(port=port, lvid=lvid,
+                                     segmentation_id=segmentation_id,
+                                     cookie=1234)
+        expected = [
+            call.add_flow(priority=3, dl_vlan=segmentation_id,
+                          in_port=port,
+                          actions='mod_vlan_vid:%s,normal' % lvid,
+                          cookie=1234),
+        ]
+        self.assertEqual(expected, self.mock.mock_calls)
+
     def test_provision_local_vlan_novlan(self):
         port = 999
         lvid = 888
@@ -15,14 +15,17 @@
 import sys
 import time
 
+import eventlet
 import mock
 from oslo_config import cfg
 from oslo_log import log
 import oslo_messaging
+from oslo_serialization import jsonutils
 import testtools
 
 from neutron._i18n import _
 from neutron.agent.common import ovs_lib
+from neutron.agent.common import state_file
 from neutron.agent.common import utils
 from neutron.agent.linux import async_process
 from neutron.agent.linux import ip_lib
@@ -259,6 +262,165 @@ class TestOvsNeutronAgent(object):
     def test_restore_local_vlan_map_segmentation_id_compat(self):
         self._test_restore_local_vlan_maps(2, segmentation_id='None')
 
+    def _test_restore_local_vlan_state(self, state, tag=2, cookies=()):
+        path = self.get_temp_file_path('local_vlans.json')
+        with open(path, 'w') as f:
+            f.write(jsonutils.dumps({'networks': state}))
+        self.agent.local_vlan_state.path = path
+        self.agent.int_ofports = {'physnet1': 5}
+        port = mock.Mock(port_name='fake_port', vif_id='fake_vif')
+        with mock.patch.object(self.agent, 'int_br') as int_br:
+            int_br.dump_flow_cookies.return_value = set(cookies)
+            int_br.get_vif_ports.return_value = [port]
+            int_br.get_ports_attributes.return_value = [{
+                'name': port.port_name,
+                'other_config': {'net_uuid': 'fake_network_id'},
+                'tag': tag
+            }]
+            self.agent._restore_local_vlan_map()
+
+    def test_restore_local_vlan_state(self):
+        self._test_restore_local_vlan_state(
+            {'fake_network_id': {'vlan': 2, 'network_type': 'vlan',
+                                 'physical_network': 'physnet1',
+                                 'segmentation_id': 1000,
+                                 'vif_ports': ['fake_vif']}})
+        lvm = self.agent._restored_local_vlans['fake_network_id']
+        self.assertEqual((2, 'vlan', 'physnet1', 1000),
+                         (lvm.vlan, lvm.network_type, lvm.physical_network,
+                          lvm.segmentation_id))
+        self.assertIsNone(lvm.cookie)
+
+    def test_restore_local_vlan_state_flows_installed(self):
+        self._test_restore_local_vlan_state(
+            {'fake_network_id': {'vlan': 2, 'network_type': 'vlan',
+                                 'physical_network': 'physnet1',
+                                 'segmentation_id': 1000,
+                                 'vif_ports': ['fake_vif'],
+                                 'cookie': 1234, 'int_ofport': 5}},
+            cookies=[1234])
+        lvm = self.agent._restored_local_vlans['fake_network_id']
+        self.assertEqual(1234, lvm.cookie)
+
+    def test_restore_local_vlan_state_flows_missing(self):
+        self._test_restore_local_vlan_state(
+            {'fake_network_id': {'vlan': 2, 'network_type': 'vlan',
+                                 'physical_network': 'physnet1',
+                                 'segmentation_id': 1000,
+                                 'vif_ports': ['fake_vif'],
+                                 'cookie': 1234, 'int_ofport': 5}},
+            cookies=[4321])
+        lvm = self.agent._restored_local_vlans['fake_network_id']
+        self.assertIsNone(lvm.cookie)
+
+    def test_restore_local_vlan_state_ofport_changed(self):
+        self._test_restore_local_vlan_state(
+            {'fake_network_id': {'vlan': 2, 'network_type': 'vlan',
+                                 'physical_network': 'physnet1',
+                                 'segmentation_id': 1000,
+                                 'vif_ports': ['fake_vif'],
+                                 'cookie': 1234, 'int_ofport': 6}},
+            cookies=[1234])
+        lvm = self.agent._restored_local_vlans['fake_network_id']
+        self.assertIsNone(lvm.cookie)
+
+    def test_restore_local_vlan_state_tag_changed(self):
+        self._test_restore_local_vlan_state(
+            {'fake_network_id': {'vlan': 3, 'network_type': 'vlan',
+                                 'physical_network': 'physnet1',
+                                 'segmentation_id': 1000,
+                                 'vif_ports': ['fake_vif']}})
+        self.assertEqual({}, self.agent._restored_local_vlans)
+
+    def test_restore_local_vlan_state_invalid_mapping(self):
+        self._test_restore_local_vlan_state(
+            {'fake_network_id': {'vlan': 2, 'vif_ports': ['fake_vif']}})
+        self.assertEqual({}, self.agent._restored_local_vlans)
+
+    def test_persist_local_vlan_state(self):
+        self.agent.local_vlan_state.path = self.get_temp_file_path(
+            'local_vlans.json')
+        self.agent.int_ofports = {'physnet1': 5}
+        self.agent.local_vlan_map = {
+            'net1': self.mod_agent.LocalVLANMapping(2, 'vlan', 'physnet1',
+                                                    1000, {'vif1': None},
+                                                    cookie=1234)}
+        with mock.patch.object(state_file.common_utils,
+                               'replace_file') as replace_file:
+            self.agent.persist_local_vlan_state()
+            self.agent.persist_local_vlan_state()
+        replace_file.assert_called_once_with(
+            self.agent.local_vlan_state.path, mock.ANY)
+        self.assertEqual(
+            {'networks': {'net1': {'vlan': 2, 'network_type': 'vlan',
+                                   'physical_network': 'physnet1',
+                                   'segmentation_id': 1000,
+                                   'vif_ports': ['vif1'],
+                                   'cookie': 1234, 'int_ofport': 5}}},
+            jsonutils.loads(replace_file.call_args[0][1]))
+
+    def test_provision_local_vlan_reclaims_changed_restored_network(self):
+        self.agent._restored_local_vlans = {
+            'net1': self.mod_agent.LocalVLANMapping(2, 'vlan', 'physnet1',
+                                                    1000)}
+        self.agent._local_vlan_hints = {'net1': 2}
+        with mock.patch.object(self.agent,
+                               'reclaim_local_vlan') as reclaim_local_vlan:
+            self.agent.provision_local_vlan('net1', 'vlan', 'physnet1',
+                                            1001)
+        reclaim_local_vlan.assert_called_once_with('net1')
+        self.assertNotIn('net1', self.agent._local_vlan_hints)
+
+    def test_provision_local_vlan_keeps_unchanged_restored_network(self):
+        self.agent._restored_local_vlans = {
+            'net1': self.mod_agent.LocalVLANMapping(2, 'vlan', 'physnet1',
+                                                    1000)}
+        self.agent._local_vlan_hints = {'net1': 2}
+        with mock.patch.object(self.agent,
+                               'reclaim_local_vlan') as reclaim_local_vlan:
+            self.agent.provision_local_vlan('net1', 'vlan', 'physnet1',
+                                            1000)
+        self.assertFalse(reclaim_local_vlan.called)
+        self.assertEqual(2, self.agent.local_vlan_map['net1'].vlan)
+
+    def _provision_restored_network(self, cookie):
+        self.agent._restored_local_vlans = {
+            'net1': self.mod_agent.LocalVLANMapping(2, 'vlan', 'physnet1',
+                                                    1000, cookie=cookie)}
+        self.agent._local_vlan_hints = {'net1': 2}
+        phys_br = mock.Mock()
+        self.agent.phys_brs = {'physnet1': phys_br}
+        self.agent.phys_ofports = {'physnet1': 6}
+        self.agent.int_ofports = {'physnet1': 5}
+        with mock.patch.object(self.agent, 'int_br') as int_br:
+            self.agent.provision_local_vlan('net1', 'vlan', 'physnet1',
+                                            1000)
+        # the physical bridges flows are deleted when the agent starts
+        phys_br.provision_local_vlan.assert_called_once_with(
+            port=6, lvid=2, segmentation_id=1000, distributed=False)
+        return int_br
+
+    def test_provision_local_vlan_keeps_restored_flows(self):
+        int_br = self._provision_restored_network(1234)
+        self.assertFalse(int_br.provision_local_vlan.called)
+        self.assertEqual(1234, self.agent.local_vlan_map['net1'].cookie)
+
+    def test_provision_local_vlan_restored_flows_missing(self):
+        int_br = self._provision_restored_network(None)
+        cookie = self.agent.local_vlan_map['net1'].cookie
+        self.assertIsNotNone(cookie)
+        int_br.provision_local_vlan.assert_called_once_with(
+            port=5, lvid=2, segmentation_id=1000, cookie=cookie)
+
+    def test_cleanup_stale_flows_keeps_network_flows(self):
+        self.agent.local_vlan_map = {
+            'net1': self.mod_agent.LocalVLANMapping(2, 'vlan', 'physnet1',
+                                                    1000, cookie=1234),
+            'net2': self.mod_agent.LocalVLANMapping(3, 'local', None, None)}
+        with mock.patch.object(self.agent, 'int_br') as int_br:
+            self.agent.cleanup_stale_flows()
+        int_br.cleanup_flows.assert_called_once_with({1234})
+
     def test_check_agent_configurations_for_dvr_raises(self):
         self.agent.enable_distributed_routing = True
         self.agent.enable_tunneling = True
@@ -763,6 +925,60 @@ class TestOvsNeutronAgent(object):
             self.assertEqual(set([dev_mock]), failed_devices.get('added'))
             self.assertFalse(treat_vif_port.called)
 
+    def test_treat_devices_added_updated_in_parallel(self):
+        self.agent.device_processing_workers = 2
+        devices = [{'device': 'dev%d' % i, 'network_id': 'net%d' % (i % 2)}
+                   for i in range(6)]
+        treated = []
+
+        def fake_treat_device(details, *args):
+            eventlet.sleep(0)
+            treated.append(details['device'])
+
+        with mock.patch.object(self.agent.plugin_rpc,
+                               'get_devices_details_list_and_failed_devices',
+                               return_value={'devices': devices,
+                                             'failed_devices': []}),\
+                mock.patch.object(self.agent.int_br, 'get_vifs_by_ids',
+                                  return_value={}),\
+                mock.patch.object(self.agent,
+                                  '_treat_device_added_or_updated',
+                                  side_effect=fake_treat_device):
+            self.agent.treat_devices_added_or_updated([], False)
+        self.assertEqual(['dev0', 'dev2', 'dev4'],
+                         [d for d in treated if int(d[-1]) % 2 == 0])
+        self.assertEqual(['dev1', 'dev3', 'dev5'],
+                         [d for d in treated if int(d[-1]) % 2 == 1])
+        self.assertEqual(
+            6, self.agent.get_port_stats({}, {})['regular']['treated'])
+
+    def test_treat_devices_added_updated_in_parallel_error(self):
+        self.agent.device_processing_workers = 2
+        devices = [{'device': 'dev%d' % i, 'network_id': 'net%d' % (i % 2)}
+                   for i in range(6)]
+        treated = []
+
+        def fake_treat_device(details, *args):
+            if details['device'] == 'dev0':
+                raise RuntimeError()
+            eventlet.sleep(0)
+            treated.append(details['device'])
+
+        with mock.patch.object(self.agent.plugin_rpc,
+                               'get_devices_details_list_and_failed_devices',
+                               return_value={'devices': devices,
+                                             'failed_devices': []}),\
+                mock.patch.object(self.agent.int_br, 'get_vifs_by_ids',
+                                  return_value={}),\
+                mock.patch.object(self.agent,
+                                  '_treat_device_added_or_updated',
+                                  side_effect=fake_treat_device):
+            self.assertRaises(RuntimeError,
+                              self.agent.treat_devices_added_or_updated,
+                              [], False)
+        # the error is raised once the other networks are treated
+        self.assertEqual(['dev1', 'dev3', 'dev5'], treated)
+
     def test_treat_devices_added_updated_put_port_down(self):
         fake_details_dict = {'admin_state_up': False,
                              'port_id': 'xxx',
@@ -877,6 +1093,26 @@ class TestOvsNeutronAgent(object):
     def test_process_network_port_with_empty_port(self):
         self._test_process_network_ports({})
 
+    def test_process_network_ports_applies_flow_bundles(self):
+        self.agent.use_flow_bundles = True
+        port_info = {'current': set(['tap0']), 'added': set(['tap0'])}
+        parent = mock.Mock()
+        with mock.patch.object(self.agent.sg_agent, "setup_port_filters"),\
+                mock.patch.object(self.agent,
+                                  "treat_devices_added_or_updated",
+                                  return_value=([], [], [], set())),\
+                mock.patch.object(self.agent.int_br,
+                                  "apply_flow_bundle") as apply_bundle,\
+                mock.patch.object(self.agent, "_bind_devices",
+                                  return_value=set()) as bind_devices:
+            parent.attach_mock(apply_bundle, 'apply_flow_bundle')
+            parent.attach_mock(bind_devices, '_bind_devices')
+            self.agent.process_network_ports(port_info, False)
+        # the flows are applied before the ports are reported up
+        self.assertEqual([mock.call.apply_flow_bundle(),
+                          mock.call._bind_devices([])],
+                         parent.mock_calls)
+
     def test_process_network_ports_with_insecure_ports(self):
         port_info = {'current': set(['tap0', 'tap1']),
                      'updated': set(['tap1']),
@@ -1321,10 +1557,10 @@ class TestOvsNeutronAgent(object):
                 mock.call.deferred().__enter__(),
                 deferred_br_call.delete_arp_responder('vlan2', FAKE_IP1),
                 deferred_br_call.delete_unicast_to_tun('vlan2', FAKE_MAC),
-                deferred_br_call.install_flood_to_tun('vlan2', 'seg2',
-                                                      set(['1'])),
                 deferred_br_call.delete_port('gre-02020202'),
                 deferred_br_call.cleanup_tunnel_port('2'),
+                deferred_br_call.install_flood_to_tun('vlan2', 'seg2',
+                                                      set(['1'])),
                 mock.call.deferred().__exit__(None, None, None),
             ]
             br_tun.assert_has_calls(expected_calls)
@@ -1338,15 +1574,60 @@ class TestOvsNeutronAgent(object):
                                                                FAKE_IP1)]}}}
         with mock.patch.object(self.agent, 'tun_br', autospec=True) as tun_br,\
                 mock.patch.object(self.agent,
-                                  '_setup_tunnel_port') as add_tun_fn:
+                                  '_setup_tunnel_ports') as add_tun_fn,\
+                mock.patch.object(self.agent, '_setup_tunnel_port'):
             self.agent.fdb_add(None, fdb_entry)
             self.assertFalse(add_tun_fn.called)
             fdb_entry['net1']['ports']['10.10.10.10'] = [
                 l2pop_rpc.PortInfo(FAKE_MAC, FAKE_IP1)]
+            fdb_entry['net2'] = {
+                'network_type': 'gre',
+                'segment_id': 'tun2',
+                'ports': {'10.10.10.10': [n_const.FLOODING_ENTRY],
+                          '10.10.10.11': [n_const.FLOODING_ENTRY]}}
+            self.agent.fdb_add(None, fdb_entry)
+            add_tun_fn.assert_called_once_with(
+                tun_br, {'10.10.10.10': 'gre-0a0a0a0a',
+                         '10.10.10.11': 'gre-0a0a0a0b'}, 'gre')
+
+    def test_fdb_add_flows_aggregated(self):
+        self._prepare_l2_pop_ofports()
+        fdb_entry = {'net1':
+                     {'network_type': 'gre',
+                      'segment_id': 'tun1',
+                      'ports':
+                      {'1.1.1.1': [n_const.FLOODING_ENTRY],
+                       '2.2.2.2': [l2pop_rpc.PortInfo(FAKE_MAC, FAKE_IP1),
+                                   n_const.FLOODING_ENTRY]}},
+                     'net2':
+                     {'network_type': 'gre',
+                      'segment_id': 'tun2',
+                      'ports':
+                      {'1.1.1.1': [n_const.FLOODING_ENTRY],
+                       '2.2.2.2': [n_const.FLOODING_ENTRY]}}}
+        with mock.patch.object(self.agent, 'tun_br', autospec=True) as tun_br:
             self.agent.fdb_add(None, fdb_entry)
-            deferred_br = tun_br.deferred().__enter__()
-            add_tun_fn.assert_called_with(
-                deferred_br, 'gre-0a0a0a0a', '10.10.10.10', 'gre')
+        tun_br.deferred.assert_called_once_with()
+        deferred_br = tun_br.deferred().__enter__()
+        # net2 already floods to both tunnels
+        deferred_br.install_flood_to_tun.assert_called_once_with(
+            'vlan1', 'seg1', set(['1', '2']))
+        deferred_br.install_unicast_to_tun.assert_called_once_with(
+            'vlan1', 'seg1', '2', FAKE_MAC)
+
+    def test_fdb_del_flows_aggregated(self):
+        self._prepare_l2_pop_ofports()
+        fdb_entry = {'net2':
+                     {'network_type': 'gre',
+                      'segment_id': 'tun2',
+                      'ports': {'1.1.1.1': [n_const.FLOODING_ENTRY],
+                                '2.2.2.2': [n_const.FLOODING_ENTRY]}}}
+        with mock.patch.object(self.agent, 'tun_br', autospec=True) as tun_br,\
+                mock.patch.object(self.agent, 'cleanup_tunnel_port'):
+            self.agent.fdb_remove(None, fdb_entry)
+        deferred_br = tun_br.deferred().__enter__()
+        self.assertFalse(deferred_br.install_flood_to_tun.called)
+        deferred_br.delete_flood_to_tun.assert_called_once_with('vlan2')
 
     def test_fdb_del_port(self):
         self._prepare_l2_pop_ofports()
@@ -1478,14 +1759,15 @@ class TestOvsNeutronAgent(object):
                                return_value=fake_tunnel_details),\
                 mock.patch.object(
                     self.agent,
-                    '_setup_tunnel_port') as _setup_tunnel_port_fn,\
+                    '_setup_tunnel_ports') as _setup_tunnel_ports_fn,\
                 mock.patch.object(self.agent,
                                   'cleanup_stale_flows') as cleanup:
             self.agent.tunnel_types = ['vxlan']
             self.agent.tunnel_sync()
-            expected_calls = [mock.call(self.agent.tun_br, 'vxlan-64651f0f',
-                                        '100.101.31.15', 'vxlan')]
-            _setup_tunnel_port_fn.assert_has_calls(expected_calls)
+            expected_calls = [mock.call(self.agent.tun_br,
+                                        {'100.101.31.15': 'vxlan-64651f0f'},
+                                        'vxlan')]
+            _setup_tunnel_ports_fn.assert_has_calls(expected_calls)
             self.assertEqual([], cleanup.mock_calls)
 
     def test_tunnel_sync_invalid_ip_address(self):
@@ -1496,17 +1778,46 @@ class TestOvsNeutronAgent(object):
                                return_value=fake_tunnel_details),\
                 mock.patch.object(
                     self.agent,
-                    '_setup_tunnel_port') as _setup_tunnel_port_fn,\
+                    '_setup_tunnel_ports') as _setup_tunnel_ports_fn,\
                 mock.patch.object(self.agent,
                                   'cleanup_stale_flows') as cleanup:
             self.agent.tunnel_types = ['vxlan']
             self.agent.tunnel_sync()
-            _setup_tunnel_port_fn.assert_called_once_with(self.agent.tun_br,
-                                                          'vxlan-64646464',
-                                                          '100.100.100.100',
-                                                          'vxlan')
+            _setup_tunnel_ports_fn.assert_called_once_with(
+                self.agent.tun_br, {'100.100.100.100': 'vxlan-64646464'},
+                'vxlan')
             self.assertEqual([], cleanup.mock_calls)
 
+    def test_setup_tunnel_ports(self):
+        self.agent.l2_pop = False
+        self.agent.local_vlan_map = {
+            'net1': self.mod_agent.LocalVLANMapping(1, 'vxlan', None, 100)}
+        tunnels = {'10.0.0.2': 'vxlan-0a000002',
+                   '10.0.0.3': 'vxlan-0a000003'}
+        with mock.patch.object(self.agent.tun_br, 'add_tunnel_ports',
+                               return_value={
+                                   'vxlan-0a000002': 5,
+                                   'vxlan-0a000003': ovs_lib.INVALID_OFPORT}
+                               ) as add_tunnel_ports,\
+                mock.patch.object(self.agent.tun_br,
+                                  'deferred') as deferred,\
+                mock.patch.object(self.mod_agent.LOG, 'error') as log_error:
+            deferred_br = deferred.return_value.__enter__.return_value
+            self.agent._setup_tunnel_ports(self.agent.tun_br, tunnels,
+                                           'vxlan')
+        add_tunnel_ports.assert_called_once_with(
+            {'vxlan-0a000002': '10.0.0.2', 'vxlan-0a000003': '10.0.0.3'},
+            self.agent.local_ip, 'vxlan', self.agent.vxlan_udp_port,
+            self.agent.dont_fragment, self.agent.tunnel_csum)
+        self.assertEqual({'10.0.0.2': 5},
+                         self.agent.tun_br_ofports['vxlan'])
+        deferred_br.setup_tunnel_port.assert_called_once_with('vxlan', 5)
+        deferred_br.install_flood_to_tun.assert_called_once_with(
+            1, 100, mock.ANY)
+        self.assertEqual(
+            [5], list(deferred_br.install_flood_to_tun.call_args[0][2]))
+        self.assertEqual(1, log_error.call_count)
+
     def test_tunnel_update(self):
         kwargs = {'tunnel_ip': '10.10.10.10',
                   'tunnel_type': 'gre'}
@@ -1804,6 +2115,15 @@ class TestOvsNeutronAgent(object):
         self.agent._setup_tunnel_port(bridge, 1, 2, tunnel_type=tunnel_type)
         self.assertIn('bar', self.agent.local_vlan_map)
 
+    def test_loop_count_and_wait_completes_timed_iteration(self):
+        self.agent.polling_interval = 0
+        port_stats = {'regular': {'added': 1}}
+        with mock.patch.object(self.agent.loop_timer,
+                               'complete_iteration') as complete_iteration:
+            self.agent.loop_count_and_wait(time.time(), port_stats)
+        complete_iteration.assert_called_once_with(
+            self.agent.iter_num - 1, mock.ANY, port_stats)
+
     def test_setup_entry_for_arp_reply_ignores_ipv6_addresses(self):
         self.agent.arp_responder_enabled = True
         ip = '2001:db8::1'
@@ -1821,7 +2141,7 @@ class TestOvsNeutronAgentOFCtl(TestOvsNeutronAgent,
             mock.patch.object(self.agent.int_br,
                               'dump_flows_all_tables') as dump_flows,\
                 mock.patch.object(self.agent.int_br,
-                                  'delete_flows') as del_flow:
+                                  'do_action_flows') as do_action_flows:
             dump_flows.return_value = [
                 'cookie=0x4d2, duration=50.156s, table=0,actions=drop',
                 'cookie=0x4321, duration=54.143s, table=2, priority=0',
@@ -1830,11 +2150,19 @@ class TestOvsNeutronAgentOFCtl(TestOvsNeutronAgent,
             ]
             self.agent.iter_num = 3
             self.agent.cleanup_stale_flows()
-            expected = [
-                mock.call(cookie='0x4321/-1', table='2'),
-                mock.call(cookie='0x2345/-1', table='2'),
-            ]
-            self.assertEqual(expected, del_flow.mock_calls)
+            do_action_flows.assert_called_once_with('del', [
+                {'cookie': '0x4321/-1', 'table': '2'},
+                {'cookie': '0x2345/-1', 'table': '2'},
+            ])
+
+    def test_rpc_loop_loads_flow_mirrors(self):
+        self.agent.mirror_installed_flows = True
+        with mock.patch.object(self.agent.int_br,
+                               'load_flow_mirror') as load_flow_mirror,\
+                mock.patch.object(self.agent, '_check_and_handle_signal',
+                                  return_value=False):
+            self.agent.rpc_loop(polling_manager=mock.Mock())
+        load_flow_mirror.assert_called_once_with()
 
 
 class TestOvsNeutronAgentRyu(TestOvsNeutronAgent,
@@ -2154,6 +2482,7 @@ class TestOvsDvrNeutronAgent(object):
                     port=int_ofp,
                     lvid=lvid,
                     segmentation_id=segmentation_id,
+                    cookie=mock.ANY,
                 ),
             ] + self._expected_port_bound(self._port, lvid)
             self.assertEqual(expected_on_int_br, int_br.mock_calls)
@@ -2231,7 +2560,8 @@ class TestOvsDvrNeutronAgent(object):
                     network_type=network_type,
                     segmentation_id=segmentation_id,
                     lvid=lvid,
-                    distributed=True),
+                    distributed=True,
+                    cookie=mock.ANY),
             ] + self._expected_install_dvr_process(
                 port=self._port,
                 lvid=lvid,
@@ -2346,6 +2676,7 @@ class TestOvsDvrNeutronAgent(object):
                     lvid=lvid,
                     segmentation_id=None,
                     distributed=True,
+                    cookie=mock.ANY,
                 ),
             ]
             self.assertEqual(expected_on_tun_br, tun_br.mock_calls)
@@ -2425,7 +2756,8 @@ class TestOvsDvrNeutronAgent(object):
                                  int_br.mock_calls)
                 expected_on_tun_br = [
                     mock.call.provision_local_vlan(network_type='vxlan',
-                        lvid=lvid, segmentation_id=None, distributed=True),
+                        lvid=lvid, segmentation_id=None, distributed=True,
+                        cookie=mock.ANY),
                 ] + self._expected_install_dvr_process(
                     port=self._port,
                     lvid=lvid,
@@ -2526,7 +2858,8 @@ class TestOvsDvrNeutronAgent(object):
                     network_type='vxlan',
                     segmentation_id=None,
                     lvid=lvid,
-                    distributed=True),
+                    distributed=True,
+                    cookie=mock.ANY),
             ] + self._expected_install_dvr_process(
                 port=self._port,
                 lvid=lvid,
@@ -2649,6 +2982,7 @@ class TestOvsDvrNeutronAgent(object):
                     lvid=lvid,
                     segmentation_id=None,
                     distributed=True,
+                    cookie=mock.ANY,
                 ),
             ]
             self.assertEqual(expected_on_tun_br, tun_br.mock_calls)
@@ -324,7 +324,8 @@ class TunnelTest(object):
             mock.call.provision_local_vlan(
                 network_type=p_const.TYPE_GRE,
                 lvid=LV_ID,
-                segmentation_id=LS_ID),
+                segmentation_id=LS_ID,
+                cookie=mock.ANY),
         ]
 
         a = self._build_agent()
@@ -344,7 +345,8 @@ class TunnelTest(object):
             mock.call.provision_local_vlan(
                 port=self.INT_OFPORT,
                 lvid=LV_ID,
-                segmentation_id=None))
+                segmentation_id=None,
+                cookie=mock.ANY))
 
         a = self._build_agent()
         a.available_local_vlans = set([LV_ID])
@@ -370,7 +372,8 @@ class TunnelTest(object):
             mock.call.provision_local_vlan(
                 port=self.INT_OFPORT,
                 lvid=LV_ID,
-                segmentation_id=LS_ID))
+                segmentation_id=LS_ID,
+                cookie=mock.ANY))
         a = self._build_agent()
         a.available_local_vlans = set([LV_ID])
         a.phys_brs['net1'] = self.mock_map_tun_bridge
@@ -0,0 +1,84 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.tests.common import firewall_benchmark
+from neutron.tests import base
+
+
+class FakeIptablesTestCase(base.BaseTestCase):
+
+    def test_restore_then_save(self):
+        iptables = firewall_benchmark.FakeIptables()
+        iptables.restore('*filter\n'
+                         ':test-chain - [0:0]\n'
+                         '-I test-chain 1 -j DROP\n'
+                         '-I test-chain 1 -j ACCEPT\n'
+                         '-I INPUT 1 -j test-chain\n'
+                         'COMMIT\n')
+        self.assertEqual(3, iptables.rule_count())
+        lines = iptables.save('filter').splitlines()
+        self.assertIn(':test-chain - [0:0]', lines)
+        self.assertIn(':INPUT ACCEPT [0:0]', lines)
+        self.assertLess(lines.index('-A test-chain -j ACCEPT'),
+                        lines.index('-A test-chain -j DROP'))
+
+        iptables.restore('*filter\n'
+                         '-D INPUT 1\n'
+                         '-X test-chain\n'
+                         'COMMIT\n')
+        self.assertEqual(0, iptables.rule_count())
+        self.assertNotIn('test-chain', iptables.save())
+
+
+class FirewallBenchmarkTestCase(base.BaseTestCase):
+
+    def _run(self, **kwargs):
+        topology = firewall_benchmark.Topology(
+            ports=4, groups=2, rules=3, remote_groups=1, members=2)
+        results = firewall_benchmark.run(topology, **kwargs)
+        return dict((result.step, result) for result in results)
+
+    def test_run(self):
+        results = self._run()
+        self.assertEqual(
+            {'prepare', 'refresh', 'rule_update', 'member_update'},
+            set(results))
+        self.assertGreater(results['prepare'].restore_bytes, 0)
+        self.assertGreater(results['prepare'].rules, 0)
+        # nothing changed, so there is nothing to restore
+        self.assertEqual(0, results['refresh'].restore_calls)
+        self.assertEqual(1, results['rule_update'].restore_calls)
+        self.assertGreater(results['rule_update'].rules,
+                           results['refresh'].rules)
+
+    def test_run_without_ipset(self):
+        results = self._run(enable_ipset=False)
+        # remote members are expanded into the port chains
+        self.assertEqual(1, results['member_update'].restore_calls)
+
+    def test_run_traces_memory_separately(self):
+        with mock.patch.object(firewall_benchmark,
+                               'tracemalloc') as tracemalloc,\
+                mock.patch.object(
+                    firewall_benchmark, 'FakeExecute',
+                    side_effect=firewall_benchmark.FakeExecute) as execute:
+            tracemalloc.is_tracing.return_value = True
+            tracemalloc.get_traced_memory.return_value = (0, 2048)
+            results = self._run()
+        # the steps are run twice, only the second run is traced
+        self.assertEqual(2, execute.call_count)
+        self.assertEqual(4, tracemalloc.start.call_count)
+        self.assertEqual(
+            set([2]), set(result.peak_memory_kb
+                          for result in results.values()))